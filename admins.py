@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+from telegram.ext import filters
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 5.0
+
+# Версия списка админов хранится в базе и растёт триггерами на любое изменение таблицы admins,
+# поэтому все процессы, работающие с одним stats.db, видят изменения без рестарта
+# (таблица meta и триггеры создаются миграцией, см. migrations._admin_meta)
+
+
+def _read_version(conn) -> int:
+    row = conn.execute("SELECT value FROM meta WHERE key = 'admins_version'").fetchone()
+    return row[0] if row else 0
+
+
+def _read_admins(conn):
+    version = _read_version(conn)
+    return version, {row[0] for row in conn.execute('SELECT user_id FROM admins')}
+
+
+class AdminCache:
+    # Проверка прав — обычный поиск в set; фильтр хендлера обновляется на месте
+
+    def __init__(self, storage, interval: float = REFRESH_INTERVAL):
+        self.storage = storage
+        self.interval = interval
+        self.ids = frozenset()
+        self.version = None
+        self.filter = filters.User(allow_empty=False)
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.ids
+
+    def load(self):
+        # Синхронная загрузка при старте, до запуска event loop
+        self._apply(*self.storage.run_sync(_read_admins))
+
+    async def refresh(self, force: bool = False) -> bool:
+        # Дешёвая проверка: одна строка из meta; сам список читаем только если версия сменилась
+        if not force and await self.storage.run(_read_version) == self.version:
+            return False
+        self._apply(*await self.storage.run(_read_admins))
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Не удалось обновить список админов: {e}")
+
+    def _apply(self, version: int, ids: set):
+        added, removed = ids - self.ids, self.ids - ids
+        if added:
+            self.filter.add_user_ids(added)
+        if removed:
+            self.filter.remove_user_ids(removed)
+        self.ids = frozenset(ids)
+        self.version = version
+        if added or removed:
+            logger.info(f"Загружено админов: {len(self.ids)} (версия {version})")
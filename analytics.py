@@ -0,0 +1,114 @@
+import html
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from bots import DEFAULT_BOT
+
+DASHBOARD_PERIODS = ((1, "Сегодня"), (7, "7 дней"), (30, "30 дней"))
+TOP_COMMANDS = 5
+LOOKUP_CHUNK = 500
+
+# Агрегаты ведутся инкрементально при сбросе телеметрии, поэтому панель
+# читает несколько строк за период, а не сканирует всю историю command_stats.
+# Таблицы агрегатов и их заполнение по истории — миграция migrations._analytics_rollups
+#
+# Все дни в статистике считаются по UTC, как CURRENT_TIMESTAMP и date('now') в SQLite:
+# события, активность, новые пользователи и «сегодня» панели попадают в один и тот же день
+
+UPSERT_HOURLY_SQL = '''
+    INSERT INTO stats_hourly (bot, hour, command, n) VALUES (?, ?, ?, ?)
+    ON CONFLICT(bot, hour, command) DO UPDATE SET n = n + excluded.n
+'''
+UPSERT_DAILY_SQL = '''
+    INSERT INTO stats_daily (bot, date, command, n) VALUES (?, ?, ?, ?)
+    ON CONFLICT(bot, date, command) DO UPDATE SET n = n + excluded.n
+'''
+UPSERT_ACTIVE_SQL = '''
+    INSERT INTO daily_active_users (bot, date, n) VALUES (?, ?, ?)
+    ON CONFLICT(bot, date) DO UPDATE SET n = n + excluded.n
+'''
+UPSERT_NEW_USERS_SQL = '''
+    INSERT INTO daily_new_users (bot, date, n) VALUES (?, date('now'), 1)
+    ON CONFLICT(bot, date) DO UPDATE SET n = n + 1
+'''
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def update_command_rollups(conn, events):
+    # events — строки command_stats: (bot, user_id, command, 'YYYY-MM-DD HH:MM:SS')
+    hourly, daily = Counter(), Counter()
+    for bot, _, command, timestamp in events:
+        hourly[(bot, timestamp[:13], command)] += 1
+        daily[(bot, timestamp[:10], command)] += 1
+    conn.executemany(UPSERT_HOURLY_SQL, [(*key, n) for key, n in hourly.items()])
+    conn.executemany(UPSERT_DAILY_SQL, [(*key, n) for key, n in daily.items()])
+
+
+def new_active_users(conn, activity_keys) -> Counter:
+    # Сколько пользователей из пачки впервые активны в свой день; вызывается до записи user_activity.
+    # activity_keys — (bot, user_id, day), результат — по (bot, day)
+    by_day = defaultdict(list)
+    for bot, user_id, day in activity_keys:
+        by_day[(bot, day)].append(user_id)
+    first_actions = Counter()
+    for (bot, day), user_ids in by_day.items():
+        for i in range(0, len(user_ids), LOOKUP_CHUNK):
+            chunk = user_ids[i:i + LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            existing = conn.execute(
+                f'SELECT COUNT(*) FROM user_activity WHERE bot = ? AND date = ? AND user_id IN ({placeholders})',
+                (bot, day, *chunk)
+            ).fetchone()[0]
+            first_actions[(bot, day)] += len(chunk) - existing
+    return first_actions
+
+
+def update_active_rollup(conn, first_actions: Counter):
+    conn.executemany(UPSERT_ACTIVE_SQL, [(bot, day, n) for (bot, day), n in first_actions.items() if n])
+
+
+def record_new_user(conn, bot: str = DEFAULT_BOT):
+    conn.execute(UPSERT_NEW_USERS_SQL, (bot,))
+
+
+def dashboard(conn, today: date, bot: str = DEFAULT_BOT) -> list:
+    periods = []
+    for days, title in DASHBOARD_PERIODS:
+        since = (today - timedelta(days=days - 1)).isoformat()
+        new_users = conn.execute(
+            'SELECT COALESCE(SUM(n), 0) FROM daily_new_users WHERE bot = ? AND date >= ?', (bot, since)
+        ).fetchone()[0]
+        # Уникальные активные за период: индекс по (bot, date, user_id), объём зависит только от окна
+        active = conn.execute(
+            'SELECT COUNT(DISTINCT user_id) FROM user_activity WHERE bot = ? AND date >= ?', (bot, since)
+        ).fetchone()[0]
+        daily_active = conn.execute(
+            'SELECT COALESCE(SUM(n), 0) FROM daily_active_users WHERE bot = ? AND date >= ?', (bot, since)
+        ).fetchone()[0]
+        taps = conn.execute(
+            'SELECT COALESCE(SUM(n), 0) FROM stats_daily WHERE bot = ? AND date >= ?', (bot, since)
+        ).fetchone()[0]
+        top = conn.execute(
+            '''SELECT command, SUM(n) AS total FROM stats_daily WHERE bot = ? AND date >= ?
+               GROUP BY command ORDER BY total DESC LIMIT ?''', (bot, since, TOP_COMMANDS)
+        ).fetchall()
+        periods.append((title, days, new_users, active, round(daily_active / days), taps, top))
+    return periods
+
+
+def format_dashboard(periods) -> str:
+    parts = ["<b>📊 Статистика бота</b>"]
+    for title, days, new_users, active, average_dau, taps, top in periods:
+        lines = [f"\n<b>{title}</b>",
+                 f"👤 Новые пользователи: {new_users}",
+                 f"🔥 Активные пользователи: {active}"]
+        if days > 1:
+            lines.append(f"📈 Средний DAU: {average_dau}")
+        lines.append(f"👆 Нажатия: {taps}")
+        if top:
+            lines.append("🏆 Топ: " + ", ".join(f"{html.escape(command)} ({n})" for command, n in top))
+        parts.append("\n".join(lines))
+    return "\n".join(parts)
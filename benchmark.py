@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from telegram import Update
+from telegram.ext import Application
+
+import bot
+from broadcast import Broadcaster, BroadcastStats, TokenBucket, make_sender
+from fake_bot_api import BOT_USER, FakeBotApi
+from menu import MAIN_MENU
+from telemetry import TelemetryBuffer
+
+logger = logging.getLogger(__name__)
+
+# Нагрузочный прогон без сети: бот из bot.py работает против FakeBotApi, синтетические
+# пользователи жмут /start и ходят по меню. Результат — JSON, который можно сравнить
+# с прошлым прогоном:
+#   python benchmark.py --users 2000 --output bench.json
+#   python benchmark.py --users 2000 --baseline bench.json
+
+BENCH_TOKEN = '123456:BENCHMARK'
+FIRST_USER_ID = 10_000_000
+
+# Метрики для сравнения с базовым прогоном: путь в JSON и что считается улучшением
+COMPARED_METRICS = (
+    (('handlers', 'start', 'p95_ms'), 'lower'),
+    (('handlers', 'menu', 'p95_ms'), 'lower'),
+    (('handlers', 'menu', 'p99_ms'), 'lower'),
+    (('updates_per_second',), 'higher'),
+    (('db', 'rows_per_second'), 'higher'),
+    (('broadcast', 'messages_per_second'), 'higher'),
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота против локального Bot API")
+    parser.add_argument('--users', type=int, default=1000, help="число синтетических пользователей")
+    parser.add_argument('--clicks', type=int, default=10, help="нажатий в меню на пользователя")
+    parser.add_argument('--concurrency', type=int, default=50, help="пользователей одновременно")
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка ответа Bot API, c")
+    parser.add_argument('--jitter', type=float, default=0.01, help="разброс задержки, c")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument('--db-events', type=int, default=20000, help="событий для замера записи в базу")
+    parser.add_argument('--broadcast', type=int, default=300, help="получателей тестовой рассылки")
+    parser.add_argument('--broadcast-rate', type=float, default=None, help="лимит рассылки, сообщений/с")
+    parser.add_argument('--flood', action='store_true', help="не отключать защиту от флуда")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help="каталог для временной базы (по умолчанию tmp)")
+    parser.add_argument('--output', help="куда записать JSON с результатами")
+    parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="допустимое ухудшение, доля")
+    return parser.parse_args(argv)
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    cuts = statistics.quantiles(ordered, n=100, method='inclusive') if len(ordered) > 1 else [ordered[0]] * 99
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+# ================== СИНТЕТИЧЕСКИЕ АПДЕЙТЫ ==================
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+
+def start_update(user_id: int) -> dict:
+    return {
+        'update_id': 0,
+        'message': {
+            'message_id': 0, 'date': int(time.time()), 'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+            'chat': {'id': user_id, 'type': 'private'}, 'from': _user(user_id),
+        },
+    }
+
+
+def callback_update(user_id: int, message_id: int, data: str) -> dict:
+    return {
+        'update_id': 0,
+        'callback_query': {
+            'id': f'{user_id}-{message_id}-{time.monotonic_ns()}', 'chat_instance': str(user_id), 'data': data,
+            'from': _user(user_id),
+            'message': {'message_id': message_id, 'date': int(time.time()), 'text': '…',
+                        'chat': {'id': user_id, 'type': 'private'}, 'from': BOT_USER},
+        },
+    }
+
+
+def menu_targets(registry) -> dict:
+    # Куда можно перейти с каждого экрана: только callback-кнопки, ведущие на экраны меню
+    targets = {}
+    for screen_id in registry:
+        screen = registry.get(screen_id)
+        targets[screen_id] = [button.callback_data for row in screen.markup.inline_keyboard
+                              for button in row if button.callback_data and button.callback_data in registry]
+    return targets
+
+
+# ================== ФАЗЫ ==================
+
+async def replay_users(application, api: FakeBotApi, options) -> dict:
+    rng = random.Random(options.seed)
+    targets = menu_targets(bot.menu)
+    latencies = {'start': [], 'menu': []}
+    errors = 0
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    async def process(kind: str, data: dict):
+        nonlocal errors
+        update = Update.de_json(data, application.bot)
+        started = time.perf_counter()
+        try:
+            await application.process_update(update)
+        except Exception as e:
+            errors += 1
+            logger.debug(f"Ошибка обработки апдейта: {e}")
+        latencies[kind].append(time.perf_counter() - started)
+
+    async def user_session(user_id: int, clicks):
+        async with semaphore:
+            await process('start', start_update(user_id))
+            # Последнее сообщение в чате — главное меню, дальше пользователь редактирует его кнопками
+            message_id = api.last_message_id(user_id)
+            for data in clicks:
+                await process('menu', callback_update(user_id, message_id, data))
+
+    sessions = []
+    for i in range(options.users):
+        screen, clicks = MAIN_MENU, []
+        for _ in range(options.clicks):
+            # Иногда пользователь жмёт ту же кнопку повторно — такие нажатия бот отсекает локально
+            screen = screen if rng.random() < 0.05 else rng.choice(targets[screen] or [MAIN_MENU])
+            clicks.append(screen)
+        sessions.append(user_session(FIRST_USER_ID + i, clicks))
+
+    started = time.perf_counter()
+    await asyncio.gather(*sessions)
+    elapsed = time.perf_counter() - started
+    updates = sum(len(samples) for samples in latencies.values())
+    return {
+        'handlers': {kind: percentiles(samples) for kind, samples in latencies.items()},
+        'updates': updates,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_second': round(updates / elapsed, 1) if elapsed else None,
+    }
+
+
+async def measure_db_writes(options) -> dict:
+    # Отдельный буфер без таймера: копим события и меряем одну запись пачкой
+    rng = random.Random(options.seed)
+    commands = list(bot.menu)
+    buffer = TelemetryBuffer(bot.db, flush_interval=3600, max_events=options.db_events + 1)
+    for _ in range(options.db_events):
+        buffer.record(FIRST_USER_ID + rng.randrange(max(options.users, 1)), rng.choice(commands))
+    started = time.perf_counter()
+    await buffer.flush()
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': options.db_events,
+        'flush_s': round(elapsed, 4),
+        'rows_per_second': round(options.db_events / elapsed, 1) if elapsed else None,
+    }
+
+
+async def measure_broadcast(application, api: FakeBotApi, options) -> dict:
+    rate = options.broadcast_rate
+    bucket = TokenBucket(rate) if rate else TokenBucket()
+    stats = BroadcastStats(options.broadcast)
+    send = make_sender({'type': 'text', 'text': 'Бенчмарк рассылки'})
+    recipients = range(FIRST_USER_ID, FIRST_USER_ID + options.broadcast)
+    started = time.perf_counter()
+    await Broadcaster(application.bot, bucket).run(recipients, send, stats)
+    elapsed = time.perf_counter() - started
+    return {
+        'recipients': options.broadcast,
+        'rate_limit': bucket.rate,
+        'sent': stats.sent,
+        'failed': stats.failed,
+        'blocked': stats.blocked,
+        'retries': stats.retries,
+        'elapsed_s': round(elapsed, 3),
+        'messages_per_second': round(stats.sent / elapsed, 1) if elapsed else None,
+    }
+
+
+async def run_benchmark(options) -> dict:
+    api = FakeBotApi(latency=options.latency, jitter=options.jitter,
+                     rate_limit_ratio=options.rate_limit, seed=options.seed)
+    await api.start()
+    application = (
+        Application.builder()
+        .token(BENCH_TOKEN)
+        .base_url(api.base_url)
+        .connection_pool_size(max(options.concurrency, 1) + 8)
+        .build()
+    )
+    bot.register_handlers(application)
+    if not options.flood:
+        # Синтетические пользователи жмут без пауз; иначе большая часть нажатий отсеется лимитом
+        bot.flood.limits = {}
+    await application.initialize()
+    await bot.telemetry.start()
+    try:
+        results = {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'config': {name: value for name, value in vars(options).items()
+                       if name not in ('output', 'baseline', 'workdir')},
+        }
+        results.update(await replay_users(application, api, options))
+        await bot.telemetry.flush()
+        results['api_calls'] = dict(api.counts)
+        results['api_rate_limited'] = dict(api.rate_limited)
+        results['db'] = await measure_db_writes(options)
+        results['broadcast'] = await measure_broadcast(application, api, options) if options.broadcast else None
+        return results
+    finally:
+        await bot.telemetry.stop()
+        await application.shutdown()
+        await api.stop()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    # Список ухудшений относительно базового прогона больше чем на tolerance
+    regressions = []
+    for path, better in COMPARED_METRICS:
+        current, previous = results, baseline
+        for key in path:
+            current = (current or {}).get(key)
+            previous = (previous or {}).get(key)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = change > tolerance if better == 'lower' else change < -tolerance
+        if worse:
+            regressions.append(f"{'.'.join(path)}: {previous} → {current} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    # Каждый запрос к Bot API httpx пишет в INFO — на тысячах пользователей это шум
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('broadcast').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory(dir=options.workdir) as workdir:
+        # Своя база, чтобы прогон не трогал боевой stats.db
+        bot.db.path = os.path.join(workdir, 'stats.db')
+        bot.db.open()
+        try:
+            bot.db.run_sync(bot.init_db)
+            bot.admins.load()
+            results = asyncio.run(run_benchmark(options))
+        finally:
+            bot.db.close()
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if options.baseline:
+        with open(options.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for line in regressions:
+            print(f"⚠️ Регрессия: {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
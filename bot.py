@@ -1,11 +1,38 @@
+import asyncio
 import logging
 import os
-import sqlite3
+import signal
+import time
 from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from functools import partial
+
+# Время старта процесса — для замера холодного запуска в логах
+STARTED_AT = time.perf_counter()
+
+from telegram import Update, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaPhoto, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import BadRequest
+from telegram.ext import Application, ApplicationHandlerStop, ChatMemberHandler, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, TypeHandler, filters
 from dotenv import load_dotenv
 
+import jobstore
+from admins import AdminCache
+from analytics import dashboard, format_dashboard, record_new_user, utc_today
+from bots import DEFAULT_BOT, parse_bots
+from broadcast import Broadcaster, BroadcastStats, TokenBucket, make_sender, message_payload, progress_editor
+from charts import ChartService, charts_supported, render_chart, upsert_conversions
+from export import EXPORT_HINT, ExportStats, export_filename, export_table, parse_export_args
+from flood import FloodControl, parse_limits, update_kind
+from jobs import JobManager
+from menu import MAIN_MENU, MenuRegistry, RenderTracker
+from metrics import InstrumentedRequest, Metrics, MetricsServer
+from migrations import migrate
+from persistence import SqlitePersistence
+from processor import ChatOrderedProcessor
+from retention import RetentionWorker, enable_incremental_vacuum
+from segments import SEGMENT_HINT, SEGMENT_PRESETS, count_recipients, describe_segment, parse_segment, segment_sql
+from storage import DB_PATH, Storage
+from telemetry import TelemetryBuffer
+
 # Загружаем переменные из .env файла
 load_dotenv()
 
@@ -17,140 +44,174 @@ logger = logging.getLogger(__name__)
 
 # Константы из .env
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# Несколько ботов (брендов) в одном процессе: BOTS="main=токен,brand2=токен2".
+# Без BOTS работает один бот с BOT_TOKEN. Первый бот — основной: он загружает графики
+BOT_CONFIGS = parse_bots(os.getenv("BOTS", ""), BOT_TOKEN)
+BOT_NAMES = {token: name for name, token in BOT_CONFIGS}
+PRIMARY_BOT = BOT_CONFIGS[0][0] if BOT_CONFIGS else DEFAULT_BOT
+
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "0"))
 
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный https-адрес, который регистрируется в Telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Без WEBHOOK_SECRET бот сам генерирует секрет при запуске и регистрирует его вместе с WEBHOOK_URL
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Сколько дней сырые события command_stats живут в базе до переноса в архив
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+# Локальный эндпоинт метрик в формате Prometheus; 0 — выключен (сводка остаётся в /metrics)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Лимиты частоты запросов одного пользователя, например "callback=2/6,command=0.5/3"
+# (токенов в секунду / размер пачки); не указанные классы берут значения по умолчанию
+FLOOD_LIMITS = os.getenv("FLOOD_LIMITS", "")
+
+# Сколько апдейтов обрабатывается одновременно (разные чаты параллельно, один чат — по порядку)
+# и сколько апдейтов одного чата может ждать своей очереди
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+UPDATE_QUEUE_PER_CHAT = int(os.getenv("UPDATE_QUEUE_PER_CHAT", "20"))
+
 # ⚠️ ЗАМЕНИТЕ ЭТОТ ID НА СВОЙ!
 INITIAL_ADMIN_ID = 7727813191
 
-# Глобальный набор админов (загружается из БД)
-ADMIN_IDS = set()
+# Экраны меню; файл MENU_FILE, если он есть, подменяет встроенные экраны на лету
+MENU_FILE = os.getenv("MENU_FILE", "menu.json")
+menu = MenuRegistry(path=MENU_FILE)
+# Какой экран показан в каком сообщении; message_id у каждого бота свои, поэтому трекер на бота
+renders = {}
+
+# Задержки хендлеров и базы, вызовы Bot API
+metrics = Metrics()
+
 
 # ================== БАЗА ДАННЫХ ==================
 
-def init_db():
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            first_seen DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS groups (
-            chat_id INTEGER PRIMARY KEY,
-            title TEXT,
-            added_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS admins (
-            user_id INTEGER PRIMARY KEY
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS command_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            command TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_activity (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            date DATE,
-            actions_count INTEGER DEFAULT 1,
-            UNIQUE(user_id, date)
+# Общее хранилище: одно соединение в отдельном потоке, handlers только await'ят
+db = Storage(DB_PATH, timer=metrics.db_timer)
+telemetry = TelemetryBuffer(db)
+
+# Графики Click2Reg/Reg2Dep: рендерятся в фоне, загружаются в чат ADMIN_CHAT_ID один раз
+charts = ChartService(db, ADMIN_CHAT_ID or INITIAL_ADMIN_ID, render=render_chart if charts_supported() else None)
+
+# Архивация и удаление старых событий
+retention = RetentionWorker(db, days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR)
+
+# Кэш админов (загружается из БД и сверяется с версией в таблице meta)
+admins = AdminCache(db)
+
+# Запущенные боты по имени и их обработчики апдейтов (заполняются в build_application)
+applications = {}
+processors = {}
+
+def bot_name(bot) -> str:
+    # Имя бота, от которого пришёл апдейт: им помечаются строки базы
+    return BOT_NAMES.get(bot.token, DEFAULT_BOT)
+
+def rendered_for(name: str) -> RenderTracker:
+    if name not in renders:
+        renders[name] = RenderTracker(menu)
+    return renders[name]
+
+def init_db(conn):
+    # Схема создаётся и обновляется пошаговыми миграциями (migrations.py);
+    # на актуальной базе это одно чтение PRAGMA user_version
+    if migrate(conn):
+        # Новая или обновлённая база: добавляем первоначального админа
+        conn.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (INITIAL_ADMIN_ID,))
+
+def _add_user(conn, user_id: int, bot: str = DEFAULT_BOT):
+    if conn.execute('INSERT OR IGNORE INTO users (bot, user_id) VALUES (?, ?)', (bot, user_id)).rowcount:
+        record_new_user(conn, bot)
+    else:
+        # Пользователь, который снова пишет боту, опять получает рассылки
+        conn.execute(
+            'UPDATE users SET active = 1, blocked_at = NULL WHERE bot = ? AND user_id = ? AND active = 0', (bot, user_id)
         )
-    ''')
-    
-    # Добавляем первоначального админа
-    cursor.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (INITIAL_ADMIN_ID,))
-    
-    conn.commit()
-    conn.close()
-
-def load_admins_from_db():
-    global ADMIN_IDS
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM admins')
-    ADMIN_IDS = {row[0] for row in cursor.fetchall()}
-    conn.close()
-    logger.info(f"Загружено админов: {len(ADMIN_IDS)}")
-
-def add_user_to_db(user_id: int):
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
-    conn.commit()
-    conn.close()
-
-def add_group_to_db(chat_id: int, title: str = ""):
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO groups (chat_id, title) VALUES (?, ?)', (chat_id, title))
-    conn.commit()
-    conn.close()
-
-def add_admin_to_db(user_id: int):
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (user_id,))
-    conn.commit()
-    conn.close()
-
-def log_command_usage(user_id: int, command: str):
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO command_stats (user_id, command) VALUES (?, ?)', (user_id, command))
-    conn.commit()
-    conn.close()
-
-def log_user_activity(user_id: int):
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    today = datetime.now().date()
-    cursor.execute('''
-        INSERT OR REPLACE INTO user_activity (user_id, date, actions_count)
-        VALUES (?, ?, COALESCE((SELECT actions_count FROM user_activity WHERE user_id = ? AND date = ?), 0) + 1)
-    ''', (user_id, today, user_id, today))
-    conn.commit()
-    conn.close()
-
-def get_all_users():
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM users')
-    users = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return users
-
-def get_all_groups():
-    conn = sqlite3.connect('stats.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT chat_id FROM groups')
-    groups = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return groups
+
+async def add_user_to_db(user_id: int, bot: str = DEFAULT_BOT):
+    await db.run(_add_user, user_id, bot)
+
+async def set_user_active(user_id: int, active: bool, bot: str = DEFAULT_BOT):
+    # Пользователь заблокировал бота или разблокировал его
+    await db.execute(
+        '''UPDATE users SET active = ?, blocked_at = CASE WHEN ? THEN NULL ELSE CURRENT_TIMESTAMP END
+           WHERE bot = ? AND user_id = ?''',
+        (int(active), int(active), bot, user_id)
+    )
+
+async def add_group_to_db(chat_id: int, title: str = "", bot: str = DEFAULT_BOT):
+    await db.execute('''
+        INSERT INTO groups (bot, chat_id, title) VALUES (?, ?, ?)
+        ON CONFLICT(bot, chat_id) DO UPDATE SET title = excluded.title, active = 1, blocked_at = NULL
+    ''', (bot, chat_id, title))
+
+async def remove_group_from_db(chat_id: int, bot: str = DEFAULT_BOT):
+    # Группа остаётся в базе для истории, но в рассылки больше не попадает
+    await db.execute(
+        'UPDATE groups SET active = 0, blocked_at = CURRENT_TIMESTAMP WHERE bot = ? AND chat_id = ? AND active = 1',
+        (bot, chat_id)
+    )
+
+async def rename_group(chat_id: int, title: str, bot: str = DEFAULT_BOT):
+    await db.execute('UPDATE groups SET title = ? WHERE bot = ? AND chat_id = ?', (title, bot, chat_id))
+
+def _migrate_group(conn, old_chat_id: int, new_chat_id: int, bot: str = DEFAULT_BOT):
+    # Группа стала супергруппой: у чата новый id, старый больше не принимает сообщения
+    conn.execute('''
+        INSERT INTO groups (bot, chat_id, title, added_at)
+        SELECT bot, ?, title, added_at FROM groups WHERE bot = ? AND chat_id = ?
+        ON CONFLICT(bot, chat_id) DO UPDATE SET active = 1, blocked_at = NULL
+    ''', (new_chat_id, bot, old_chat_id))
+    conn.execute(
+        'UPDATE groups SET active = 0, blocked_at = CURRENT_TIMESTAMP WHERE bot = ? AND chat_id = ? AND active = 1',
+        (bot, old_chat_id)
+    )
+
+async def add_admin_to_db(user_id: int):
+    await db.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (user_id,))
+
+def log_user_action(user_id: int, command: str, bot: str = DEFAULT_BOT):
+    # Нажатие попадает в буфер телеметрии и пишется в базу пачкой
+    telemetry.record(user_id, command, bot)
 
 def is_admin(user_id: int):
-    return user_id in ADMIN_IDS
+    return admins.is_admin(user_id)
 
 # ================== ОСНОВНЫЕ ФУНКЦИИ ==================
 
+# Защита от флуда: лишние апдейты отсекаются до хендлеров и не доходят до базы
+flood = FloodControl(parse_limits(FLOOD_LIMITS))
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is None or is_admin(user.id):
+        return
+    kind = update_kind(update)
+    if flood.allow(user.id, kind):
+        return
+    metrics.inc('bot_flood_throttled_total', kind=kind)
+    if kind == 'callback':
+        # Кнопку нужно «отпустить», иначе у пользователя будут крутиться часики
+        try:
+            await update.callback_query.answer("⏳ Слишком часто, подождите немного.")
+        except BadRequest:
+            pass
+    raise ApplicationHandlerStop
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    add_user_to_db(user.id)
-    log_command_usage(user.id, 'start')
-    log_user_activity(user.id)
+    name = bot_name(context.bot)
+    await add_user_to_db(user.id, name)
+    log_user_action(user.id, 'start', name)
     
     keyboard = [[KeyboardButton("/start")]]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
@@ -159,27 +220,41 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"👋 Привет, {user.first_name}! Я бот-помощник для партнеров.",
         reply_markup=reply_markup
     )
-    await show_main_menu(update, user)
-
-async def show_main_menu(update, user=None):
-    if user is None:
-        user = update.effective_user
-    keyboard = [
-        [InlineKeyboardButton("📋 О платформе", callback_data="menu_about")],
-        [InlineKeyboardButton("💼 Условия работы", callback_data="menu_conditions")],
-        [InlineKeyboardButton("📞 Контакты поддержки", callback_data="menu_contacts")],
-        [InlineKeyboardButton("📚 Полезные материалы", callback_data="menu_materials")],
-        [InlineKeyboardButton("❓ FAQ", callback_data="menu_faq")],
-        [
-            InlineKeyboardButton("📊 Статистика: 30 дней", callback_data="stats_30"),
-            InlineKeyboardButton("📈 Статистика: 7 дней", callback_data="stats_7")
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    if hasattr(update, 'message'):
-        await update.message.reply_text("🎯 Выбери, что тебя интересует:", reply_markup=reply_markup)
-    else:
-        await update.callback_query.edit_message_text("🏠 Главное меню. Выбери, что тебя интересует:", reply_markup=reply_markup)
+    await show_main_menu(update, user, name)
+
+async def show_main_menu(update, user=None, bot: str = DEFAULT_BOT):
+    sent = await update.message.reply_text("🎯 Выбери, что тебя интересует:", reply_markup=menu.get(MAIN_MENU).markup)
+    rendered_for(bot).mark_rendered(sent.chat_id, sent.message_id, MAIN_MENU)
+
+async def render_screen(query, screen, context: ContextTypes.DEFAULT_TYPE):
+    # Возвращает сообщение, в котором теперь показан экран
+    message = query.message
+    # file_id графиков выданы основному боту, остальные показывают экран текстом
+    chart = charts.file_id(screen.id) if bot_name(context.bot) == PRIMARY_BOT else None
+    if chart:
+        # Картинка уже загружена в Telegram: отправляем только file_id
+        await query.edit_message_media(
+            InputMediaPhoto(chart, caption=screen.text, parse_mode=screen.parse_mode),
+            reply_markup=screen.markup
+        )
+        return message
+    if getattr(message, 'photo', None):
+        # Сообщение с графиком нельзя превратить в текст через edit_message_text
+        try:
+            await message.delete()
+        except BadRequest:
+            pass
+        return await context.bot.send_message(
+            message.chat.id, screen.text, parse_mode=screen.parse_mode,
+            reply_markup=screen.markup, link_preview_options=screen.link_preview
+        )
+    await query.edit_message_text(
+        text=screen.text,
+        parse_mode=screen.parse_mode,
+        reply_markup=screen.markup,
+        link_preview_options=screen.link_preview
+    )
+    return message
 
 async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -187,260 +262,46 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     user = query.from_user
 
-    log_command_usage(user.id, data)
-    log_user_activity(user.id)
-
-    try:
-        if data == "main_menu":
-            await show_main_menu(query, user)
-            return
+    screen = menu.get(data)
+    if screen is None:
+        logger.warning(f"Неизвестный callback_data: {data}")
+        return
 
-        elif data == "menu_about":
-            text = (
-                "<b>🚀 О нашей платформе</b>\n\n"
-                "🔥 <a href='https://wincraft.casino/'>Wincraft Casino</a> — это динамично развивающийся бренд, "
-                "который за короткий срок стал узнаваемым и востребованным среди партнёров и игроков по всему миру.\n\n"
-                "💎 Мы не просто следуем трендам — мы создаём их. Наша команда оперативно адаптирует продукт под "
-                "современные ожидания аудитории, внедряя инновации и сохраняя высочайший уровень сервиса.\n\n"
-                "🤝 Каждому партнёру — индивидуальный подход. Мы верим, что успех строится на доверии, "
-                "прозрачности и гибкости. Готовы расти вместе с вами!\n\n"
-                "🔗 <b>Наша платформа:</b> https://wincraft.casino/\n"
-                "🔗 <b>Партнёрская программа:</b> https://affwin.partners/"
-            )
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="main_menu")]]
-            await query.edit_message_text(
-                text=text,
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                disable_web_page_preview=True
-            )
+    # Повторное нажатие или «Назад» на уже открытый экран: отвечаем локально, без edit и записи в базу
+    name = bot_name(context.bot)
+    rendered = rendered_for(name)
+    message = query.message
+    if message is not None and rendered.is_redundant(message.chat.id, message.message_id, user.id, data):
+        return
 
-        elif data == "menu_conditions":
-            text = "<b>💼 Условия работы</b>\n\nВыберите модель сотрудничества:"
-            keyboard = [
-                [InlineKeyboardButton("💰 CPA", callback_data="conditions_cpa")],
-                [InlineKeyboardButton("📊 RS", callback_data="conditions_rs")],
-                [InlineKeyboardButton("🔄 Hybrid", callback_data="conditions_hybrid")],
-                [InlineKeyboardButton("◀️ Назад", callback_data="main_menu")]
-            ]
-            await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "conditions_cpa":
-            text = ("<b>💰 Модель CPA (Cost Per Action)</b>\n\n"
-                    "✅ <b>Преимущества:</b>\n"
-                    "• Оплата за целевое действие\n"
-                    "• Минимальные риски для партнера\n"
-                    "• Подходит для начинающих\n"
-                    "• Стабильный доход\n\n"
-                    "💵 <b>Ставки по FB нашим основным гео:</b>\n"
-                    "┌────────────┬──────────────────┬───────┐\n"
-                    "│   Тир      │     Страна       │ Ставка│\n"
-                    "├────────────┼──────────────────┼───────┤\n"
-                    "│    T1      │ FI (Finland)     │  170  │\n"
-                    "│    T1      │ CH (Switzerland) │  295  │\n"
-                    "│    T3      │ KG (Kyrgyzstan)  │  60   │\n"
-                    "│    T3      │ AM (Armenia)     │  60   │\n"
-                    "│    T2      │ HU (Hungary)     │  160  │\n"
-                    "│    T3      │ GE (Georgia)     │  80   │\n"
-                    "│    T2      │ PL (Poland)      │  150  │\n"
-                    "│    T2      │ RS (Serbia)      │  75   │\n"
-                    "│    T1      │ CA (Canada)      │  220  │\n"
-                    "│    T1      │ IE (Ireland)     │  255  │\n"
-                    "│    T1      │ DE (Germany)     │  220  │\n"
-                    "│    T1      │ SE (Sweden)      │  215  │\n"
-                    "│    T2      │ SI (Slovenia)    │  130  │\n"
-                    "│    T2      │ SK (Slovakia)    │  130  │\n"
-                    "│    T3      │ TJ (Tajikistan)  │  65   │\n"
-                    "│    T3      │ MD (Moldova)     │  60   │\n"
-                    "│    T2      │ GR (Greece)      │  150  │\n"
-                    "│    T1      │ GB (UK)          │  225  │\n"
-                    "│    T1      │ FR (France)      │  185  │\n"
-                    "└────────────┴──────────────────┴───────┘\n\n"
-                    "📊 <b>Полная таблица ставок:</b>\n"
-                    "https://docs.google.com/spreadsheets/d/1ObMQlGiY7PbxA0ZdQkZRjXvpbp5clpM4wA2X5CUvl5A/edit?usp=sharing\n\n"
-                    "💬 <b>Другие варианты сотрудничества можем обсудить индивидуально</b>")
-            keyboard = [[InlineKeyboardButton("◀️ Назад к условиям", callback_data="menu_conditions")]]
-            await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "conditions_rs":
-            text = ("<b>📊 Модель RS (Revenue Share)</b>\n\n"
-                    "✨ <b>Премиум условия для опытных партнеров</b>\n\n"
-                    "✅ <b>Преимущества:</b>\n"
-                    "• Процент от оборота клиента\n"
-                    "• Высокий потенциал дохода\n"
-                    "• Долгосрочное сотрудничество\n"
-                    "• Персональный подход\n\n"
-                    "🌟 <b>Индивидуальные условия:</b>\n"
-                    "• Гибкие процентные ставки\n"
-                    "• Эксклюзивные предложения\n"
-                    "• Приоритетная поддержка\n\n"
-                    "👥 <b>Обсудить индивидуальные условия:</b>\n"
-                    "• @makswincraft 🚀\n"
-                    "• @dosiTG 💼\n"
-                    "• @hugewinaffs 🌟\n\n"
-                    "<i>Пример: процент от депозитов, повторных покупок, LTV клиента</i>")
-            keyboard = [
-                [InlineKeyboardButton("💬 Написать @makswincraft", url="tg://resolve?domain=makswincraft")],
-                [InlineKeyboardButton("💬 Написать @dosiTG", url="tg://resolve?domain=dosiTG")],
-                [InlineKeyboardButton("💬 Написать @hugewinaffs", url="tg://resolve?domain=hugewinaffs")],
-                [InlineKeyboardButton("◀️ Назад к условиям", callback_data="menu_conditions")]
-            ]
-            await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "conditions_hybrid":
-            text = ("<b>🔄 Гибридная модель (CPA + RS)</b>\n\n"
-                    "🎯 <b>Идеальный баланс для максимальной эффективности</b>\n\n"
-                    "✅ <b>Преимущества:</b>\n"
-                    "• Сочетание стабильности CPA и потенциала RS\n"
-                    "• Гибкие условия под ваши задачи\n"
-                    "• Индивидуальный подход\n"
-                    "• Оптимальный риск/доход\n\n"
-                    "💫 <b>Варианты сотрудничества:</b>\n"
-                    "• CPA + процент от оборота\n"
-                    "• Фиксированный бонус за качество\n"
-                    "• Многоуровневая система вознаграждений\n\n"
-                    "👥 <b>Обсудить индивидуальные условия:</b>\n"
-                    "• @makswincraft 🚀\n"
-                    "• @dosiTG 💼\n"
-                    "• @hugewinaffs 🌟\n\n"
-                    "<i>Пример: фикс за регистрацию + % от оборота, ступенчатая система</i>")
-            keyboard = [
-                [InlineKeyboardButton("💬 Написать @makswincraft", url="tg://resolve?domain=makswincraft")],
-                [InlineKeyboardButton("💬 Написать @dosiTG", url="tg://resolve?domain=dosiTG")],
-                [InlineKeyboardButton("💬 Написать @hugewinaffs", url="tg://resolve?domain=hugewinaffs")],
-                [InlineKeyboardButton("◀️ Назад к условиям", callback_data="menu_conditions")]
-            ]
-            await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "menu_contacts":
-            text = (
-                "📞 Контакты поддержки\n\n"
-                "Мы всегда на связи и готовы помочь — в любой ситуации и в любое время!\n\n"
-                "🕒 Работаем 24/7\n"
-                "Ваш запрос будет обработан максимально оперативно.\n\n"
-                "👨‍💼 Ваши персональные менеджеры:\n"
-                "• @makswincraft🚀\n"
-                "• @dosiTG 💼\n"
-                "• @hugewinaffs🌟\n\n"
-                "Пишите смело — мы настроены на долгое и взаимовыгодное сотрудничество!"
-            )
-            keyboard = [
-                [InlineKeyboardButton("🚀 Написать @makswincraft", url="https://t.me/makswincraft")],
-                [InlineKeyboardButton("💼 Написать @dosiTG", url="https://t.me/dosiTG")],
-                [InlineKeyboardButton("🌟 Написать @hugewinaffs", url="https://t.me/hugewinaffs")],
-                [InlineKeyboardButton("◀️ Назад", callback_data="main_menu")]
-            ]
-            await query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "menu_materials":
-            text = "📚 Полезные материалы\n\nВыберите раздел:"
-            keyboard = [
-                [InlineKeyboardButton("🔗 Лендинги", callback_data="materials_landings")],
-                [InlineKeyboardButton("◀️ Назад", callback_data="main_menu")]
-            ]
-            await query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "materials_landings":
-            text = "🔗 Доступные лендинги и демо-игры"
-            keyboard = [
-                [InlineKeyboardButton("🏠 Главная (EN)", url="https://wincraft.casino/")],
-                [InlineKeyboardButton("🇫🇷 Главная (FR)", url="https://www.wincraft.casino/fr")],
-                [InlineKeyboardButton("🎯 Регистрация", url="https://wincraft.casino/?modal=signup")],
-                [InlineKeyboardButton("🎰 Популярные слоты", url="https://wincraft.casino/categories/games/popular")],
-                [InlineKeyboardButton("🎁 Промо / Бонусы", url="https://wincraft.casino/promotions")],
-                [InlineKeyboardButton("🎡 Wheel of Fortune", url="https://wincraft.casino/wheel-of-fortune")],
-                [InlineKeyboardButton("👧 Wheel of Fortune (Girl)", url="https://wincraft.casino/wheel-of-fortune-girl")],
-                [InlineKeyboardButton("🎮 Демо-игры", callback_data="landings_demos")],
-                [InlineKeyboardButton("◀️ Назад к материалам", callback_data="menu_materials")]
-            ]
-            await query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "landings_demos":
-            text = "🎮 Демо-версии популярных слотов"
-            keyboard = [
-                [InlineKeyboardButton("📖 Book of Dead", url="https://wincraft.casino/casino/games/12406?demo=true")],
-                [InlineKeyboardButton("⛰️ Gates of Olympus", url="https://wincraft.casino/casino/games/20502?demo=true")],
-                [InlineKeyboardButton("⚔️ Zeus vs Hades", url="https://wincraft.casino/casino/games/14475?demo=true")],
-                [InlineKeyboardButton("🏡 The Dog House", url="https://wincraft.casino/casino/games/9535?demo=true")],
-                [InlineKeyboardButton("🍬 Sweet Bonanza", url="https://wincraft.casino/casino/games/20504?demo=true")],
-                [InlineKeyboardButton("✋ Hand of Midas", url="https://wincraft.casino/casino/games/20709?demo=true")],
-                [InlineKeyboardButton("◀️ Назад к лендингам", callback_data="materials_landings")]
-            ]
-            await query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "menu_faq":
-            text = (
-                "❓ Часто задаваемые вопросы\n\n"
-                "01. За какие лиды вы платите?\n"
-                "— Motivated-трафик\n"
-                "— Мультиаккаунты (один ID/IP/устройство → несколько регистраций)\n"
-                "— Лиды с подозрительной воронкой (высокая рега, но нет депозитов)\n\n"
-                "02. Оценка трафика — в потоке или по игрокам?\n"
-                "— Оцениваем каждого игрока индивидуально. Если из 20 — 12 сделали FTD, оплатим за 12.\n\n"
-                "03. Есть ли холд на игроков?\n"
-                "— Нет. Все FTD, совершённые до конца отчётного периода, оплачиваются.\n\n"
-                "04. Сколько дней с клика до депозита?\n"
-                "— Максимум 30 дней. Если депозит в этот срок — лид валидный.\n\n"
-                "05. Сроки сверки и выплат?\n"
-                "— Сверка до конца месяца, выплата — до 10-го числа следующего месяца.\n"
-                "— На больших объёмах — возможны выплаты 2–3 раза в месяц.\n\n"
-                "06. Тестовые капы?\n"
-                "— 10–20 FTD на тест. Далее — до 100 FTD. При хорошем качестве — без ограничений.\n\n"
-                "07. Минимальная сумма выплаты?\n"
-                "— 500 USD.\n\n"
-                "08. Способы оплаты?\n"
-                "— USDT / USDC. Инвойс, KYC, AML — не требуются.\n\n"
-                "09. Задержка postback?\n"
-                "— Минимальная. Данные обновляются 24/7 в реальном времени.\n\n"
-                "10. Критерии оценки трафика?\n"
-                "— CR клик → регистрация / FTD\n"
-                "— Доля активных игроков и ретеншн\n"
-                "— Коэффициент возвратов\n"
-                "— Источники, гео, устройства, стабильность заливов\n\n"
-                "11. Регистрация в одном периоде, депозит — в следующем?\n"
-                "— FTD засчитывается в период депозита (в рамках 30 дней) и оплачивается.\n\n"
-                "12. Как оплачивается перелив?\n"
-                "— Только по согласованию. Качественный перелив — оплачиваем.\n\n"
-                "13. Показатели через 30 дней?\n"
-                "— RetDep ≥30% от FTD\n"
-                "— Средний чек — x2–x2.5 от мин. депозита\n\n"
-                "16. KPI на тесте?\n"
-                "— На тесте KPI не блокирующие. Ориентиры:\n"
-                "  • CR клик → регистрация: 20–30%\n"
-                "  • CR регистрация → депозит: 5–10%\n"
-                "  • Retention Day 7: от 25%\n"
-                "— Оплата по валидным FTD — в любом случае.\n\n"
-                "17. Принимаете ли инфлюенсеров и PPS-бренд?\n"
-                "— PPC, SEO, Facebook — да. Инфлюенсеры и PPS-бренд — по согласованию.\n\n"
-                "18. Hard и Soft KPI?\n"
-                "— Soft: CR рега 20–30%, CR FTD 5–10%, Ret7 >25%\n"
-                "— Hard: RetDep >30%, ARPU ≥x2 от мин. депа, ROI на D7/D14\n\n"
-                "Контакты для уточнений:\n"
-                "@makswincraft | @dosiTG | @hugewinaffs"
-            )
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="main_menu")]]
-            await query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "stats_30":
-            text = ("<b>📊 Статистика за 30 дней</b>\n\n"
-                    "📆 Данные обновляются 1-го и 15-го числа каждого месяца.\n\n"
-                    "🖼️ Скоро: графики Click2Reg и Reg2Dep!")
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="main_menu")]]
-            await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
-
-        elif data == "stats_7":
-            text = ("<b>📈 Статистика за 7 дней</b>\n\n"
-                    "📆 Данные обновляются каждое утро по понедельникам.\n\n"
-                    "🖼️ Скоро: недельные графики конверсий!")
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="main_menu")]]
-            await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+    log_user_action(user.id, data, name)
 
+    try:
+        shown = await render_screen(query, screen, context)
+        if shown is not None:
+            rendered.mark_rendered(shown.chat.id, shown.message_id, data)
+        if message is not None:
+            rendered.mark_tapped(message.chat.id, message.message_id, user.id, data)
+    except BadRequest as e:
+        if "message is not modified" in str(e).lower():
+            if message is not None:
+                rendered.mark_rendered(message.chat.id, message.message_id, data)
+                rendered.mark_tapped(message.chat.id, message.message_id, user.id, data)
+            return
+        logger.error(f"Ошибка в меню: {e}")
+        await query.message.reply_text("⚠️ Ошибка. Попробуйте позже.")
     except Exception as e:
         logger.error(f"Ошибка в меню: {e}")
         await query.message.reply_text("⚠️ Ошибка. Попробуйте позже.")
 
 # ================== АДМИН-МЕНЮ ==================
 
+# Общий лимит Bot API для всех рассылок процесса
+broadcast_bucket = TokenBucket()
+
+# Долгие админские задачи выполняются в фоне, не блокируя обработку апдейтов
+jobs = JobManager()
+
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         await update.message.reply_text("❌ У вас нет доступа.")
@@ -449,6 +310,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("📢 Рассылка по пользователям", callback_data="admin_broadcast_users")],
         [InlineKeyboardButton("📤 Рассылка по группам", callback_data="admin_broadcast_groups")],
         [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton("📋 Фоновые задачи", callback_data="admin_jobs")],
         [InlineKeyboardButton("👤 Добавить админа", callback_data="admin_add_admin")],
         [InlineKeyboardButton("❌ Закрыть", callback_data="admin_close")]
     ]
@@ -472,8 +334,45 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
     elif data == "admin_broadcast_groups":
         context.user_data['admin_action'] = 'broadcast_groups'
         await query.edit_message_text("Пришлите сообщение для рассылки по группам.")
+    elif data.startswith("admin_segment_"):
+        pending = context.user_data.get('pending_broadcast')
+        preset = SEGMENT_PRESETS.get(data[len("admin_segment_"):])
+        if pending is None or preset is None:
+            await query.edit_message_text("Рассылка не найдена, начните заново: /admin")
+            return
+        pending['segment'] = preset[1](utc_today())
+        text, markup = await broadcast_confirmation(pending, bot_name(context.bot))
+        try:
+            await query.edit_message_text(text, reply_markup=markup)
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                raise
+    elif data == "admin_broadcast_confirm":
+        pending = context.user_data.pop('pending_broadcast', None)
+        context.user_data.pop('admin_action', None)
+        if pending is None:
+            await query.edit_message_text("Рассылка не найдена, начните заново: /admin")
+            return
+        job = await start_broadcast(context.bot, user_id, pending['kind'], pending['payload'], pending['segment'])
+        await query.edit_message_text(f"🆔 Рассылка запущена как задача #{job.id}.\nСтатус: /job {job.id}, отмена: /cancel {job.id}")
+    elif data == "admin_broadcast_cancel":
+        context.user_data.pop('pending_broadcast', None)
+        context.user_data.pop('admin_action', None)
+        await query.edit_message_text("Рассылка отменена.")
     elif data == "admin_stats":
-        await query.edit_message_text("📊 Аналитика доступна в веб-панели.")
+        periods = await db.run(dashboard, utc_today(), bot_name(context.bot))
+        keyboard = [[InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats")]]
+        try:
+            await query.edit_message_text(
+                format_dashboard(periods), parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                raise
+    elif data == "admin_jobs":
+        running = jobs.running()
+        text = "\n\n".join(job.describe() for job in running) if running else "Активных задач нет."
+        await query.edit_message_text(f"{text}\n\nВсе задачи: /jobs")
     elif data == "admin_add_admin":
         context.user_data['admin_action'] = 'add_admin'
         await query.edit_message_text("Введите Telegram ID нового админа:")
@@ -488,91 +387,450 @@ async def handle_admin_action_message(update: Update, context: ContextTypes.DEFA
     action = context.user_data.get('admin_action')
     message = update.message
 
-    if action == 'broadcast_users':
-        users = get_all_users()
-        success = errors = 0
-        for uid in users:
-            try:
-                if message.text:
-                    await context.bot.send_message(chat_id=uid, text=message.text, parse_mode="HTML")
-                elif message.photo:
-                    await context.bot.send_photo(chat_id=uid, photo=message.photo[-1].file_id, caption=message.caption)
-                elif message.document:
-                    await context.bot.send_document(chat_id=uid, document=message.document.file_id, caption=message.caption)
-                else:
-                    await context.bot.copy_message(chat_id=uid, from_chat_id=message.chat_id, message_id=message.message_id)
-                success += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки пользователю {uid}: {e}")
-                errors += 1
-        await message.reply_text(f"✅ Рассылка завершена.\nУспешно: {success}\nОшибок: {errors}")
-        context.user_data.pop('admin_action', None)
-
-    elif action == 'broadcast_groups':
-        groups = get_all_groups()
-        if not groups:
-            await message.reply_text("Нет сохранённых групп.")
+    if action in jobstore.RECIPIENT_TABLES:
+        # Сначала показываем число получателей; рассылка стартует только по кнопке
+        payload = message_payload(message, copy_only=(action == 'broadcast_groups'))
+        pending = {'kind': action, 'payload': payload, 'segment': {}}
+        context.user_data['pending_broadcast'] = pending
+        context.user_data['admin_action'] = 'broadcast_segment'
+        text, markup = await broadcast_confirmation(pending, bot_name(context.bot))
+        await message.reply_text(text, reply_markup=markup)
+
+    elif action == 'broadcast_segment':
+        pending = context.user_data.get('pending_broadcast')
+        if pending is None or pending['kind'] != 'broadcast_users' or not message.text:
+            await message.reply_text("Подтвердите или отмените рассылку кнопками выше.")
             return
-        success = errors = 0
-        for gid in groups:
-            try:
-                await context.bot.copy_message(chat_id=gid, from_chat_id=message.chat_id, message_id=message.message_id)
-                success += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки в группу {gid}: {e}")
-                errors += 1
-        await message.reply_text(f"📤 Рассылка в группы завершена.\nУспешно: {success}\nОшибок: {errors}")
-        context.user_data.pop('admin_action', None)
+        try:
+            pending['segment'] = parse_segment(message.text)
+        except ValueError as e:
+            await message.reply_text(f"❌ Не понял сегмент: {e}\n\n{SEGMENT_HINT}")
+            return
+        text, markup = await broadcast_confirmation(pending, bot_name(context.bot))
+        await message.reply_text(text, reply_markup=markup)
 
     elif action == 'add_admin':
         try:
             new_admin_id = int(message.text.strip())
-            add_admin_to_db(new_admin_id)
-            ADMIN_IDS.add(new_admin_id)
+            await add_admin_to_db(new_admin_id)
+            await admins.refresh()
             await message.reply_text(f"✅ Пользователь {new_admin_id} добавлен в админы!")
         except ValueError:
             await message.reply_text("❌ Неверный ID. Отправьте число.")
         context.user_data.pop('admin_action', None)
 
+# ================== ФОНОВЫЕ ЗАДАЧИ ==================
+
+BROADCAST_TITLES = {
+    'broadcast_users': "📢 Рассылка по пользователям",
+    'broadcast_groups': "📤 Рассылка по группам",
+}
+
+async def broadcast_confirmation(pending: dict, bot: str = DEFAULT_BOT):
+    # Текст и кнопки подтверждения: сколько человек получит сообщение при текущем сегменте
+    kind, segment = pending['kind'], pending['segment']
+    count = await db.run(count_recipients, kind, segment, bot)
+    lines = [BROADCAST_TITLES[kind], f"👥 Получателей: {count}"]
+    keyboard = []
+    if kind == 'broadcast_users':
+        lines.append(f"🎯 Сегмент: {describe_segment(segment)}")
+        lines.append(f"\n{SEGMENT_HINT}")
+        presets = [InlineKeyboardButton(label, callback_data=f"admin_segment_{key}")
+                   for key, (label, _) in SEGMENT_PRESETS.items()]
+        keyboard += [presets[:2], presets[2:]]
+    keyboard.append([InlineKeyboardButton(f"✅ Отправить ({count})", callback_data="admin_broadcast_confirm"),
+                     InlineKeyboardButton("❌ Отмена", callback_data="admin_broadcast_cancel")])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def start_broadcast(bot, owner_id: int, kind: str, payload: dict, segment: dict = None):
+    job_id = await db.run(jobstore.create_broadcast_job, kind, owner_id, payload, segment, bot_name(bot))
+    return jobs.start(job_id, kind, owner_id, lambda job: run_broadcast_job(job, bot, payload, segment))
+
+async def run_broadcast_job(job, bot, payload: dict, segment: dict = None):
+    title = f"{BROADCAST_TITLES[job.kind]} (#{job.id})"
+    checkpoint = None
+    # Снимок получателей тоже внутри try: отмена или ошибка на этапе preparing
+    # должны записать статус, иначе задача продолжится после рестарта
+    try:
+        if await db.run(jobstore.job_status, job.id) == 'preparing':
+            # Даты сегмента считаются в момент снимка; после рестарта снимок продолжается с тем же сегментом
+            sql, params = segment_sql(job.kind, segment, bot=bot_name(bot))
+            await jobstore.snapshot_recipients(db, job.id, sql, params)
+        counts = await db.run(jobstore.delivery_counts, job.id)
+        job.stats = BroadcastStats(sum(counts.values()))
+        job.stats.sent = counts.get('sent', 0)
+        job.stats.failed = counts.get('failed', 0)
+        job.stats.blocked = counts.get('blocked', 0)
+        if not job.stats.total:
+            await db.run(jobstore.set_job_status, job.id, 'done')
+            await bot.send_message(job.owner_id, f"{title}: нет получателей.")
+            return
+
+        resumed = " (продолжение после перезапуска)" if job.stats.done else ""
+        progress = await bot.send_message(job.owner_id, f"{title}{resumed}: {job.stats.total} получателей.")
+        checkpoint = jobstore.DeliveryCheckpoint(db, job.id, prune_table=jobstore.RECIPIENT_TABLES[job.kind])
+        await Broadcaster(bot, broadcast_bucket).run(
+            jobstore.iter_pending(db, job.id), make_sender(payload), job.stats,
+            on_progress=progress_editor(progress, title), on_result=checkpoint.record
+        )
+        await checkpoint.flush()
+    except asyncio.CancelledError:
+        if checkpoint is not None:
+            await checkpoint.flush()
+        # При остановке процесса задача остаётся в своём статусе и продолжится после рестарта
+        if not jobs.stopping:
+            await db.run(jobstore.set_job_status, job.id, 'cancelled')
+            summary = f"\n{job.stats.summary()}" if job.stats is not None else ""
+            await bot.send_message(job.owner_id, f"⛔ Задача #{job.id} отменена.{summary}")
+        raise
+    except Exception:
+        await db.run(jobstore.set_job_status, job.id, 'failed')
+        raise
+    await db.run(jobstore.set_job_status, job.id, 'done')
+    await bot.send_message(job.owner_id, f"✅ Задача #{job.id} завершена.\n{job.stats.summary()}")
+
+async def resume_broadcasts(bot):
+    for job_id, kind, owner_id, payload, segment in await db.run(jobstore.unfinished_jobs, bot_name(bot)):
+        logger.info(f"Продолжаем рассылку #{job_id} после перезапуска")
+        jobs.start(job_id, kind, owner_id,
+                   lambda job, payload=payload, segment=segment: run_broadcast_job(job, bot, payload, segment))
+
+def parse_job_id(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        return int(context.args[0])
+    except (IndexError, ValueError):
+        return None
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    all_jobs = jobs.list()
+    if not all_jobs:
+        await update.message.reply_text("Задач нет.")
+        return
+    await update.message.reply_text("\n\n".join(job.describe() for job in all_jobs[-10:]))
+
+async def job_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    job_id = parse_job_id(context)
+    job = jobs.get(job_id) if job_id is not None else None
+    if job is None:
+        await update.message.reply_text("❌ Задача не найдена. Использование: /job <id>")
+        return
+    await update.message.reply_text(job.describe())
+
+async def cancel_job_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    job_id = parse_job_id(context)
+    if job_id is None:
+        await update.message.reply_text("Использование: /cancel <id>")
+    elif jobs.cancel(job_id):
+        await update.message.reply_text(f"⏹ Отменяем задачу #{job_id}...")
+    else:
+        await update.message.reply_text(f"❌ Задача #{job_id} не найдена или уже завершена.")
+
+# ================== МЕТРИКИ ==================
+
+def collect_gauges():
+    gauges = [
+        ('bot_telemetry_pending_events', {}, telemetry.pending),
+    ]
+    for name, processor in processors.items():
+        gauges.append(('bot_updates_queued', {'bot': name}, processor.pending))
+        gauges.append(('bot_updates_active_chats', {'bot': name}, processor.active_chats))
+    for job in jobs.running():
+        if not isinstance(job.stats, BroadcastStats):
+            continue
+        for state in ('total', 'done', 'sent', 'failed', 'blocked', 'retries'):
+            gauges.append(('bot_broadcast_recipients', {'job': job.id, 'state': state}, getattr(job.stats, state)))
+    return gauges
+
+metrics.add_collector(collect_gauges)
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    await update.message.reply_text(metrics.summary())
+
+# ================== КОНВЕРСИИ ==================
+
+async def conversions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /conversions YYYY-MM-DD клики регистрации депозиты
+    if not is_admin(update.effective_user.id):
+        return
+    try:
+        day = datetime.strptime(context.args[0], "%Y-%m-%d").date().isoformat()
+        clicks, registrations, deposits = (int(value) for value in context.args[1:4])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Использование: /conversions YYYY-MM-DD клики регистрации депозиты")
+        return
+    await db.run(upsert_conversions, day, clicks, registrations, deposits)
+    # Графики перерисуются в фоне, ответ админу не ждёт рендера; загружает их основной бот
+    primary = applications.get(PRIMARY_BOT)
+    charts.schedule_refresh(primary.bot if primary is not None else context.bot)
+    await update.message.reply_text(f"✅ Данные за {day} сохранены. Графики обновятся в течение минуты.")
+
+# ================== ВЫГРУЗКИ ==================
+
+# Отправка большого документа дольше обычного запроса
+EXPORT_UPLOAD_TIMEOUT = 120
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /export activity jsonl 2024-05-01 2024-05-31
+    if not is_admin(update.effective_user.id):
+        return
+    try:
+        name, fmt, date_from, date_to = parse_export_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Не понял параметры: {e}\n\n{EXPORT_HINT}")
+        return
+    owner_id = update.effective_user.id
+    params = {'table': name, 'format': fmt, 'from': date_from, 'to': date_to}
+    job_id = await db.run(jobstore.create_job, 'export', owner_id, params, bot_name(context.bot))
+    jobs.start(job_id, 'export', owner_id,
+               lambda job: run_export_job(job, context.bot, name, fmt, date_from, date_to))
+    await update.message.reply_text(f"📦 Выгрузка #{job_id} запущена, файл придёт сюда.\nСтатус: /job {job_id}")
+
+async def run_export_job(job, bot, name: str, fmt: str, date_from: str = None, date_to: str = None):
+    job.stats = ExportStats()
+    try:
+        with await export_table(db, name, fmt, date_from, date_to, stats=job.stats, bot=bot_name(bot)) as document:
+            # PTB читает загружаемый файл целиком, а у спула в памяти нет имени файла:
+            # отдаём уже сжатые байты (не больше MAX_DOCUMENT_SIZE) с явным именем
+            content = await asyncio.to_thread(document.read)
+        await bot.send_document(
+            job.owner_id, InputFile(content, filename=export_filename(name, fmt, date_from, date_to)),
+            caption=f"📦 Выгрузка #{job.id}: {name}, строк: {job.stats.rows}",
+            write_timeout=EXPORT_UPLOAD_TIMEOUT
+        )
+    except asyncio.CancelledError:
+        # Выгрузка не продолжается после рестарта: недоделанная просто отменяется
+        await db.run(jobstore.set_job_status, job.id, 'cancelled')
+        if not jobs.stopping:
+            await bot.send_message(job.owner_id, f"⛔ Выгрузка #{job.id} отменена.")
+        raise
+    except Exception as e:
+        await db.run(jobstore.set_job_status, job.id, 'failed')
+        await bot.send_message(job.owner_id, f"❌ Выгрузка #{job.id} не удалась: {e}")
+        raise
+    await db.run(jobstore.set_job_status, job.id, 'done')
+
 # ================== ГРУППЫ ==================
 
-async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.new_chat_members:
-        for member in update.message.new_chat_members:
-            if member.id == context.bot.id:
-                chat = update.effective_chat
-                add_group_to_db(chat.id, chat.title or f"Group {chat.id}")
-                await update.message.reply_text("🤖 Спасибо за добавление! Я готов к работе.")
+# Состав групп отслеживается по апдейтам my_chat_member (бота добавили, удалили, повысили)
+# и служебным сообщениям о переименовании и миграции; обычная переписка групп боту не нужна
 
-# ================== ЗАПУСК ==================
+PRESENT_STATUSES = (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER)
 
-def main():
-    init_db()
-    load_admins_from_db()
+def is_present(member) -> bool:
+    if member.status == ChatMember.RESTRICTED:
+        return member.is_member
+    return member.status in PRESENT_STATUSES
+
+async def track_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    change = update.my_chat_member
+    chat = change.chat
+    was_present, present = is_present(change.old_chat_member), is_present(change.new_chat_member)
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    name = bot_name(context.bot)
+    if chat.type == chat.PRIVATE:
+        if was_present != present:
+            await set_user_active(chat.id, present, name)
+        return
+    if chat.type not in (chat.GROUP, chat.SUPERGROUP):
+        return
+
+    if present:
+        await add_group_to_db(chat.id, chat.title or f"Group {chat.id}", name)
+        if not was_present:
+            logger.info(f"Бота добавили в группу {chat.id}")
+            await context.bot.send_message(chat.id, "🤖 Спасибо за добавление! Я готов к работе.")
+    else:
+        logger.info(f"Бота удалили из группы {chat.id} ({change.new_chat_member.status})")
+        await remove_group_from_db(chat.id, name)
+
+async def handle_group_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await rename_group(update.effective_chat.id, update.message.new_chat_title, bot_name(context.bot))
+
+async def handle_group_migration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Сообщение приходит и в старую группу (migrate_to), и в новую супергруппу (migrate_from)
+    message = update.message
+    if message.migrate_to_chat_id:
+        old_chat_id, new_chat_id = message.chat_id, message.migrate_to_chat_id
+    else:
+        old_chat_id, new_chat_id = message.migrate_from_chat_id, message.chat_id
+    logger.info(f"Группа {old_chat_id} стала супергруппой {new_chat_id}")
+    await db.run(_migrate_group, old_chat_id, new_chat_id, bot_name(context.bot))
+
+# ================== ЗАПУСК ==================
+
+# Telegram присылает только эти типы апдейтов: без edited_message, channel_post, chat_member и т.п.
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.MY_CHAT_MEMBER]
+
+# Служебные циклы процесса (слежение за файлами, обслуживание базы), останавливаются в stop_services
+background_tasks = []
+
+metrics_server = MetricsServer(metrics, host=METRICS_HOST, port=METRICS_PORT) if METRICS_PORT else None
+
+async def start_services(primary: Application):
+    # Общие для всех ботов процесса службы запускаются один раз
+    await telemetry.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+    background_tasks.append(asyncio.create_task(menu.watch()))
+    background_tasks.append(asyncio.create_task(admins.watch()))
+    background_tasks.append(asyncio.create_task(retention.watch()))
+    background_tasks.append(asyncio.create_task(charts.watch(primary.bot)))
+
+async def stop_services():
+    # Останавливаем фоновые задачи, пока боты ещё могут отправить админу итог
+    await jobs.shutdown()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    if metrics_server is not None:
+        await metrics_server.stop()
+
+def webhook_route(name: str, base: str) -> str:
+    # Один бот — адрес как раньше; несколько — у каждого свой путь /<имя>
+    return base if len(applications) <= 1 else f"{base.rstrip('/')}/{name}"
+
+async def start_webhook(bots: dict):
+    # Апдейты всех ботов приходят на один HTTP-сервер, бот определяется по пути
+    # (модуль нужен только в этом режиме, поэтому импортируется здесь)
+    from webhook import WebhookServer
+
+    server = WebhookServer(
+        host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, secret_token=WEBHOOK_SECRET, max_connections=WEBHOOK_MAX_CONNECTIONS
+    )
+    for name, application in bots.items():
+        async def feed_update(data: dict, application=application):
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        server.add_route(webhook_route(name, WEBHOOK_PATH), feed_update)
+    await server.start()
+    if WEBHOOK_URL:
+        for name, application in bots.items():
+            await application.bot.set_webhook(
+                url=webhook_route(name, WEBHOOK_URL), secret_token=server.secret_token,
+                max_connections=WEBHOOK_MAX_CONNECTIONS, allowed_updates=ALLOWED_UPDATES
+            )
+    return server
+
+async def stop_application(application: Application):
+    # Перестаём принимать апдейты и дорабатываем очереди чатов, пока HTTP-клиент бота ещё открыт:
+    # Application.stop() не ждёт очередей, а shutdown() закрывает клиент раньше процессора
+    if application.updater is not None and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await application.update_processor.shutdown()
+
+async def run_bots(bots: dict):
+    # Все боты работают в одном event loop: общие база, лимитер рассылок, метрики и фоновые службы,
+    # у каждого бота свои Application, user_data и очередь апдейтов
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    for application in bots.values():
+        await application.initialize()
+    await start_services(next(iter(bots.values())))
+    server = None
+    try:
+        for application in bots.values():
+            await resume_broadcasts(application.bot)
+            await application.start()
+        if BOT_MODE == "webhook":
+            server = await start_webhook(bots)
+        else:
+            for application in bots.values():
+                await application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+        logger.info(f"Боты {', '.join(bots)} готовы к работе через {time.perf_counter() - STARTED_AT:.2f} с после запуска")
+        await stop_event.wait()
+    finally:
+        # Сначала перестаём принимать апдейты, дорабатываем очереди, затем общие службы
+        if server is not None:
+            await server.stop()
+        for application in bots.values():
+            await stop_application(application)
+        await stop_services()
+        for application in bots.values():
+            await application.shutdown()
+        # Сбрасываем накопленную телеметрию, чтобы не потерять последние нажатия
+        await telemetry.stop()
+
+def register_handlers(application: Application):
+    timed = metrics.instrument
+
+    # 0. Ограничение частоты — раньше всех остальных групп
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
 
     # 1. Сначала — команды (они имеют высший приоритет)
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(CommandHandler("start", timed("start", start)))
+    application.add_handler(CommandHandler("admin", timed("admin", admin_panel)))
+    application.add_handler(CommandHandler("jobs", timed("jobs", jobs_command)))
+    application.add_handler(CommandHandler("job", timed("job", job_status_command)))
+    application.add_handler(CommandHandler("cancel", timed("cancel", cancel_job_command)))
+    application.add_handler(CommandHandler("conversions", timed("conversions", conversions_command)))
+    application.add_handler(CommandHandler("metrics", timed("metrics", metrics_command)))
+    application.add_handler(CommandHandler("export", timed("export", export_command)))
 
     # 2. Потом — callback-обработчики
-    application.add_handler(CallbackQueryHandler(admin_callback_handler, pattern="^admin_"))
-    application.add_handler(CallbackQueryHandler(handle_menu, pattern="^(?!admin_).*$"))
+    application.add_handler(CallbackQueryHandler(timed("admin_callback", admin_callback_handler), pattern="^admin_"))
+    application.add_handler(CallbackQueryHandler(timed("menu", handle_menu, known_callbacks=menu), pattern="^(?!admin_).*$"))
 
     # 3. И только потом — обработчики "остальных сообщений"
     application.add_handler(MessageHandler(
-        filters.ChatType.PRIVATE & filters.User(user_id=list(ADMIN_IDS) if ADMIN_IDS else [INITIAL_ADMIN_ID]),
-        handle_admin_action_message
+        filters.ChatType.PRIVATE & admins.filter,
+        timed("admin_action", handle_admin_action_message)
     ))
 
-    # Группы
-    application.add_handler(MessageHandler(
-        filters.ChatType.GROUP | filters.ChatType.SUPERGROUP,
-        handle_group_message
-    ))
+    # Группы: только изменения состава и служебные сообщения
+    application.add_handler(ChatMemberHandler(timed("my_chat_member", track_my_chat_member), ChatMemberHandler.MY_CHAT_MEMBER))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_TITLE, timed("group_title", handle_group_title)))
+    application.add_handler(MessageHandler(filters.StatusUpdate.MIGRATE, timed("group_migration", handle_group_migration)))
+
+def build_application(name: str, token: str) -> Application:
+    processor = processors[name] = ChatOrderedProcessor(
+        UPDATE_CONCURRENCY, max_queued_per_chat=UPDATE_QUEUE_PER_CHAT,
+        on_drop=partial(metrics.inc, 'bot_updates_dropped_total', bot=name),
+    )
+    application = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(metrics, connection_pool_size=256))
+        # user_data (например, незавершённая рассылка админа) переживает рестарт; пишется пачками
+        .persistence(SqlitePersistence(db, bot=name))
+        # Параллельная обработка апдейтов с сохранением порядка внутри чата
+        .concurrent_updates(processor)
+        .build()
+    )
+    register_handlers(application)
+    applications[name] = application
+    return application
 
-    application.run_polling()
+def main():
+    if not BOT_CONFIGS:
+        raise SystemExit("Не задан BOT_TOKEN (или BOTS для нескольких ботов)")
+    if BOT_MODE == "webhook" and not (WEBHOOK_SECRET or WEBHOOK_URL):
+        # Вебхук зарегистрирован вне бота: сгенерированный секрет Telegram не узнает
+        raise SystemExit("Для BOT_MODE=webhook задайте WEBHOOK_SECRET (или WEBHOOK_URL, тогда секрет создаётся сам)")
+    started = time.perf_counter()
+    db.open()
+    db.run_sync(enable_incremental_vacuum)
+    db.run_sync(init_db)
+    admins.load()
+    logger.info(f"База готова за {time.perf_counter() - started:.3f} с")
+
+    bots = {name: build_application(name, token) for name, token in BOT_CONFIGS}
+    try:
+        asyncio.run(run_bots(bots))
+    finally:
+        db.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import re
+
+# Имя бота по умолчанию: им помечены все строки базы, записанные до появления нескольких ботов
+DEFAULT_BOT = 'main'
+
+NAME_PATTERN = re.compile(r'^[a-z0-9_]{1,32}$')
+
+# Несколько ботов (брендов) в одном процессе: общие база, лимитер рассылок и метрики,
+# а пользователи, группы, статистика, задачи и user_data каждого бота хранятся
+# с его именем в колонке bot.
+
+
+def parse_bots(text: str, default_token: str = None) -> list:
+    # "main=123:AAA,brand2=456:BBB" → [('main', '123:AAA'), ('brand2', '456:BBB')];
+    # пустая строка — один бот DEFAULT_BOT с default_token
+    bots = []
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, token = item.partition('=')
+        name, token = name.strip().lower(), token.strip()
+        if not sep or not token:
+            raise ValueError(f"ожидается имя=токен, получено «{item}»")
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"имя бота «{name}»: только a-z, 0-9 и _")
+        if any(name == other for other, _ in bots):
+            raise ValueError(f"бот «{name}» указан дважды")
+        bots.append((name, token))
+    if not bots and default_token:
+        bots.append((DEFAULT_BOT, default_token))
+    return bots
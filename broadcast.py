@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: ~30 сообщений в секунду на бота и не чаще 1 в секунду в один чат
+GLOBAL_RATE = 30
+# Запас токенов подряд: с большим ведром первая секунда шла бы с двойной скоростью
+GLOBAL_BURST = 1
+PER_CHAT_INTERVAL = 1.0
+SENDER_CONCURRENCY = 20
+MAX_ATTEMPTS = 5
+PROGRESS_INTERVAL = 3.0
+
+
+class TokenBucket:
+    # Глобальное ведро токенов: rate токенов в секунду, не больше capacity подряд
+
+    def __init__(self, rate: float = GLOBAL_RATE, capacity: float = GLOBAL_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # После 429 все отправители ждут, пока Telegram снимет ограничение. Токены за паузу
+        # не копятся: после неё отправка продолжается с обычной скоростью, без залпа
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = max(self._updated, self._paused_until)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatThrottle:
+    # Не чаще одного сообщения в секунду в один чат (важно для повторов)
+
+    def __init__(self, interval: float = PER_CHAT_INTERVAL):
+        self.interval = interval
+        self._next_allowed = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        allowed = self._next_allowed.get(chat_id, now)
+        self._next_allowed[chat_id] = max(allowed, now) + self.interval
+        if allowed > now:
+            await asyncio.sleep(allowed - now)
+
+    def forget(self, chat_id: int):
+        self._next_allowed.pop(chat_id, None)
+
+
+class BroadcastStats:
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retries = 0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def summary(self) -> str:
+        return (f"Успешно: {self.sent}\n"
+                f"Ошибок: {self.failed}\n"
+                f"Заблокировали бота: {self.blocked}")
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    delay = error.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+# BadRequest, который означает, что чата больше нет и повторять бессмысленно
+DEAD_CHAT_ERRORS = ('chat not found', 'user is deactivated', 'peer_id_invalid', 'group chat was deactivated')
+
+
+def is_dead_chat_error(error) -> bool:
+    text = str(error).lower()
+    return any(marker in text for marker in DEAD_CHAT_ERRORS)
+
+
+def message_payload(message, copy_only: bool = False) -> dict:
+    # Всё, что нужно для повторной отправки после рестарта, без объекта Message
+    payload = {'type': 'copy', 'from_chat_id': message.chat_id, 'message_id': message.message_id}
+    if copy_only:
+        return payload
+    if message.text:
+        payload.update(type='text', text=message.text)
+    elif message.photo:
+        payload.update(type='photo', file_id=message.photo[-1].file_id, caption=message.caption)
+    elif message.document:
+        payload.update(type='document', file_id=message.document.file_id, caption=message.caption)
+    return payload
+
+
+def make_sender(payload: dict):
+    # Выбираем способ отправки по типу исходного сообщения админа
+    kind = payload['type']
+    if kind == 'text':
+        return lambda bot, chat_id: bot.send_message(chat_id=chat_id, text=payload['text'], parse_mode="HTML")
+    if kind == 'photo':
+        return lambda bot, chat_id: bot.send_photo(chat_id=chat_id, photo=payload['file_id'], caption=payload['caption'])
+    if kind == 'document':
+        return lambda bot, chat_id: bot.send_document(chat_id=chat_id, document=payload['file_id'], caption=payload['caption'])
+    return lambda bot, chat_id: bot.copy_message(
+        chat_id=chat_id, from_chat_id=payload['from_chat_id'], message_id=payload['message_id']
+    )
+
+
+class Broadcaster:
+    # Пул отправителей с общим ведром токенов и повторами при RetryAfter/сетевых ошибках
+
+    def __init__(self, bot, bucket: TokenBucket = None, concurrency: int = SENDER_CONCURRENCY,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.bot = bot
+        self.bucket = bucket or TokenBucket()
+        self.throttle = ChatThrottle()
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+    async def run(self, recipients, send, stats: BroadcastStats = None, on_progress=None, on_result=None):
+        # recipients — обычный или асинхронный итератор id; on_result(chat_id, outcome) вызывается
+        # после каждой доставки, например для записи чекпоинта
+        stats = stats or BroadcastStats()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue, send, stats, on_result)) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self._report(stats, on_progress)) if on_progress else None
+        try:
+            if hasattr(recipients, '__aiter__'):
+                async for chat_id in recipients:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in recipients:
+                    await queue.put(chat_id)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if reporter is not None:
+                reporter.cancel()
+                await asyncio.gather(reporter, return_exceptions=True)
+        return stats
+
+    async def _worker(self, queue, send, stats, on_result):
+        while True:
+            chat_id = await queue.get()
+            try:
+                outcome = await self.deliver(chat_id, send, stats)
+                if on_result is not None:
+                    await on_result(chat_id, outcome)
+            except Exception as e:
+                logger.error(f"Ошибка обработки получателя {chat_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def deliver(self, chat_id: int, send, stats: BroadcastStats) -> str:
+        # Возвращает итог доставки: sent / blocked / failed
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            await self.throttle.wait(chat_id)
+            try:
+                await send(self.bot, chat_id)
+                stats.sent += 1
+                self.throttle.forget(chat_id)
+                return 'sent'
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logger.warning(f"Флуд-лимит при отправке в {chat_id}, ждём {delay} c")
+                self.bucket.pause(delay)
+                stats.retries += 1
+            except (Forbidden, ChatMigrated) as e:
+                # ChatMigrated: группа стала супергруппой, по старому id сообщения больше не доходят
+                logger.info(f"Чат {chat_id} недоступен: {e}")
+                stats.blocked += 1
+                self.throttle.forget(chat_id)
+                return 'blocked'
+            except BadRequest as e:
+                if is_dead_chat_error(e):
+                    logger.info(f"Чат {chat_id} недоступен: {e}")
+                    stats.blocked += 1
+                    self.throttle.forget(chat_id)
+                    return 'blocked'
+                logger.error(f"Ошибка отправки в {chat_id}: {e}")
+                break
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Сетевая ошибка при отправке в {chat_id} (попытка {attempt}): {e}")
+                stats.retries += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                logger.error(f"Ошибка отправки в {chat_id}: {e}")
+                break
+        stats.failed += 1
+        self.throttle.forget(chat_id)
+        return 'failed'
+
+    async def _report(self, stats, on_progress):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            try:
+                await on_progress(stats)
+            except Exception as e:
+                logger.debug(f"Не удалось обновить прогресс рассылки: {e}")
+
+
+def progress_editor(progress_message, title: str):
+    # Живой прогресс: редактируем одно сообщение админа, пропуская неизменившийся текст
+    last_text = None
+
+    async def on_progress(stats: BroadcastStats):
+        nonlocal last_text
+        text = f"{title}\n🔄 Обработано: {stats.done}/{stats.total}\n{stats.summary()}"
+        if text != last_text:
+            last_text = text
+            await progress_message.edit_text(text)
+
+    return on_progress
@@ -0,0 +1,134 @@
+import asyncio
+import importlib.util
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 600.0
+
+# Экран меню → период графика в днях
+CHART_PERIODS = {'stats_30': 30, 'stats_7': 7}
+CHART_TITLES = {'stats_30': "Click2Reg / Reg2Dep за 30 дней", 'stats_7': "Click2Reg / Reg2Dep за 7 дней"}
+
+# Конверсии заносят админы (/conversions); любое изменение таблицы увеличивает версию данных,
+# а готовые графики кэшируются как Telegram file_id по ключу (экран, версия).
+# Таблицы и триггеры создаёт миграция migrations._chart_cache
+
+
+def data_version(conn) -> int:
+    return conn.execute("SELECT value FROM meta WHERE key = 'conversions_version'").fetchone()[0]
+
+
+def upsert_conversions(conn, day: str, clicks: int, registrations: int, deposits: int):
+    conn.execute('''
+        INSERT INTO conversion_stats (date, clicks, registrations, deposits) VALUES (?, ?, ?, ?)
+        ON CONFLICT(date) DO UPDATE SET
+            clicks = excluded.clicks, registrations = excluded.registrations, deposits = excluded.deposits
+    ''', (day, clicks, registrations, deposits))
+
+
+def load_rows(conn, days: int):
+    # Окно отсчитывается от последнего занесённого дня, поэтому график зависит только от данных
+    return conn.execute(
+        '''SELECT date, clicks, registrations, deposits FROM conversion_stats
+           WHERE date > date((SELECT MAX(date) FROM conversion_stats), ?)
+           ORDER BY date''',
+        (f'-{days} days',)
+    ).fetchall()
+
+
+def load_cached(conn, version: int) -> dict:
+    rows = conn.execute('SELECT screen, file_id FROM chart_cache WHERE data_version = ?', (version,)).fetchall()
+    return dict(rows)
+
+
+def save_file_id(conn, screen: str, version: int, file_id: str):
+    conn.execute(
+        'INSERT OR REPLACE INTO chart_cache (screen, data_version, file_id) VALUES (?, ?, ?)',
+        (screen, version, file_id)
+    )
+    # Графики старых версий больше не покажутся
+    conn.execute('DELETE FROM chart_cache WHERE screen = ? AND data_version < ?', (screen, version))
+
+
+def charts_supported() -> bool:
+    return importlib.util.find_spec('matplotlib') is not None
+
+
+def render_chart(title: str, rows) -> bytes:
+    # matplotlib тяжёлый и нужен только фоновой задаче, поэтому импортируется здесь
+    from matplotlib.figure import Figure
+
+    days = [row[0][5:] for row in rows]
+    click2reg = [100.0 * regs / clicks if clicks else 0.0 for _, clicks, regs, _ in rows]
+    reg2dep = [100.0 * deps / regs if regs else 0.0 for _, _, regs, deps in rows]
+
+    figure = Figure(figsize=(8, 4.5), dpi=100)
+    axes = figure.subplots()
+    axes.plot(days, click2reg, marker='o', label='Click2Reg, %')
+    axes.plot(days, reg2dep, marker='o', label='Reg2Dep, %')
+    axes.set_title(title)
+    axes.grid(alpha=0.3)
+    axes.legend()
+    axes.tick_params(axis='x', labelrotation=45)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+class ChartService:
+    # Рендер и загрузка идут в фоне; нажатие на экран только берёт file_id из памяти
+
+    def __init__(self, storage, upload_chat_id: int, render=render_chart):
+        # render=None отключает графики (например, если matplotlib не установлен)
+        self.storage = storage
+        self.upload_chat_id = upload_chat_id
+        self.render = render
+        self.enabled = bool(upload_chat_id) and render is not None
+        self.version = None
+        self._file_ids = {}
+        self._refreshing = None
+        if not self.enabled:
+            logger.info("Графики отключены: нет matplotlib или ADMIN_CHAT_ID")
+
+    def file_id(self, screen_id: str):
+        return self._file_ids.get(screen_id)
+
+    async def refresh(self, bot):
+        if not self.enabled:
+            return
+        version = await self.storage.run(data_version)
+        cached = await self.storage.run(load_cached, version)
+        for screen_id, days in CHART_PERIODS.items():
+            if screen_id in cached:
+                continue
+            rows = await self.storage.run(load_rows, days)
+            if not rows:
+                continue
+            png = await asyncio.to_thread(self.render, CHART_TITLES[screen_id], rows)
+            # Загружаем картинку один раз; дальше Telegram отдаёт её по file_id
+            message = await bot.send_photo(self.upload_chat_id, photo=png, disable_notification=True)
+            cached[screen_id] = message.photo[-1].file_id
+            await self.storage.run(save_file_id, screen_id, version, cached[screen_id])
+            logger.info(f"График {screen_id} обновлён (версия данных {version})")
+        self._file_ids = cached
+        self.version = version
+
+    def schedule_refresh(self, bot):
+        # Не больше одного обновления одновременно
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._safe_refresh(bot))
+        return self._refreshing
+
+    async def _safe_refresh(self, bot):
+        try:
+            await self.refresh(bot)
+        except Exception as e:
+            logger.error(f"Не удалось обновить графики: {e}")
+
+    async def watch(self, bot, interval: float = REFRESH_INTERVAL):
+        while True:
+            await self.schedule_refresh(bot)
+            await asyncio.sleep(interval)
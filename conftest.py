@@ -0,0 +1,20 @@
+import pytest
+
+from bot import init_db
+from storage import Storage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    # Открытая база без схемы: для тестов миграций, старых баз и самого Storage
+    db = Storage(str(tmp_path / 'stats.db'))
+    db.open()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def db(storage):
+    # База со схемой последней версии
+    storage.run_sync(init_db)
+    return storage
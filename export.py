@@ -0,0 +1,153 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import tempfile
+from datetime import date, timedelta
+from itertools import chain
+
+from analytics import utc_today
+from bots import DEFAULT_BOT
+
+EXPORT_CHUNK = 2000
+# Сжатый файл до этого размера держится в памяти, дальше SpooledTemporaryFile уходит на диск
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+# Bot API не принимает документы больше 50 МБ
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+# Выгрузки для админов. Строки читаются из базы порциями (keyset по ключу сортировки,
+# короткий запрос на порцию), каждая порция кодируется генератором в CSV/JSONL и сразу
+# сжимается в gzip во временный файл. В памяти одновременно только одна порция,
+# сколько бы строк ни было в таблице. Выгружаются строки бота, через которого пришла команда.
+
+# имя выгрузки: (таблица, колонки, ключ keyset-сортировки, колонка для фильтра по датам)
+EXPORT_TABLES = {
+    'users': ('users', ('user_id', 'first_seen', 'active', 'blocked_at'), ('first_seen', 'user_id'), 'first_seen'),
+    'groups': ('groups', ('chat_id', 'title', 'added_at', 'active', 'blocked_at'), ('chat_id',), 'added_at'),
+    'activity': ('command_stats', ('id', 'user_id', 'command', 'timestamp'), ('timestamp', 'id'), 'timestamp'),
+    'daily': ('user_activity', ('user_id', 'date', 'actions_count'), ('date', 'user_id'), 'date'),
+}
+
+EXPORT_HINT = ("Использование: /export <таблица> [csv|jsonl] [с YYYY-MM-DD] [по YYYY-MM-DD]\n"
+               f"Таблицы: {', '.join(EXPORT_TABLES)}")
+
+
+def csv_lines(columns, rows, header: bool = False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in chain([columns], rows) if header else rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def jsonl_lines(columns, rows, header: bool = False):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+
+
+FORMATS = {'csv': csv_lines, 'jsonl': jsonl_lines}
+
+
+def parse_export_args(args):
+    # ['activity', 'jsonl', '2024-05-01'] → ('activity', 'jsonl', '2024-05-01', None); ошибки — ValueError
+    if not args or args[0] not in EXPORT_TABLES:
+        raise ValueError("укажите таблицу")
+    name, fmt, dates = args[0], 'csv', []
+    for arg in args[1:]:
+        if arg in FORMATS:
+            fmt = arg
+            continue
+        try:
+            dates.append(date.fromisoformat(arg).isoformat())
+        except ValueError:
+            raise ValueError(f"непонятный параметр «{arg}»") from None
+    if len(dates) > 2:
+        raise ValueError("не больше двух дат")
+    date_from, date_to = (dates + [None, None])[:2]
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("начало периода позже конца")
+    return name, fmt, date_from, date_to
+
+
+def export_filename(name: str, fmt: str, date_from: str = None, date_to: str = None) -> str:
+    period = f"_{date_from or 'start'}_{date_to or utc_today().isoformat()}" if date_from or date_to else ''
+    return f"{name}{period}.{fmt}.gz"
+
+
+def fetch_chunk(conn, name: str, after, date_from: str, date_to: str, limit: int, bot: str = DEFAULT_BOT):
+    # Порция строк после курсора after (значения ключа сортировки последней строки)
+    table, columns, order, date_column = EXPORT_TABLES[name]
+    conditions, params = ['bot = ?'], [bot]
+    if after is not None:
+        conditions.append(f"({', '.join(order)}) > ({', '.join('?' * len(order))})")
+        params.extend(after)
+    if date_from:
+        conditions.append(f'{date_column} >= ?')
+        params.append(date_from)
+    if date_to:
+        # Конец периода включительно: до начала следующего дня (подходит и для DATE, и для DATETIME)
+        conditions.append(f'{date_column} < ?')
+        params.append((date.fromisoformat(date_to) + timedelta(days=1)).isoformat())
+    return conn.execute(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {', '.join(order)} LIMIT ?",
+        (*params, limit)
+    ).fetchall()
+
+
+async def iter_chunks(storage, name: str, date_from: str = None, date_to: str = None, chunk: int = EXPORT_CHUNK,
+                      bot: str = DEFAULT_BOT):
+    _, columns, order, _ = EXPORT_TABLES[name]
+    positions = [columns.index(column) for column in order]
+    after = None
+    while True:
+        rows = await storage.run(fetch_chunk, name, after, date_from, date_to, chunk, bot)
+        if not rows:
+            return
+        yield rows
+        after = tuple(rows[-1][i] for i in positions)
+
+
+def write_chunk(archive, fmt: str, columns, rows, header: bool):
+    archive.write(''.join(FORMATS[fmt](columns, rows, header)).encode('utf-8'))
+
+
+class ExportStats:
+
+    def __init__(self):
+        self.rows = 0
+        self.size = 0
+
+    def summary(self) -> str:
+        return f"Выгружено строк: {self.rows}"
+
+
+async def export_table(storage, name: str, fmt: str = 'csv', date_from: str = None, date_to: str = None,
+                       stats: ExportStats = None, chunk: int = EXPORT_CHUNK, bot: str = DEFAULT_BOT):
+    # Возвращает открытый временный файл с gzip-выгрузкой (позиция в начале); закрывает вызывающий
+    columns = EXPORT_TABLES[name][1]
+    stats = stats or ExportStats()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        with gzip.GzipFile(filename=export_filename(name, fmt, date_from, date_to)[:-3],
+                           fileobj=spool, mode='wb') as archive:
+            header = fmt == 'csv'
+            async for rows in iter_chunks(storage, name, date_from, date_to, chunk, bot):
+                # Кодирование и сжатие — вне event loop, как запись архивов в retention
+                await asyncio.to_thread(write_chunk, archive, fmt, columns, rows, header)
+                header = False
+                stats.rows += len(rows)
+            if header:
+                # Пустая выгрузка CSV всё равно содержит заголовок
+                await asyncio.to_thread(write_chunk, archive, fmt, columns, [], True)
+        stats.size = spool.tell()
+        if stats.size > MAX_DOCUMENT_SIZE:
+            raise ValueError(f"файл больше {MAX_DOCUMENT_SIZE // (1024 * 1024)} МБ, сузьте период")
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
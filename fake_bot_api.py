@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+from email.parser import BytesParser
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+# Локальная замена api.telegram.org для нагрузочных прогонов: бот ходит сюда через
+# Application.builder().base_url(f"http://127.0.0.1:{port}/bot"), сервер отвечает
+# правдоподобными объектами, добавляет задержку и 429 и запоминает все вызовы
+
+BOT_USER = {'id': 100000, 'is_bot': True, 'first_name': 'Partner Bot', 'username': 'partner_bench_bot'}
+
+# Методы, которые не ограничиваются искусственными 429 (служебные и long polling)
+UNLIMITED_METHODS = {'getMe', 'getUpdates', 'setWebhook', 'deleteWebhook', 'close', 'logOut'}
+
+MAX_BODY_SIZE = 20 * 1024 * 1024
+
+
+class FakeBotApi:
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit_ratio: float = 0.0, retry_after: int = 1, blocked_chats=(), seed: int = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.blocked_chats = set(blocked_chats)
+        self.calls = []
+        self.counts = Counter()
+        self.rate_limited = Counter()
+        self.updates = asyncio.Queue()
+        self._random = random.Random(seed)
+        self._message_ids = Counter()
+        self._next_update_id = 1
+        self._server = None
+        self._connections = set()
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Тестовый Bot API слушает {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    # ---------- для драйвера ----------
+
+    def push_update(self, update: dict):
+        # Апдейт, который бот получит через getUpdates
+        update.setdefault('update_id', self._next_update_id)
+        self._next_update_id = max(self._next_update_id, update['update_id']) + 1
+        self.updates.put_nowait(update)
+
+    def last_message_id(self, chat_id: int) -> int:
+        return self._message_ids[chat_id]
+
+    def reset(self):
+        self.calls.clear()
+        self.counts.clear()
+        self.rate_limited.clear()
+
+    # ---------- HTTP ----------
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                if not await self._handle_request(request_line, reader, writer):
+                    break
+        except (asyncio.CancelledError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _handle_request(self, request_line: bytes, reader, writer) -> bool:
+        method, target, version = request_line.decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            await self._respond(writer, 413, {'ok': False, 'error_code': 413, 'description': 'Request Entity Too Large'}, False)
+            return False
+        body = await reader.readexactly(length) if length else b''
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        # /bot<token>/<method>
+        parts = target.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            await self._respond(writer, 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}, keep_alive)
+            return keep_alive
+        api_method = parts[1]
+        params = parse_params(headers.get('content-type', ''), body)
+
+        status, payload = await self.call(api_method, params)
+        await self._respond(writer, status, payload, keep_alive)
+        return keep_alive
+
+    async def _respond(self, writer, status: int, payload: dict, keep_alive: bool):
+        body = json.dumps(payload).encode()
+        connection = 'keep-alive' if keep_alive else 'close'
+        writer.write(
+            f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {connection}\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    # ---------- методы Bot API ----------
+
+    async def call(self, method: str, params: dict):
+        self.calls.append((time.monotonic(), method, params))
+        self.counts[method] += 1
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': await self._get_updates(params)}
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if method not in UNLIMITED_METHODS and self._random.random() < self.rate_limit_ratio:
+            self.rate_limited[method] += 1
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        chat_id = _int(params.get('chat_id'))
+        if chat_id in self.blocked_chats:
+            return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+
+        handler = getattr(self, f'_api_{method}', None)
+        result = handler(params) if handler else True
+        return 200, {'ok': True, 'result': result}
+
+    async def _get_updates(self, params: dict):
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout) if timeout else self.updates.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        batch = [first]
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def _message(self, params: dict, **fields) -> dict:
+        chat_id = _int(params.get('chat_id'))
+        message_id = _int(params.get('message_id'))
+        if message_id is None:
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+        message = {'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                   'chat': {'id': chat_id, 'type': 'private' if chat_id and chat_id > 0 else 'supergroup'}}
+        message.update(fields)
+        return message
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_sendMessage(self, params):
+        return self._message({'chat_id': params.get('chat_id')}, text=params.get('text', ''))
+
+    def _api_editMessageText(self, params):
+        if 'inline_message_id' in params:
+            return True
+        return self._message(params, text=params.get('text', ''))
+
+    def _api_editMessageMedia(self, params):
+        return self._message(params, photo=[_photo_size()])
+
+    def _api_sendPhoto(self, params):
+        return self._message({'chat_id': params.get('chat_id')}, photo=[_photo_size()])
+
+    def _api_sendDocument(self, params):
+        return self._message({'chat_id': params.get('chat_id')},
+                             document={'file_id': 'document', 'file_unique_id': 'document'})
+
+    def _api_copyMessage(self, params):
+        return {'message_id': self._message({'chat_id': params.get('chat_id')})['message_id']}
+
+
+def _photo_size() -> dict:
+    return {'file_id': f'photo-{time.monotonic_ns()}', 'file_unique_id': 'photo', 'width': 800, 'height': 450}
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_params(content_type: str, body: bytes) -> dict:
+    # PTB шлёт обычные запросы как form-urlencoded, загрузку файлов — как multipart
+    if not body:
+        return {}
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser().parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body)
+        params = {}
+        for part in message.get_payload():
+            if part.get_filename() is None:
+                params[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True).decode()
+        return params
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    return dict(parse_qsl(body.decode()))
@@ -0,0 +1,75 @@
+import time
+
+# Лимиты по классам апдейтов: (токенов в секунду, размер пачки подряд)
+DEFAULT_LIMITS = {
+    'callback': (2.0, 6),
+    'command': (0.5, 3),
+    'message': (1.0, 5),
+}
+SWEEP_INTERVAL = 60.0
+
+
+class FloodControl:
+    # Ведро токенов на каждого пользователя и класс апдейта. Проверка — одно обращение к dict;
+    # ведро, которое успело наполниться до краёв, ничем не отличается от нового и удаляется
+
+    def __init__(self, limits: dict = None, clock=time.monotonic, sweep_interval: float = SWEEP_INTERVAL):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        # kind → {user_id: (токены, время обновления)}
+        self._buckets = {kind: {} for kind in self.limits}
+        self._next_sweep = clock() + sweep_interval
+
+    def allow(self, user_id: int, kind: str) -> bool:
+        limit = self.limits.get(kind)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = self.clock()
+        if now >= self._next_sweep:
+            self.sweep(now)
+        buckets = self._buckets[kind]
+        tokens, updated = buckets.get(user_id, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            buckets[user_id] = (tokens, now)
+            return False
+        buckets[user_id] = (tokens - 1, now)
+        return True
+
+    def sweep(self, now: float = None):
+        now = self.clock() if now is None else now
+        self._next_sweep = now + self.sweep_interval
+        for kind, buckets in self._buckets.items():
+            rate, burst = self.limits[kind]
+            idle = [user_id for user_id, (tokens, updated) in buckets.items()
+                    if tokens + (now - updated) * rate >= burst]
+            for user_id in idle:
+                del buckets[user_id]
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+
+def parse_limits(text: str) -> dict:
+    # "callback=2/6,command=0.5/3" → {'callback': (2.0, 6), 'command': (0.5, 3)}
+    limits = {}
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        kind, _, value = item.partition('=')
+        rate, _, burst = value.partition('/')
+        limits[kind.strip()] = (float(rate), int(burst or 1))
+    return limits
+
+
+def update_kind(update):
+    # Класс апдейта для лимитов: нажатие кнопки, команда или обычное сообщение;
+    # остальное (например, my_chat_member) не ограничивается
+    if update.callback_query is not None:
+        return 'callback'
+    message = update.message
+    if message is None:
+        return None
+    if message.text and message.text.startswith('/'):
+        return 'command'
+    return 'message'
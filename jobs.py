@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_FINISHED_JOBS = 50
+
+STATUS_LABELS = {
+    'running': '🔄 выполняется',
+    'done': '✅ завершена',
+    'cancelled': '⛔ отменена',
+    'failed': '❌ ошибка',
+}
+
+
+class Job:
+
+    def __init__(self, job_id: int, kind: str, owner_id: int):
+        self.id = job_id
+        self.kind = kind
+        self.owner_id = owner_id
+        self.status = 'running'
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.stats = None
+        self.error = None
+        self.task = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status != 'running'
+
+    def describe(self) -> str:
+        lines = [f"🆔 Задача #{self.id} ({self.kind}): {STATUS_LABELS[self.status]}",
+                 f"Запущена: {self.created_at:%d.%m %H:%M:%S}"]
+        if self.finished_at:
+            lines.append(f"Завершена: {self.finished_at:%d.%m %H:%M:%S}")
+        if self.stats is not None:
+            if getattr(self.stats, 'total', None):
+                lines.append(f"Обработано: {self.stats.done}/{self.stats.total}")
+            lines.append(self.stats.summary())
+        if self.error:
+            lines.append(f"Ошибка: {self.error}")
+        return "\n".join(lines)
+
+
+class JobManager:
+    # Долгие админские задачи (рассылки, выгрузки) выполняются отдельными asyncio-задачами,
+    # поэтому обработчик апдейта сразу возвращается, а диспетчер остаётся свободным.
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self.stopping = False
+
+    def start(self, job_id: int, kind: str, owner_id: int, fn) -> Job:
+        # job_id выдаёт таблица jobs; fn(job) — корутина, которая делает работу и обновляет job.stats
+        job = Job(job_id, kind, owner_id)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, fn))
+        self._evict_finished()
+        return job
+
+    async def _run(self, job: Job, fn):
+        try:
+            await fn(job)
+            job.status = 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as e:
+            logger.error(f"Задача #{job.id} ({job.kind}) упала: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now()
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: int):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return list(self._jobs.values())
+
+    def running(self):
+        return [job for job in self._jobs.values() if not job.finished]
+
+    def cancel(self, job_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.task.cancel()
+        return True
+
+    async def shutdown(self):
+        # Флаг отличает остановку процесса от отмены админом: такие задачи продолжатся после рестарта
+        self.stopping = True
+        tasks = [job.task for job in self.running()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import time
+
+from bots import DEFAULT_BOT
+
+# Рассылки и статус доставки каждому получателю хранятся в stats.db,
+# поэтому после рестарта воркера задача продолжается с того же места.
+
+CHECKPOINT_SIZE = 200
+CHECKPOINT_INTERVAL = 2.0
+PENDING_CHUNK = 500
+
+MIN_CHAT_ID = -(2 ** 63)
+
+
+# Откуда берутся получатели каждого вида рассылки: таблица и её ключ
+RECIPIENT_TABLES = {
+    'broadcast_users': ('users', 'user_id'),
+    'broadcast_groups': ('groups', 'chat_id'),
+}
+
+
+def recipients_sql(kind: str) -> str:
+    # Параметр — имя бота; недоступные чаты (active = 0) отсекаются индексом idx_<table>_active
+    table, key = RECIPIENT_TABLES[kind]
+    return f'SELECT {key} AS chat_id FROM {table} WHERE bot = ? AND active = 1'
+
+
+def create_broadcast_job(conn, kind: str, owner_id: int, payload: dict, segment: dict = None,
+                         bot: str = DEFAULT_BOT) -> int:
+    # Задача создаётся в статусе preparing: получатели копируются в неё отдельными порциями
+    cursor = conn.execute(
+        "INSERT INTO jobs (kind, owner_id, payload, segment, bot, status) VALUES (?, ?, ?, ?, ?, 'preparing')",
+        (kind, owner_id, json.dumps(payload, ensure_ascii=False), json.dumps(segment or {}, ensure_ascii=False), bot)
+    )
+    return cursor.lastrowid
+
+
+def create_job(conn, kind: str, owner_id: int, payload: dict, bot: str = DEFAULT_BOT) -> int:
+    # Задача без получателей (выгрузка): только номер и статус для /jobs
+    cursor = conn.execute(
+        'INSERT INTO jobs (kind, owner_id, payload, bot) VALUES (?, ?, ?, ?)',
+        (kind, owner_id, json.dumps(payload, ensure_ascii=False), bot)
+    )
+    return cursor.lastrowid
+
+
+def snapshot_chunk(conn, job_id: int, sql: str, after_chat_id, limit: int, params=()):
+    # Одна порция снимка получателей: keyset по chat_id, короткая транзакция
+    rows = conn.execute(
+        f'SELECT chat_id FROM ({sql}) WHERE chat_id > ? ORDER BY chat_id LIMIT ?',
+        (*params, after_chat_id, limit)
+    ).fetchall()
+    conn.executemany(
+        'INSERT OR IGNORE INTO broadcast_deliveries (job_id, chat_id) VALUES (?, ?)',
+        [(job_id, row[0]) for row in rows]
+    )
+    return rows[-1][0] if rows else None
+
+
+def last_snapshot_chat_id(conn, job_id: int):
+    row = conn.execute('SELECT MAX(chat_id) FROM broadcast_deliveries WHERE job_id = ?', (job_id,)).fetchone()
+    return row[0] if row[0] is not None else MIN_CHAT_ID
+
+
+async def snapshot_recipients(storage, job_id: int, sql: str, params=(), chunk: int = PENDING_CHUNK):
+    # После рестарта снимок продолжается с последнего скопированного chat_id
+    last_chat_id = await storage.run(last_snapshot_chat_id, job_id)
+    while last_chat_id is not None:
+        last_chat_id = await storage.run(snapshot_chunk, job_id, sql, last_chat_id, chunk, params)
+    await storage.run(set_job_status, job_id, 'running')
+
+
+def unfinished_jobs(conn, bot: str = DEFAULT_BOT):
+    # Продолжаются после рестарта только рассылки; каждый бот продолжает свои
+    rows = conn.execute(
+        f"""SELECT id, kind, owner_id, payload, segment FROM jobs
+            WHERE status IN ('preparing', 'running') AND bot = ?
+              AND kind IN ({', '.join('?' * len(RECIPIENT_TABLES))})
+            ORDER BY id""",
+        (bot, *RECIPIENT_TABLES)
+    ).fetchall()
+    return [(job_id, kind, owner_id, json.loads(payload), json.loads(segment or '{}'))
+            for job_id, kind, owner_id, payload, segment in rows]
+
+
+def job_status(conn, job_id: int):
+    row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return row[0] if row else None
+
+
+def set_job_status(conn, job_id: int, status: str):
+    finished_at = "CURRENT_TIMESTAMP" if status not in ('preparing', 'running') else "NULL"
+    conn.execute(f'UPDATE jobs SET status = ?, finished_at = {finished_at} WHERE id = ?', (status, job_id))
+
+
+def delivery_counts(conn, job_id: int) -> dict:
+    rows = conn.execute(
+        'SELECT status, COUNT(*) FROM broadcast_deliveries WHERE job_id = ? GROUP BY status',
+        (job_id,)
+    ).fetchall()
+    return dict(rows)
+
+
+def fetch_pending(conn, job_id: int, after_chat_id, limit: int):
+    rows = conn.execute(
+        '''SELECT chat_id FROM broadcast_deliveries
+           WHERE job_id = ? AND status = 'pending' AND chat_id > ?
+           ORDER BY chat_id LIMIT ?''',
+        (job_id, after_chat_id, limit)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def save_outcomes(conn, job_id: int, outcomes, prune_table=None):
+    # Уже отмеченных получателей не трогаем: отправленное не переотправляется
+    conn.executemany(
+        "UPDATE broadcast_deliveries SET status = ? WHERE job_id = ? AND chat_id = ? AND status = 'pending'",
+        [(status, job_id, chat_id) for chat_id, status in outcomes]
+    )
+    # Чаты, где бот заблокирован или удалён, выключаем — следующие рассылки их пропустят.
+    # Чат выключается только у бота, который делал рассылку
+    blocked = [(job_id, chat_id) for chat_id, status in outcomes if status == 'blocked']
+    if prune_table and blocked:
+        table, key = prune_table
+        conn.executemany(
+            f'''UPDATE {table} SET active = 0, blocked_at = CURRENT_TIMESTAMP
+                WHERE bot = (SELECT bot FROM jobs WHERE id = ?) AND {key} = ? AND active = 1''',
+            blocked
+        )
+
+
+async def iter_pending(storage, job_id: int, chunk: int = PENDING_CHUNK):
+    # Keyset-пагинация по ещё не обработанным получателям
+    last_chat_id = MIN_CHAT_ID
+    while True:
+        chat_ids = await storage.run(fetch_pending, job_id, last_chat_id, chunk)
+        if not chat_ids:
+            return
+        for chat_id in chat_ids:
+            yield chat_id
+        last_chat_id = chat_ids[-1]
+
+
+class DeliveryCheckpoint:
+    # Итоги доставки копятся и записываются пачками, а не коммитом на каждого получателя
+
+    def __init__(self, storage, job_id: int, prune_table=None, batch_size: int = CHECKPOINT_SIZE,
+                 interval: float = CHECKPOINT_INTERVAL):
+        self.storage = storage
+        self.job_id = job_id
+        self.prune_table = prune_table
+        self.batch_size = batch_size
+        self.interval = interval
+        self._outcomes = []
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def record(self, chat_id: int, status: str):
+        self._outcomes.append((chat_id, status))
+        if len(self._outcomes) >= self.batch_size or time.monotonic() - self._last_flush >= self.interval:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._outcomes:
+                return
+            outcomes, self._outcomes = self._outcomes, []
+            try:
+                await self.storage.run(save_outcomes, self.job_id, outcomes, self.prune_table)
+            except Exception:
+                self._outcomes[:0] = outcomes
+                raise
@@ -0,0 +1,450 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, LinkPreviewOptions
+
+logger = logging.getLogger(__name__)
+
+MAIN_MENU = 'main_menu'
+DEFAULT_BACK_LABEL = "◀️ Назад"
+RELOAD_INTERVAL = 5.0
+
+# Последний показанный экран в сообщении и окно защиты от двойных нажатий
+RENDERED_CACHE_SIZE = 10000
+RENDERED_TTL = 3600.0
+DEBOUNCE_WINDOW = 1.0
+
+# Экраны меню описаны данными: id — это callback_data кнопки, которая ведёт на экран,
+# parent — куда ведёт кнопка «Назад» (добавляется автоматически, подпись — back).
+# Тот же формат принимает JSON-файл MENU_FILE для горячей замены без рестарта.
+SCREENS = [
+    {
+        'id': 'main_menu',
+        'parent': None,
+        'text': "🏠 Главное меню. Выбери, что тебя интересует:",
+        'buttons': [
+            [{'text': '📋 О платформе', 'callback': 'menu_about'}],
+            [{'text': '💼 Условия работы', 'callback': 'menu_conditions'}],
+            [{'text': '📞 Контакты поддержки', 'callback': 'menu_contacts'}],
+            [{'text': '📚 Полезные материалы', 'callback': 'menu_materials'}],
+            [{'text': '❓ FAQ', 'callback': 'menu_faq'}],
+            [{'text': '📊 Статистика: 30 дней', 'callback': 'stats_30'}, {'text': '📈 Статистика: 7 дней', 'callback': 'stats_7'}],
+        ],
+    },
+    {
+        'id': 'menu_about',
+        'parent': 'main_menu',
+        'parse_mode': 'HTML',
+        'disable_preview': True,
+        'text': (
+            "<b>🚀 О нашей платформе</b>\n\n"
+            "🔥 <a href='https://wincraft.casino/'>Wincraft Casino</a> — это динамично развивающийся бренд, "
+            "который за короткий срок стал узнаваемым и востребованным среди партнёров и игроков по всему миру.\n\n"
+            "💎 Мы не просто следуем трендам — мы создаём их. Наша команда оперативно адаптирует продукт под "
+            "современные ожидания аудитории, внедряя инновации и сохраняя высочайший уровень сервиса.\n\n"
+            "🤝 Каждому партнёру — индивидуальный подход. Мы верим, что успех строится на доверии, "
+            "прозрачности и гибкости. Готовы расти вместе с вами!\n\n"
+            "🔗 <b>Наша платформа:</b> https://wincraft.casino/\n"
+            "🔗 <b>Партнёрская программа:</b> https://affwin.partners/"
+        ),
+    },
+    {
+        'id': 'menu_conditions',
+        'parent': 'main_menu',
+        'parse_mode': 'HTML',
+        'text': (
+            "<b>💼 Условия работы</b>\n\nВыберите модель сотрудничества:"
+        ),
+        'buttons': [
+            [{'text': '💰 CPA', 'callback': 'conditions_cpa'}],
+            [{'text': '📊 RS', 'callback': 'conditions_rs'}],
+            [{'text': '🔄 Hybrid', 'callback': 'conditions_hybrid'}],
+        ],
+    },
+    {
+        'id': 'conditions_cpa',
+        'parent': 'menu_conditions',
+        'back': '◀️ Назад к условиям',
+        'parse_mode': 'HTML',
+        'text': (
+            "<b>💰 Модель CPA (Cost Per Action)</b>\n\n"
+            "✅ <b>Преимущества:</b>\n"
+            "• Оплата за целевое действие\n"
+            "• Минимальные риски для партнера\n"
+            "• Подходит для начинающих\n"
+            "• Стабильный доход\n\n"
+            "💵 <b>Ставки по FB нашим основным гео:</b>\n"
+            "┌────────────┬──────────────────┬───────┐\n"
+            "│   Тир      │     Страна       │ Ставка│\n"
+            "├────────────┼──────────────────┼───────┤\n"
+            "│    T1      │ FI (Finland)     │  170  │\n"
+            "│    T1      │ CH (Switzerland) │  295  │\n"
+            "│    T3      │ KG (Kyrgyzstan)  │  60   │\n"
+            "│    T3      │ AM (Armenia)     │  60   │\n"
+            "│    T2      │ HU (Hungary)     │  160  │\n"
+            "│    T3      │ GE (Georgia)     │  80   │\n"
+            "│    T2      │ PL (Poland)      │  150  │\n"
+            "│    T2      │ RS (Serbia)      │  75   │\n"
+            "│    T1      │ CA (Canada)      │  220  │\n"
+            "│    T1      │ IE (Ireland)     │  255  │\n"
+            "│    T1      │ DE (Germany)     │  220  │\n"
+            "│    T1      │ SE (Sweden)      │  215  │\n"
+            "│    T2      │ SI (Slovenia)    │  130  │\n"
+            "│    T2      │ SK (Slovakia)    │  130  │\n"
+            "│    T3      │ TJ (Tajikistan)  │  65   │\n"
+            "│    T3      │ MD (Moldova)     │  60   │\n"
+            "│    T2      │ GR (Greece)      │  150  │\n"
+            "│    T1      │ GB (UK)          │  225  │\n"
+            "│    T1      │ FR (France)      │  185  │\n"
+            "└────────────┴──────────────────┴───────┘\n\n"
+            "📊 <b>Полная таблица ставок:</b>\n"
+            "https://docs.google.com/spreadsheets/d/1ObMQlGiY7PbxA0ZdQkZRjXvpbp5clpM4wA2X5CUvl5A/edit?usp=sharing\n\n"
+            "💬 <b>Другие варианты сотрудничества можем обсудить индивидуально</b>"
+        ),
+    },
+    {
+        'id': 'conditions_rs',
+        'parent': 'menu_conditions',
+        'back': '◀️ Назад к условиям',
+        'parse_mode': 'HTML',
+        'text': (
+            "<b>📊 Модель RS (Revenue Share)</b>\n\n"
+            "✨ <b>Премиум условия для опытных партнеров</b>\n\n"
+            "✅ <b>Преимущества:</b>\n"
+            "• Процент от оборота клиента\n"
+            "• Высокий потенциал дохода\n"
+            "• Долгосрочное сотрудничество\n"
+            "• Персональный подход\n\n"
+            "🌟 <b>Индивидуальные условия:</b>\n"
+            "• Гибкие процентные ставки\n"
+            "• Эксклюзивные предложения\n"
+            "• Приоритетная поддержка\n\n"
+            "👥 <b>Обсудить индивидуальные условия:</b>\n"
+            "• @makswincraft 🚀\n"
+            "• @dosiTG 💼\n"
+            "• @hugewinaffs 🌟\n\n"
+            "<i>Пример: процент от депозитов, повторных покупок, LTV клиента</i>"
+        ),
+        'buttons': [
+            [{'text': '💬 Написать @makswincraft', 'url': 'tg://resolve?domain=makswincraft'}],
+            [{'text': '💬 Написать @dosiTG', 'url': 'tg://resolve?domain=dosiTG'}],
+            [{'text': '💬 Написать @hugewinaffs', 'url': 'tg://resolve?domain=hugewinaffs'}],
+        ],
+    },
+    {
+        'id': 'conditions_hybrid',
+        'parent': 'menu_conditions',
+        'back': '◀️ Назад к условиям',
+        'parse_mode': 'HTML',
+        'text': (
+            "<b>🔄 Гибридная модель (CPA + RS)</b>\n\n"
+            "🎯 <b>Идеальный баланс для максимальной эффективности</b>\n\n"
+            "✅ <b>Преимущества:</b>\n"
+            "• Сочетание стабильности CPA и потенциала RS\n"
+            "• Гибкие условия под ваши задачи\n"
+            "• Индивидуальный подход\n"
+            "• Оптимальный риск/доход\n\n"
+            "💫 <b>Варианты сотрудничества:</b>\n"
+            "• CPA + процент от оборота\n"
+            "• Фиксированный бонус за качество\n"
+            "• Многоуровневая система вознаграждений\n\n"
+            "👥 <b>Обсудить индивидуальные условия:</b>\n"
+            "• @makswincraft 🚀\n"
+            "• @dosiTG 💼\n"
+            "• @hugewinaffs 🌟\n\n"
+            "<i>Пример: фикс за регистрацию + % от оборота, ступенчатая система</i>"
+        ),
+        'buttons': [
+            [{'text': '💬 Написать @makswincraft', 'url': 'tg://resolve?domain=makswincraft'}],
+            [{'text': '💬 Написать @dosiTG', 'url': 'tg://resolve?domain=dosiTG'}],
+            [{'text': '💬 Написать @hugewinaffs', 'url': 'tg://resolve?domain=hugewinaffs'}],
+        ],
+    },
+    {
+        'id': 'menu_contacts',
+        'parent': 'main_menu',
+        'text': (
+            "📞 Контакты поддержки\n\n"
+            "Мы всегда на связи и готовы помочь — в любой ситуации и в любое время!\n\n"
+            "🕒 Работаем 24/7\n"
+            "Ваш запрос будет обработан максимально оперативно.\n\n"
+            "👨‍💼 Ваши персональные менеджеры:\n"
+            "• @makswincraft🚀\n"
+            "• @dosiTG 💼\n"
+            "• @hugewinaffs🌟\n\n"
+            "Пишите смело — мы настроены на долгое и взаимовыгодное сотрудничество!"
+        ),
+        'buttons': [
+            [{'text': '🚀 Написать @makswincraft', 'url': 'https://t.me/makswincraft'}],
+            [{'text': '💼 Написать @dosiTG', 'url': 'https://t.me/dosiTG'}],
+            [{'text': '🌟 Написать @hugewinaffs', 'url': 'https://t.me/hugewinaffs'}],
+        ],
+    },
+    {
+        'id': 'menu_materials',
+        'parent': 'main_menu',
+        'text': (
+            "📚 Полезные материалы\n\nВыберите раздел:"
+        ),
+        'buttons': [
+            [{'text': '🔗 Лендинги', 'callback': 'materials_landings'}],
+        ],
+    },
+    {
+        'id': 'materials_landings',
+        'parent': 'menu_materials',
+        'back': '◀️ Назад к материалам',
+        'text': (
+            "🔗 Доступные лендинги и демо-игры"
+        ),
+        'buttons': [
+            [{'text': '🏠 Главная (EN)', 'url': 'https://wincraft.casino/'}],
+            [{'text': '🇫🇷 Главная (FR)', 'url': 'https://www.wincraft.casino/fr'}],
+            [{'text': '🎯 Регистрация', 'url': 'https://wincraft.casino/?modal=signup'}],
+            [{'text': '🎰 Популярные слоты', 'url': 'https://wincraft.casino/categories/games/popular'}],
+            [{'text': '🎁 Промо / Бонусы', 'url': 'https://wincraft.casino/promotions'}],
+            [{'text': '🎡 Wheel of Fortune', 'url': 'https://wincraft.casino/wheel-of-fortune'}],
+            [{'text': '👧 Wheel of Fortune (Girl)', 'url': 'https://wincraft.casino/wheel-of-fortune-girl'}],
+            [{'text': '🎮 Демо-игры', 'callback': 'landings_demos'}],
+        ],
+    },
+    {
+        'id': 'landings_demos',
+        'parent': 'materials_landings',
+        'back': '◀️ Назад к лендингам',
+        'text': (
+            "🎮 Демо-версии популярных слотов"
+        ),
+        'buttons': [
+            [{'text': '📖 Book of Dead', 'url': 'https://wincraft.casino/casino/games/12406?demo=true'}],
+            [{'text': '⛰️ Gates of Olympus', 'url': 'https://wincraft.casino/casino/games/20502?demo=true'}],
+            [{'text': '⚔️ Zeus vs Hades', 'url': 'https://wincraft.casino/casino/games/14475?demo=true'}],
+            [{'text': '🏡 The Dog House', 'url': 'https://wincraft.casino/casino/games/9535?demo=true'}],
+            [{'text': '🍬 Sweet Bonanza', 'url': 'https://wincraft.casino/casino/games/20504?demo=true'}],
+            [{'text': '✋ Hand of Midas', 'url': 'https://wincraft.casino/casino/games/20709?demo=true'}],
+        ],
+    },
+    {
+        'id': 'menu_faq',
+        'parent': 'main_menu',
+        'text': (
+            "❓ Часто задаваемые вопросы\n\n"
+            "01. За какие лиды вы платите?\n"
+            "— Motivated-трафик\n"
+            "— Мультиаккаунты (один ID/IP/устройство → несколько регистраций)\n"
+            "— Лиды с подозрительной воронкой (высокая рега, но нет депозитов)\n\n"
+            "02. Оценка трафика — в потоке или по игрокам?\n"
+            "— Оцениваем каждого игрока индивидуально. Если из 20 — 12 сделали FTD, оплатим за 12.\n\n"
+            "03. Есть ли холд на игроков?\n"
+            "— Нет. Все FTD, совершённые до конца отчётного периода, оплачиваются.\n\n"
+            "04. Сколько дней с клика до депозита?\n"
+            "— Максимум 30 дней. Если депозит в этот срок — лид валидный.\n\n"
+            "05. Сроки сверки и выплат?\n"
+            "— Сверка до конца месяца, выплата — до 10-го числа следующего месяца.\n"
+            "— На больших объёмах — возможны выплаты 2–3 раза в месяц.\n\n"
+            "06. Тестовые капы?\n"
+            "— 10–20 FTD на тест. Далее — до 100 FTD. При хорошем качестве — без ограничений.\n\n"
+            "07. Минимальная сумма выплаты?\n"
+            "— 500 USD.\n\n"
+            "08. Способы оплаты?\n"
+            "— USDT / USDC. Инвойс, KYC, AML — не требуются.\n\n"
+            "09. Задержка postback?\n"
+            "— Минимальная. Данные обновляются 24/7 в реальном времени.\n\n"
+            "10. Критерии оценки трафика?\n"
+            "— CR клик → регистрация / FTD\n"
+            "— Доля активных игроков и ретеншн\n"
+            "— Коэффициент возвратов\n"
+            "— Источники, гео, устройства, стабильность заливов\n\n"
+            "11. Регистрация в одном периоде, депозит — в следующем?\n"
+            "— FTD засчитывается в период депозита (в рамках 30 дней) и оплачивается.\n\n"
+            "12. Как оплачивается перелив?\n"
+            "— Только по согласованию. Качественный перелив — оплачиваем.\n\n"
+            "13. Показатели через 30 дней?\n"
+            "— RetDep ≥30% от FTD\n"
+            "— Средний чек — x2–x2.5 от мин. депозита\n\n"
+            "16. KPI на тесте?\n"
+            "— На тесте KPI не блокирующие. Ориентиры:\n"
+            "  • CR клик → регистрация: 20–30%\n"
+            "  • CR регистрация → депозит: 5–10%\n"
+            "  • Retention Day 7: от 25%\n"
+            "— Оплата по валидным FTD — в любом случае.\n\n"
+            "17. Принимаете ли инфлюенсеров и PPS-бренд?\n"
+            "— PPC, SEO, Facebook — да. Инфлюенсеры и PPS-бренд — по согласованию.\n\n"
+            "18. Hard и Soft KPI?\n"
+            "— Soft: CR рега 20–30%, CR FTD 5–10%, Ret7 >25%\n"
+            "— Hard: RetDep >30%, ARPU ≥x2 от мин. депа, ROI на D7/D14\n\n"
+            "Контакты для уточнений:\n"
+            "@makswincraft | @dosiTG | @hugewinaffs"
+        ),
+    },
+    {
+        'id': 'stats_30',
+        'parent': 'main_menu',
+        'parse_mode': 'HTML',
+        'text': (
+            "<b>📊 Статистика за 30 дней</b>\n\n"
+            "📆 Данные обновляются 1-го и 15-го числа каждого месяца.\n\n"
+            "📉 Click2Reg и Reg2Dep по дням — на графике над этим текстом. "
+            "Если графика нет, данные за период ещё не внесены."
+        ),
+    },
+    {
+        'id': 'stats_7',
+        'parent': 'main_menu',
+        'parse_mode': 'HTML',
+        'text': (
+            "<b>📈 Статистика за 7 дней</b>\n\n"
+            "📆 Данные обновляются каждое утро по понедельникам.\n\n"
+            "📉 Конверсии за неделю — на графике над этим текстом. "
+            "Если графика нет, данные за период ещё не внесены."
+        ),
+    },
+]
+
+
+class Screen(NamedTuple):
+    id: str
+    text: str
+    parse_mode: str
+    markup: InlineKeyboardMarkup
+    link_preview: LinkPreviewOptions
+    parent: str
+
+
+def _compile_button(button: dict) -> InlineKeyboardButton:
+    if 'callback' in button:
+        return InlineKeyboardButton(button['text'], callback_data=button['callback'])
+    return InlineKeyboardButton(button['text'], url=button['url'])
+
+
+def compile_screens(definitions) -> dict:
+    # Разметка собирается один раз; объекты telegram неизменяемы, их можно отдавать всем нажатиям
+    screens = {}
+    for definition in definitions:
+        rows = [[_compile_button(button) for button in row] for row in definition.get('buttons', [])]
+        parent = definition.get('parent')
+        if parent:
+            rows.append([InlineKeyboardButton(definition.get('back', DEFAULT_BACK_LABEL), callback_data=parent)])
+        screens[definition['id']] = Screen(
+            id=definition['id'],
+            text=definition['text'],
+            parse_mode=definition.get('parse_mode'),
+            markup=InlineKeyboardMarkup(rows),
+            link_preview=LinkPreviewOptions(is_disabled=True) if definition.get('disable_preview') else None,
+            parent=parent,
+        )
+
+    if MAIN_MENU not in screens:
+        raise ValueError(f"нет экрана {MAIN_MENU}")
+    for screen in screens.values():
+        targets = [button.callback_data for row in screen.markup.inline_keyboard for button in row if button.callback_data]
+        missing = [target for target in targets if target not in screens]
+        if missing:
+            raise ValueError(f"экран {screen.id} ссылается на неизвестные экраны: {', '.join(missing)}")
+    return screens
+
+
+class MenuRegistry:
+    # Поиск экрана по callback_data — один dict lookup, без ветвлений и пересборки клавиатур
+
+    def __init__(self, definitions=SCREENS, path: str = None):
+        self.path = path
+        self._screens = compile_screens(definitions)
+        self._mtime = None
+        # Растёт при каждой перезагрузке, чтобы кэш отрисовки не считал старый экран актуальным
+        self.version = 0
+        self.reload()
+
+    def get(self, screen_id: str):
+        return self._screens.get(screen_id)
+
+    def __contains__(self, screen_id: str) -> bool:
+        return screen_id in self._screens
+
+    def __iter__(self):
+        return iter(list(self._screens))
+
+    def reload(self) -> bool:
+        # Перечитываем файл только если он изменился; битый файл не ломает текущее меню
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                definitions = json.load(f)
+            screens = compile_screens(definitions)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Меню из {self.path} не загружено: {e}")
+            return False
+        self._screens = screens
+        self.version += 1
+        logger.info(f"Меню загружено из {self.path}: {len(screens)} экранов")
+        return True
+
+    async def watch(self, interval: float = RELOAD_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.reload)
+
+
+class LruTtlCache:
+    # Небольшой LRU-кэш с истечением записей: ограничен и по размеру, и по времени
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._items[key] = (value, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class RenderTracker:
+    # Помнит, какой экран уже показан в сообщении, и гасит повторные нажатия одного пользователя,
+    # чтобы не делать лишний edit_message_text и запись в базу
+
+    def __init__(self, registry: MenuRegistry, max_size: int = RENDERED_CACHE_SIZE,
+                 ttl: float = RENDERED_TTL, debounce: float = DEBOUNCE_WINDOW):
+        self.registry = registry
+        self._rendered = LruTtlCache(max_size, ttl)
+        self._taps = LruTtlCache(max_size, debounce)
+
+    def is_redundant(self, chat_id: int, message_id: int, user_id: int, screen_id: str) -> bool:
+        if self._taps.get((user_id, chat_id, message_id)) == screen_id:
+            return True
+        return self._rendered.get((chat_id, message_id)) == (screen_id, self.registry.version)
+
+    def mark_tapped(self, chat_id: int, message_id: int, user_id: int, screen_id: str):
+        # Только после успешной отрисовки: повтор после ошибки edit не должен гаситься
+        self._taps.set((user_id, chat_id, message_id), screen_id)
+
+    def mark_rendered(self, chat_id: int, message_id: int, screen_id: str):
+        self._rendered.set((chat_id, message_id), (screen_id, self.registry.version))
@@ -0,0 +1,289 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DESCRIPTIONS = {
+    'bot_handler_seconds': ('histogram', "Время обработки апдейта по хендлерам"),
+    'bot_callback_seconds': ('histogram', "Время обработки нажатия по callback_data"),
+    'bot_handler_errors_total': ('counter', "Исключения в хендлерах"),
+    'bot_db_seconds': ('histogram', "Время операций с базой, включая ожидание потока базы"),
+    'bot_api_seconds': ('histogram', "Время запросов к Bot API"),
+    'bot_api_requests_total': ('counter', "Запросы к Bot API по методу и HTTP-коду"),
+    'bot_api_errors_total': ('counter', "Запросы к Bot API, завершившиеся сетевой ошибкой"),
+    'bot_flood_throttled_total': ('counter', "Апдейты, отброшенные защитой от флуда"),
+    'bot_updates_queued': ('gauge', "Апдейты, ждущие своей очереди в чате"),
+    'bot_updates_active_chats': ('gauge', "Чаты с апдейтами в обработке"),
+    'bot_updates_dropped_total': ('counter', "Апдейты, отброшенные из-за переполненной очереди чата"),
+}
+
+SUMMARY_TOP = 5
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Оценка по корзинам с линейной интерполяцией внутри корзины, как histogram_quantile
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    # Метрики процесса в памяти. Запись — пара операций со словарём, поэтому включены всегда;
+    # текст для Prometheus собирается только при запросе
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._histograms = {}
+        self._counters = Counter()
+        self._collectors = []
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, amount: int = 1, **labels):
+        self._counters[(name, _label_key(labels))] += amount
+
+    def add_collector(self, collect):
+        # collect() -> [(имя, {метки}, значение)]; вызывается при каждом чтении метрик (gauge)
+        self._collectors.append(collect)
+
+    def db_timer(self, operation: str, seconds: float):
+        self.observe('bot_db_seconds', seconds, op=operation)
+
+    def instrument(self, name: str, callback, known_callbacks=None):
+        # Обёртка хендлера: время и ошибки. Для нажатий добавляется метка callback_data,
+        # но только из known_callbacks, чтобы произвольные данные не раздували число рядов
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.inc('bot_handler_errors_total', handler=name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.observe('bot_handler_seconds', elapsed, handler=name)
+                query = getattr(update, 'callback_query', None)
+                if known_callbacks is not None and query is not None:
+                    data = query.data if query.data in known_callbacks else 'other'
+                    self.observe('bot_callback_seconds', elapsed, data=data)
+
+        return wrapper
+
+    # ---------- чтение ----------
+
+    def _gauges(self):
+        gauges = []
+        for collect in self._collectors:
+            try:
+                gauges.extend(collect())
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик: {e}")
+        return gauges
+
+    def render(self) -> str:
+        # Текстовый формат Prometheus 0.0.4
+        families = {}
+        for (name, key), histogram in self._histograms.items():
+            families.setdefault(name, []).append((key, histogram))
+        for (name, key), value in self._counters.items():
+            families.setdefault(name, []).append((key, value))
+        gauges = {}
+        for name, labels, value in self._gauges():
+            gauges.setdefault(name, []).append((_label_key(labels), value))
+
+        lines = ['# TYPE bot_uptime_seconds gauge', f'bot_uptime_seconds {time.monotonic() - self.started:.3f}']
+        for name in sorted(families):
+            kind, description = DESCRIPTIONS.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(families[name], key=lambda item: item[0]):
+                if isinstance(value, Histogram):
+                    cumulative = 0
+                    for bound, n in zip(value.buckets, value.counts):
+                        cumulative += n
+                        le = f'le="{bound}"'
+                        lines.append(f'{name}_bucket{_format_labels(key, le)} {cumulative}')
+                    le = 'le="+Inf"'
+                    lines.append(f'{name}_bucket{_format_labels(key, le)} {value.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {value.sum:.6f}')
+                    lines.append(f'{name}_count{_format_labels(key)} {value.count}')
+                else:
+                    lines.append(f'{name}{_format_labels(key)} {value}')
+        for name in sorted(gauges):
+            lines.append(f'# TYPE {name} gauge')
+            for key, value in sorted(gauges[name]):
+                lines.append(f'{name}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _series(self, name: str):
+        return [(dict(key), histogram) for (series, key), histogram in self._histograms.items() if series == name]
+
+    def _counter(self, name: str):
+        return [(dict(key), value) for (series, key), value in self._counters.items() if series == name]
+
+    def summary(self) -> str:
+        # Короткая сводка для админа в Telegram
+        def ms(histogram, q):
+            return f"{histogram.quantile(q) * 1000:.0f}"
+
+        uptime = int(time.monotonic() - self.started)
+        parts = [f"📈 Метрики (аптайм {uptime // 3600} ч {uptime % 3600 // 60} мин)"]
+
+        errors = Counter()
+        for labels, value in self._counter('bot_handler_errors_total'):
+            errors[labels['handler']] += value
+        handlers = sorted(self._series('bot_handler_seconds'), key=lambda item: -item[1].count)
+        if handlers:
+            lines = ["\nХендлеры, p50/p95 мс:"]
+            for labels, histogram in handlers:
+                lines.append(f"• {labels['handler']}: {ms(histogram, 0.5)}/{ms(histogram, 0.95)} "
+                             f"(n={histogram.count}, ошибок {errors[labels['handler']]})")
+            parts.append("\n".join(lines))
+
+        callbacks = sorted(self._series('bot_callback_seconds'), key=lambda item: -item[1].quantile(0.95))
+        if callbacks:
+            lines = ["\nСамые медленные экраны, p95 мс:"]
+            for labels, histogram in callbacks[:SUMMARY_TOP]:
+                lines.append(f"• {labels['data']}: {ms(histogram, 0.95)} (n={histogram.count})")
+            parts.append("\n".join(lines))
+
+        operations = sorted(self._series('bot_db_seconds'), key=lambda item: -item[1].sum)
+        if operations:
+            lines = ["\nБаза, p95 мс (по суммарному времени):"]
+            for labels, histogram in operations[:SUMMARY_TOP]:
+                lines.append(f"• {labels['op']}: {ms(histogram, 0.95)} (n={histogram.count})")
+            parts.append("\n".join(lines))
+
+        requests = self._counter('bot_api_requests_total')
+        if requests:
+            total = sum(value for _, value in requests)
+            failed = sum(value for labels, value in requests if labels['code'] != '200')
+            limited = sum(value for labels, value in requests if labels['code'] == '429')
+            network = sum(value for _, value in self._counter('bot_api_errors_total'))
+            parts.append(f"\nBot API: запросов {total}, ошибок {failed}, 429: {limited}, сетевых сбоев {network}")
+
+        throttled = sum(value for _, value in self._counter('bot_flood_throttled_total'))
+        if throttled:
+            parts.append(f"🛑 Отброшено защитой от флуда: {throttled}")
+
+        for name, labels, value in self._gauges():
+            if name == 'bot_broadcast_recipients' and labels.get('state') == 'done':
+                parts.append(f"📢 Рассылка #{labels['job']}: {value} обработано")
+        return "\n".join(parts)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    # HTTP-клиент PTB, который считает запросы к Bot API по методам, кодам ответа и времени
+
+    def __init__(self, metrics: Metrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            self.metrics.inc('bot_api_errors_total', method=api_method, error=type(e).__name__)
+            raise
+        finally:
+            self.metrics.observe('bot_api_seconds', time.perf_counter() - started, method=api_method)
+        self.metrics.inc('bot_api_requests_total', method=api_method, code=str(code))
+        return code, payload
+
+
+class MetricsServer:
+    # GET /metrics в текстовом формате Prometheus; по умолчанию слушает только localhost
+
+    def __init__(self, metrics: Metrics, host: str = '127.0.0.1', port: int = 9100, path: str = '/metrics'):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.path = path
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b'\r\n', b'\n', b''):
+                pass
+            method, target, _ = request_line.decode('latin-1').split()
+            if method != 'GET':
+                status, body = '405 Method Not Allowed', b''
+            elif target.split('?', 1)[0] != self.path:
+                status, body = '404 Not Found', b''
+            else:
+                status, body = '200 OK', self.metrics.render().encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
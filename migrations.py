@@ -0,0 +1,389 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Схема базы версионируется через PRAGMA user_version: шаг N переводит базу из версии N-1 в N.
+# Каждый шаг выполняется в своей транзакции вместе с записью новой версии, поэтому
+# при сбое база остаётся на прошлой версии. Уже применённые шаги на старте не выполняются.
+#
+# Первые шаги повторяют историю схемы до появления версий и идемпотентны (IF NOT EXISTS,
+# проверка колонок), чтобы базы без user_version обновлялись на месте без потерь.
+# Новые изменения схемы — только новым шагом в конце списка, старые шаги не редактируются.
+# SQL каждого шага записан здесь, а не берётся из модулей: правка схемы в модуле не должна
+# менять то, что делает уже выпущенный шаг на старых базах.
+
+
+def add_column_if_missing(conn, table: str, column: str, definition: str):
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_seen DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS groups (
+            chat_id INTEGER PRIMARY KEY,
+            title TEXT,
+            added_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS command_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            command TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            date DATE,
+            actions_count INTEGER DEFAULT 1,
+            UNIQUE(user_id, date)
+        )
+    ''')
+
+
+def _broadcast_jobs(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            owner_id INTEGER,
+            payload TEXT,
+            status TEXT DEFAULT 'running',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (job_id, chat_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_deliveries_pending ON broadcast_deliveries (job_id, status, chat_id)')
+
+
+def _chat_active_flags(conn):
+    # Заблокировавшие бота пользователи и удалившие его группы помечаются active = 0
+    for table in ('users', 'groups'):
+        add_column_if_missing(conn, table, 'active', 'INTEGER NOT NULL DEFAULT 1')
+        add_column_if_missing(conn, table, 'blocked_at', 'DATETIME')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_active ON users (active, user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_groups_active ON groups (active, chat_id)')
+
+
+def _admin_meta(conn):
+    # meta и версия списка админов: триггеры увеличивают её на любое изменение admins (см. admins.py)
+    for statement in (
+        '''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('admins_version', 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS admins_version_insert AFTER INSERT ON admins
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'admins_version';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS admins_version_delete AFTER DELETE ON admins
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'admins_version';
+        END
+        ''',
+    ):
+        conn.execute(statement)
+
+
+def _analytics_rollups(conn):
+    # Агрегаты статистики (см. analytics.py) и разовое заполнение их по накопленной истории
+    for statement in (
+        '''
+        CREATE TABLE IF NOT EXISTS stats_hourly (
+            hour TEXT NOT NULL,
+            command TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, command)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            date TEXT NOT NULL,
+            command TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, command)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_new_users (
+            date TEXT PRIMARY KEY,
+            n INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_active_users (
+            date TEXT PRIMARY KEY,
+            n INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_command_stats_timestamp ON command_stats (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_command_stats_user ON command_stats (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_user_activity_date ON user_activity (date, user_id)',
+    ):
+        conn.execute(statement)
+    if conn.execute("SELECT value FROM meta WHERE key = 'rollups_backfilled'").fetchone():
+        return
+    for statement in (
+        '''
+        INSERT INTO stats_hourly (hour, command, n)
+        SELECT substr(timestamp, 1, 13), command, COUNT(*) FROM command_stats
+        WHERE command IS NOT NULL GROUP BY 1, 2
+        ''',
+        '''
+        INSERT INTO stats_daily (date, command, n)
+        SELECT substr(timestamp, 1, 10), command, COUNT(*) FROM command_stats
+        WHERE command IS NOT NULL GROUP BY 1, 2
+        ''',
+        '''
+        INSERT INTO daily_new_users (date, n)
+        SELECT date(first_seen), COUNT(*) FROM users WHERE first_seen IS NOT NULL GROUP BY 1
+        ''',
+        '''
+        INSERT INTO daily_active_users (date, n)
+        SELECT date, COUNT(*) FROM user_activity GROUP BY date
+        ''',
+        "INSERT INTO meta (key, value) VALUES ('rollups_backfilled', 1)",
+    ):
+        conn.execute(statement)
+
+
+def _chart_cache(conn):
+    # Конверсии и кэш графиков; любое изменение conversion_stats увеличивает версию данных (см. charts.py)
+    for statement in (
+        '''
+        CREATE TABLE IF NOT EXISTS conversion_stats (
+            date TEXT PRIMARY KEY,
+            clicks INTEGER NOT NULL DEFAULT 0,
+            registrations INTEGER NOT NULL DEFAULT 0,
+            deposits INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chart_cache (
+            screen TEXT NOT NULL,
+            data_version INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (screen, data_version)
+        )
+        ''',
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('conversions_version', 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversions_version_insert AFTER INSERT ON conversion_stats
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'conversions_version';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversions_version_update AFTER UPDATE ON conversion_stats
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'conversions_version';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS conversions_version_delete AFTER DELETE ON conversion_stats
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'conversions_version';
+        END
+        ''',
+    ):
+        conn.execute(statement)
+
+
+def _broadcast_segments(conn):
+    # Сегмент рассылки хранится в задаче, чтобы снимок получателей продолжился после рестарта
+    add_column_if_missing(conn, 'jobs', 'segment', 'TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_command_stats_command ON command_stats (command, user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_first_seen ON users (first_seen)')
+
+
+def _persistence(conn):
+    # user_data и состояния диалогов (см. persistence.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    ''')
+
+
+def rebuild_table(conn, table: str, schema: str, columns: str):
+    # SQLite не меняет первичный ключ через ALTER: новая таблица, копия строк, замена.
+    # Индексы старой таблицы удаляются вместе с ней — шаг создаёт их заново
+    conn.execute(schema.format(table=f'{table}_new'))
+    conn.execute(f'INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
+# Новые ключи таблиц с данными отдельных ботов (колонка bot, см. bots.py)
+NAMESPACED_TABLES = (
+    ('users', '''
+        CREATE TABLE {table} (
+            bot TEXT NOT NULL DEFAULT 'main',
+            user_id INTEGER NOT NULL,
+            first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+            active INTEGER NOT NULL DEFAULT 1,
+            blocked_at DATETIME,
+            PRIMARY KEY (bot, user_id)
+        )
+    ''', 'user_id, first_seen, active, blocked_at'),
+    ('groups', '''
+        CREATE TABLE {table} (
+            bot TEXT NOT NULL DEFAULT 'main',
+            chat_id INTEGER NOT NULL,
+            title TEXT,
+            added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            active INTEGER NOT NULL DEFAULT 1,
+            blocked_at DATETIME,
+            PRIMARY KEY (bot, chat_id)
+        )
+    ''', 'chat_id, title, added_at, active, blocked_at'),
+    ('user_activity', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bot TEXT NOT NULL DEFAULT 'main',
+            user_id INTEGER,
+            date DATE,
+            actions_count INTEGER DEFAULT 1,
+            UNIQUE(bot, user_id, date)
+        )
+    ''', 'id, user_id, date, actions_count'),
+    ('stats_hourly', '''
+        CREATE TABLE {table} (
+            bot TEXT NOT NULL DEFAULT 'main',
+            hour TEXT NOT NULL,
+            command TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bot, hour, command)
+        ) WITHOUT ROWID
+    ''', 'hour, command, n'),
+    ('stats_daily', '''
+        CREATE TABLE {table} (
+            bot TEXT NOT NULL DEFAULT 'main',
+            date TEXT NOT NULL,
+            command TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bot, date, command)
+        ) WITHOUT ROWID
+    ''', 'date, command, n'),
+    ('daily_new_users', '''
+        CREATE TABLE {table} (
+            bot TEXT NOT NULL DEFAULT 'main',
+            date TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bot, date)
+        )
+    ''', 'date, n'),
+    ('daily_active_users', '''
+        CREATE TABLE {table} (
+            bot TEXT NOT NULL DEFAULT 'main',
+            date TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bot, date)
+        )
+    ''', 'date, n'),
+    ('persistence', '''
+        CREATE TABLE {table} (
+            bot TEXT NOT NULL DEFAULT 'main',
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (bot, kind, key)
+        ) WITHOUT ROWID
+    ''', 'kind, key, data'),
+)
+
+
+def _bot_namespaces(conn):
+    # Несколько ботов в одной базе: существующие строки достаются боту по умолчанию 'main'
+    for table, schema, columns in NAMESPACED_TABLES:
+        rebuild_table(conn, table, schema, columns)
+    add_column_if_missing(conn, 'command_stats', 'bot', "TEXT NOT NULL DEFAULT 'main'")
+    add_column_if_missing(conn, 'jobs', 'bot', "TEXT NOT NULL DEFAULT 'main'")
+    conn.execute('DROP INDEX IF EXISTS idx_command_stats_command')
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_users_active ON users (bot, active, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_users_first_seen ON users (bot, first_seen, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_groups_active ON groups (bot, active, chat_id)',
+        'CREATE INDEX IF NOT EXISTS idx_user_activity_date ON user_activity (bot, date, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_command_stats_command ON command_stats (bot, command, user_id)',
+        # Выгрузка событий одного бота по времени (для архивации остаётся индекс по timestamp)
+        'CREATE INDEX IF NOT EXISTS idx_command_stats_bot_timestamp ON command_stats (bot, timestamp)',
+    ):
+        conn.execute(statement)
+
+
+MIGRATIONS = (
+    _base_tables,
+    _broadcast_jobs,
+    _chat_active_flags,
+    _admin_meta,
+    _analytics_rollups,
+    _chart_cache,
+    _broadcast_segments,
+    _persistence,
+    _bot_namespaces,
+)
+
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS) -> list:
+    # Возвращает номера применённых шагов; на актуальной базе — одно чтение PRAGMA
+    version = schema_version(conn)
+    latest = len(migrations)
+    if version > latest:
+        logger.warning(f"Версия схемы базы ({version}) новее кода ({latest}), миграции пропущены")
+        return []
+    applied = []
+    for number in range(version + 1, latest + 1):
+        step = migrations[number - 1]
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN')
+        try:
+            step(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Миграция {number} ({step.__name__}) не применена")
+            raise
+        applied.append(number)
+        logger.info(f"Схема базы обновлена до версии {number} ({step.__name__})")
+    return applied
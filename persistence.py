@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from bots import DEFAULT_BOT
+
+logger = logging.getLogger(__name__)
+
+UPDATE_INTERVAL = 10.0
+
+# user_data, chat_data, bot_data и состояния ConversationHandler хранятся в stats.db
+# компактным JSON, по строке на пользователя/чат. PTB сам собирает изменённые записи и раз
+# в update_interval передаёт их сюда; мы отбрасываем неизменившиеся и пишем остальное
+# одной транзакцией, поэтому обычный апдейт за сохранение состояния не платит.
+# У каждого бота процесса свой экземпляр и свои строки (колонка bot).
+# Таблицу persistence создают миграции migrations._persistence и migrations._bot_namespaces.
+
+EMPTY = '{}'
+
+
+def load_records(conn, kind: str, bot: str = DEFAULT_BOT):
+    return conn.execute('SELECT key, data FROM persistence WHERE bot = ? AND kind = ?', (bot, kind)).fetchall()
+
+
+def write_records(conn, records: dict, bot: str = DEFAULT_BOT):
+    # Пустые данные и закончившиеся диалоги удаляются, остальное — upsert
+    conn.executemany(
+        'DELETE FROM persistence WHERE bot = ? AND kind = ? AND key = ?',
+        [(bot, kind, key) for (kind, key), data in records.items() if data is None]
+    )
+    conn.executemany(
+        '''INSERT INTO persistence (bot, kind, key, data) VALUES (?, ?, ?, ?)
+           ON CONFLICT(bot, kind, key) DO UPDATE SET data = excluded.data''',
+        [(bot, kind, key, data) for (kind, key), data in records.items() if data is not None]
+    )
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class SqlitePersistence(BasePersistence):
+
+    def __init__(self, storage, update_interval: float = UPDATE_INTERVAL, bot: str = DEFAULT_BOT):
+        # callback_data не храним: бот не использует arbitrary_callback_data
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.storage = storage
+        self.bot_name = bot
+        # Последнее записанное состояние каждой записи — чтобы не переписывать неизменившееся
+        self._written = {}
+        self._dirty = {}
+        self._writing = None
+
+    # ---------- чтение при старте ----------
+
+    async def _load(self, kind: str) -> dict:
+        records = {}
+        for key, data in await self.storage.run(load_records, kind, self.bot_name):
+            self._written[(kind, key)] = data
+            records[key] = json.loads(data)
+        return records
+
+    async def get_user_data(self) -> dict:
+        return {int(key): data for key, data in (await self._load('user')).items()}
+
+    async def get_chat_data(self) -> dict:
+        return {int(key): data for key, data in (await self._load('chat')).items()}
+
+    async def get_bot_data(self) -> dict:
+        return (await self._load('bot')).get('bot', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        states = await self._load(f'conversation:{name}')
+        return {tuple(json.loads(key)): state for key, state in states.items()}
+
+    # ---------- изменения ----------
+
+    def _stage(self, kind: str, key: str, value, empty=EMPTY):
+        try:
+            data = _dumps(value)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Состояние {kind}:{key} не сохранено: {e}")
+            return
+        if data == empty:
+            data = None
+        if self._written.get((kind, key)) == data:
+            return
+        self._dirty[(kind, key)] = data
+        # Все изменения одного прохода PTB уходят одной транзакцией
+        if self._writing is None or self._writing.done():
+            self._writing = asyncio.get_running_loop().create_task(self._write())
+
+    async def _write(self):
+        await asyncio.sleep(0)
+        batch, self._dirty = self._dirty, {}
+        if not batch:
+            return
+        try:
+            await self.storage.run(write_records, batch, self.bot_name)
+        except Exception as e:
+            logger.error(f"Ошибка записи состояния: {e}")
+            # Не потерять: вернём пачку, более свежие изменения важнее
+            self._dirty = {**batch, **self._dirty}
+            return
+        for record, data in batch.items():
+            if data is None:
+                self._written.pop(record, None)
+            else:
+                self._written[record] = data
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._stage('user', str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        self._stage('chat', str(chat_id), data)
+
+    async def update_bot_data(self, data: dict):
+        self._stage('bot', 'bot', data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name: str, key, new_state):
+        self._stage(f'conversation:{name}', _dumps(list(key)), new_state, empty='null')
+
+    async def drop_user_data(self, user_id: int):
+        self._stage('user', str(user_id), {})
+
+    async def drop_chat_data(self, chat_id: int):
+        self._stage('chat', str(chat_id), {})
+
+    # Один процесс владеет состоянием, перечитывать из базы нечего
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        # Вызывается PTB при остановке: дожидаемся текущей записи и пишем остаток
+        if self._writing is not None:
+            await self._writing
+        await self._write()
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from collections import deque
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_UPDATES = 32
+MAX_QUEUED_PER_CHAT = 20
+
+
+def update_key(update):
+    # Порядок важен внутри одного диалога: ключ — чат, для апдейтов без чата — пользователь
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    return user.id if user is not None else None
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    # Апдейты разных чатов обрабатываются параллельно (не больше max_concurrent_updates сразу),
+    # апдейты одного чата — строго по очереди. У каждого активного чата своя очередь и
+    # обработчик; когда очередь пустеет, оба удаляются, так что память занимают только
+    # чаты, где прямо сейчас что-то происходит.
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+                 max_queued_per_chat: int = MAX_QUEUED_PER_CHAT, on_drop=None):
+        super().__init__(max_concurrent_updates)
+        self.max_queued_per_chat = max_queued_per_chat
+        # Вызывается на каждый отброшенный апдейт (счётчик в метриках)
+        self.on_drop = on_drop
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._queues = {}
+        self._workers = set()
+        self.dropped = 0
+        self._incoming = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._queues)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        # Дорабатываем всё, что уже принято в очереди. Application.shutdown() вызывает это уже
+        # после закрытия HTTP-клиента бота, поэтому при остановке очереди дорабатываются раньше,
+        # сразу после Application.stop() (см. bot.stop_application); повторный вызов ничего не делает.
+        # Апдейты, которые PTB уже забрал из update_queue, могут ещё не дойти до очереди чата
+        while True:
+            await asyncio.sleep(0)
+            if self._workers:
+                await asyncio.gather(*list(self._workers), return_exceptions=True)
+            elif not self._incoming:
+                return
+
+    async def process_update(self, update, coroutine):
+        self._incoming += 1
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self._incoming -= 1
+
+    async def do_process_update(self, update, coroutine):
+        # Только ставим апдейт в очередь чата, чтобы ожидание своей очереди не занимало общий слот
+        key = update_key(update)
+        if key is None:
+            self._spawn(None, deque([coroutine]))
+            return
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._spawn(key, queue)
+        elif len(queue) >= self.max_queued_per_chat:
+            # Один чат завалил очередь — новые апдейты этого чата отбрасываем, остальных не трогаем
+            self.dropped += 1
+            coroutine.close()
+            if self.on_drop is not None:
+                self.on_drop()
+            logger.warning(f"Очередь чата {key} переполнена, апдейт отброшен")
+            return
+        queue.append(coroutine)
+
+    def _spawn(self, key, queue: deque):
+        worker = asyncio.get_running_loop().create_task(self._drain(key, queue))
+        self._workers.add(worker)
+        worker.add_done_callback(self._workers.discard)
+
+    async def _drain(self, key, queue: deque):
+        try:
+            while queue:
+                coroutine = queue.popleft()
+                async with self._slots:
+                    try:
+                        await coroutine
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки апдейта чата {key}: {e}")
+        finally:
+            if key is not None and self._queues.get(key) is queue:
+                del self._queues[key]
+            for coroutine in queue:
+                coroutine.close()
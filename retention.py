@@ -0,0 +1,112 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+RETENTION_DAYS = 90
+ARCHIVE_DIR = 'archive'
+BATCH_SIZE = 1000
+BATCH_PAUSE = 0.2
+VACUUM_PAGES = 500
+RUN_INTERVAL = 6 * 3600
+# Первый проход откладывается, чтобы после рестарта не конкурировать с первыми апдейтами
+STARTUP_DELAY = 300
+
+# Старые строки command_stats уходят в сжатые append-only архивы по месяцам
+# (archive/command_stats-YYYY-MM.jsonl.gz) и удаляются из базы небольшими пачками.
+# Агрегаты stats_daily уже содержат эти события, поэтому статистика не теряется.
+
+
+def enable_incremental_vacuum(conn):
+    # auto_vacuum меняется только через полный VACUUM, поэтому делаем это один раз
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        logger.info("Включаем incremental auto_vacuum (однократный VACUUM)")
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+
+
+def cutoff_timestamp(days: int, now: datetime = None) -> str:
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def fetch_expired(conn, cutoff: str, limit: int):
+    return conn.execute(
+        '''SELECT id, user_id, command, timestamp, bot FROM command_stats
+           WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?''',
+        (cutoff, limit)
+    ).fetchall()
+
+
+def delete_archived(conn, ids):
+    conn.executemany('DELETE FROM command_stats WHERE id = ?', [(row_id,) for row_id in ids])
+    return len(ids)
+
+
+def prune_hourly(conn, cutoff: str):
+    # Почасовые агрегаты нужны только за окно хранения, дневные остаются навсегда
+    return conn.execute('DELETE FROM stats_hourly WHERE hour < ?', (cutoff[:13],)).rowcount
+
+
+def incremental_vacuum(conn, pages: int = VACUUM_PAGES):
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+
+
+def write_archive(archive_dir: str, rows):
+    # Дописываем пачку в файлы по месяцам; каждая дозапись — отдельный gzip-member
+    os.makedirs(archive_dir, exist_ok=True)
+    by_month = {}
+    for row_id, user_id, command, timestamp, bot in rows:
+        record = {'id': row_id, 'bot': bot, 'user_id': user_id, 'command': command, 'timestamp': timestamp}
+        by_month.setdefault(str(timestamp)[:7], []).append(json.dumps(record, ensure_ascii=False))
+    for month, lines in by_month.items():
+        path = os.path.join(archive_dir, f'command_stats-{month}.jsonl.gz')
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+    return sorted(by_month)
+
+
+class RetentionWorker:
+
+    def __init__(self, storage, days: int = RETENTION_DAYS, archive_dir: str = ARCHIVE_DIR,
+                 batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE):
+        self.storage = storage
+        self.days = days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.pause = pause
+
+    async def run_once(self) -> int:
+        cutoff = cutoff_timestamp(self.days)
+        archived = 0
+        while True:
+            rows = await self.storage.run(fetch_expired, cutoff, self.batch_size)
+            if not rows:
+                break
+            # Сначала файл (вне потока базы), потом удаление — строка не пропадёт, не попав в архив
+            await asyncio.to_thread(write_archive, self.archive_dir, rows)
+            archived += await self.storage.run(delete_archived, [row[0] for row in rows])
+            await self.storage.run(incremental_vacuum)
+            # Короткие транзакции с паузами не держат блокировку записи надолго
+            await asyncio.sleep(self.pause)
+        await self.storage.run(prune_hourly, cutoff)
+        await self.storage.run(incremental_vacuum)
+        if archived:
+            logger.info(f"В архив перенесено событий: {archived}")
+        return archived
+
+    async def watch(self, interval: float = RUN_INTERVAL, delay: float = STARTUP_DELAY):
+        await asyncio.sleep(delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка архивации статистики: {e}")
+            await asyncio.sleep(interval)
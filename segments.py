@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+from analytics import utc_today
+from bots import DEFAULT_BOT
+from jobstore import recipients_sql
+
+# Сегменты рассылки по пользователям. Сегмент — dict из условий, все условия объединяются через И:
+#   active  — был активен за последние N дней (user_activity, уникальный индекс (bot, user_id, date))
+#   since   — впервые пришёл в бота не раньше даты YYYY-MM-DD (users.first_seen)
+#   command — нажимал кнопку/команду (command_stats за срок хранения, индекс по (bot, command, user_id))
+#   exclude — не получал рассылок по пользователям за последние N дней
+# Пустой сегмент — все активные пользователи, как раньше. Всё считается внутри одного бота.
+
+SEGMENT_KEYS = ('active', 'since', 'command', 'exclude')
+
+SEGMENT_PRESETS = {
+    'all': ("Все", lambda today: {}),
+    'active7': ("Активные 7 дн.", lambda today: {'active': 7}),
+    'active30': ("Активные 30 дн.", lambda today: {'active': 30}),
+    'new30': ("Новые за 30 дн.", lambda today: {'since': (today - timedelta(days=30)).isoformat()}),
+}
+
+SEGMENT_HINT = ("Свой сегмент — пришлите строку вида:\n"
+                "active=7 since=2024-05-01 command=menu_faq exclude=3")
+
+
+def parse_segment(text: str) -> dict:
+    # "active=7 command=menu_faq" → {'active': 7, 'command': 'menu_faq'}; ошибки — ValueError с текстом для админа
+    segment = {}
+    for item in text.split():
+        key, sep, value = item.partition('=')
+        key = key.strip().lower()
+        if not sep or not value or key not in SEGMENT_KEYS:
+            raise ValueError(f"непонятное условие «{item}»")
+        if key in ('active', 'exclude'):
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError(f"{key}: нужно число дней больше нуля")
+            segment[key] = int(value)
+        elif key == 'since':
+            try:
+                segment[key] = date.fromisoformat(value).isoformat()
+            except ValueError:
+                raise ValueError("since: дата в формате YYYY-MM-DD") from None
+        else:
+            segment[key] = value
+    return segment
+
+
+def describe_segment(segment: dict) -> str:
+    parts = []
+    if 'active' in segment:
+        parts.append(f"активные за {segment['active']} дн.")
+    if 'since' in segment:
+        parts.append(f"пришли с {segment['since']}")
+    if 'command' in segment:
+        parts.append(f"нажимали {segment['command']}")
+    if 'exclude' in segment:
+        parts.append(f"без получивших рассылку за {segment['exclude']} дн.")
+    return ", ".join(parts) if parts else "все активные"
+
+
+def segment_sql(kind: str, segment: dict = None, today: date = None, bot: str = DEFAULT_BOT):
+    # (sql, params) для снимка получателей. Условия — коррелированные EXISTS с поиском по индексу
+    # для каждой строки users, поэтому порция keyset-снимка стоит пропорционально своему размеру
+    sql = recipients_sql(kind)
+    if not segment or kind != 'broadcast_users':
+        return sql, (bot,)
+    today = today or utc_today()
+    conditions, params = [], [bot]
+    if 'active' in segment:
+        conditions.append('''EXISTS (SELECT 1 FROM user_activity a
+            WHERE a.bot = users.bot AND a.user_id = users.user_id AND a.date >= ?)''')
+        params.append((today - timedelta(days=segment['active'] - 1)).isoformat())
+    if 'since' in segment:
+        conditions.append('first_seen >= ?')
+        params.append(segment['since'])
+    if 'command' in segment:
+        conditions.append('''EXISTS (SELECT 1 FROM command_stats c
+            WHERE c.bot = users.bot AND c.command = ? AND c.user_id = users.user_id)''')
+        params.append(segment['command'])
+    if 'exclude' in segment:
+        # Недавних рассылок единицы: перебираем их и ищем получателя по первичному ключу доставок
+        conditions.append('''NOT EXISTS (SELECT 1 FROM jobs j CROSS JOIN broadcast_deliveries d
+            WHERE j.kind = 'broadcast_users' AND j.bot = users.bot AND j.created_at >= datetime('now', ?)
+              AND d.job_id = j.id AND d.chat_id = users.user_id AND d.status = 'sent')''')
+        params.append(f"-{segment['exclude']} days")
+    return f"{sql} AND {' AND '.join(conditions)}", tuple(params)
+
+
+def count_recipients(conn, kind: str, segment: dict = None, bot: str = DEFAULT_BOT) -> int:
+    sql, params = segment_sql(kind, segment, bot=bot)
+    return conn.execute(f'SELECT COUNT(*) FROM ({sql})', params).fetchone()[0]
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'stats.db'
+
+# Настройки соединения: WAL позволяет читать во время записи,
+# synchronous=NORMAL в WAL-режиме не делает fsync на каждый commit
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+class Storage:
+    # Одно долгоживущее соединение, которым владеет отдельный поток.
+    # Весь SQL выполняется в этом потоке, event loop только ждёт результат.
+
+    def __init__(self, path: str = DB_PATH, timer=None):
+        self.path = path
+        # timer(имя операции, секунды) — необязательный сбор метрик
+        self.timer = timer
+        self._executor = None
+        self._conn = None
+
+    # ---------- жизненный цикл ----------
+
+    def open(self):
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._executor.submit(self._connect).result()
+        logger.info(f"База {self.path} открыта")
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.submit(self._disconnect).result()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            self._conn.execute(pragma)
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ---------- выполнение ----------
+
+    def _transaction(self, fn, *args):
+        with self._conn:
+            return fn(self._conn, *args)
+
+    def run_sync(self, fn, *args):
+        # Для кода вне event loop (старт, тесты): fn(conn, *args) в одной транзакции
+        return self._executor.submit(self._transaction, fn, *args).result()
+
+    async def run(self, fn, *args):
+        # fn(conn, *args) выполняется в потоке базы в одной транзакции
+        loop = asyncio.get_running_loop()
+        if self.timer is None:
+            return await loop.run_in_executor(self._executor, self._transaction, fn, *args)
+        # Меряем вместе с ожиданием очереди потока базы — столько же ждёт и хендлер
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, self._transaction, fn, *args)
+        finally:
+            self.timer(getattr(fn, '__name__', 'sql'), time.perf_counter() - started)
+
+    async def execute(self, sql: str, params=()):
+        return await self.run(_execute, sql, params)
+
+    async def executemany(self, sql: str, seq_of_params):
+        return await self.run(_executemany, sql, list(seq_of_params))
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.run(_fetchall, sql, params)
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(_fetchone, sql, params)
+
+
+def _execute(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+
+def _executemany(conn, sql, seq_of_params):
+    return conn.executemany(sql, seq_of_params).rowcount
+
+
+def _fetchall(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+
+def _fetchone(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+
+from analytics import new_active_users, update_active_rollup, update_command_rollups
+from bots import DEFAULT_BOT
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 2.0
+MAX_PENDING_EVENTS = 500
+
+INSERT_EVENT_SQL = 'INSERT INTO command_stats (bot, user_id, command, timestamp) VALUES (?, ?, ?, ?)'
+UPSERT_ACTIVITY_SQL = '''
+    INSERT INTO user_activity (bot, user_id, date, actions_count) VALUES (?, ?, ?, ?)
+    ON CONFLICT(bot, user_id, date) DO UPDATE SET actions_count = actions_count + excluded.actions_count
+'''
+
+
+class TelemetryBuffer:
+    # Копит нажатия в памяти и сбрасывает их в базу одной транзакцией:
+    # по таймеру или при переполнении буфера.
+
+    def __init__(self, storage, flush_interval: float = FLUSH_INTERVAL, max_events: int = MAX_PENDING_EVENTS):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self._events = []
+        self._activity = Counter()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._pending_flush = None
+
+    def record(self, user_id: int, command: str, bot: str = DEFAULT_BOT):
+        # Формат как у CURRENT_TIMESTAMP (UTC), чтобы старые и новые строки сравнивались одинаково;
+        # день активности — тоже по UTC, как у агрегатов (см. analytics.py)
+        now = datetime.now(timezone.utc)
+        self._events.append((bot, user_id, command, now.strftime('%Y-%m-%d %H:%M:%S')))
+        self._activity[(bot, user_id, now.date().isoformat())] += 1
+        if len(self._events) >= self.max_events and self._pending_flush is None:
+            self._pending_flush = asyncio.get_running_loop().create_task(self._safe_flush())
+
+    @property
+    def pending(self) -> int:
+        return len(self._events)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Дописываем всё, что накопилось, перед остановкой
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._safe_flush()
+
+    async def _safe_flush(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка записи телеметрии: {e}")
+
+    async def flush(self):
+        async with self._lock:
+            self._pending_flush = None
+            if not self._events and not self._activity:
+                return
+            events, self._events = self._events, []
+            activity, self._activity = self._activity, Counter()
+            try:
+                await self.storage.run(_write_batch, events, activity)
+            except Exception:
+                # Возвращаем пачку в буфер, чтобы не потерять данные при следующем сбросе
+                self._events[:0] = events
+                self._activity.update(activity)
+                raise
+
+
+def _write_batch(conn, events, activity):
+    first_actions = new_active_users(conn, activity.keys())
+    conn.executemany(INSERT_EVENT_SQL, events)
+    conn.executemany(UPSERT_ACTIVITY_SQL, [(*key, n) for key, n in activity.items()])
+    # Агрегаты обновляются в той же транзакции, что и сырые события
+    update_command_rollups(conn, events)
+    update_active_rollup(conn, first_actions)
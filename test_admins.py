@@ -0,0 +1,37 @@
+import asyncio
+
+from admins import AdminCache
+from bot import init_db
+from storage import Storage
+
+
+def test_admin_cache_follows_changes_from_other_process(tmp_path):
+    path = str(tmp_path / 'stats.db')
+    ours, theirs = Storage(path), Storage(path)
+    ours.open()
+    theirs.open()
+    try:
+        ours.run_sync(init_db)
+        cache = AdminCache(ours)
+        cache.load()
+        initial = set(cache.ids)
+        assert len(initial) == 1
+
+        async def scenario():
+            # Ничего не менялось — список не перечитывается
+            assert not await cache.refresh()
+            # Другой процесс добавляет админа через своё соединение
+            await theirs.execute('INSERT OR IGNORE INTO admins (user_id) VALUES (?)', (555,))
+            assert await cache.refresh()
+            assert cache.is_admin(555)
+            assert 555 in cache.filter.user_ids
+
+            await theirs.execute('DELETE FROM admins WHERE user_id = ?', (555,))
+            assert await cache.refresh()
+            assert not cache.is_admin(555)
+            assert cache.filter.user_ids == frozenset(initial)
+
+        asyncio.run(scenario())
+    finally:
+        ours.close()
+        theirs.close()
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import telemetry
+from analytics import dashboard, format_dashboard, utc_today
+from bot import _add_user, init_db
+from telemetry import TelemetryBuffer
+
+
+def test_rollups_follow_flushed_events(db):
+    for user_id in (1, 2, 3):
+        db.run_sync(_add_user, user_id)
+    db.run_sync(_add_user, 1)
+
+    async def scenario():
+        telemetry = TelemetryBuffer(db, flush_interval=60)
+        for command in ('start', 'menu_faq', 'menu_faq'):
+            telemetry.record(1, command)
+        await telemetry.flush()
+        telemetry.record(1, 'menu_faq')
+        telemetry.record(2, 'menu_about')
+        await telemetry.flush()
+
+    asyncio.run(scenario())
+    today = utc_today()
+    periods = db.run_sync(dashboard, today)
+    title, days, new_users, active, average_dau, taps, top = periods[0]
+    assert (new_users, active, taps) == (3, 2, 5)
+    assert top[0] == ('menu_faq', 3)
+    # Пользователь 1 активен в двух пачках, но в DAU считается один раз
+    assert db.run_sync(lambda conn: conn.execute('SELECT SUM(n) FROM daily_active_users').fetchone()) == (2,)
+    assert 'menu_faq (3)' in format_dashboard(periods)
+
+
+def test_backfill_covers_existing_history(storage):
+    def legacy_history(conn):
+        conn.execute('CREATE TABLE command_stats (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, '
+                     'command TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
+        conn.executemany('INSERT INTO command_stats (user_id, command, timestamp) VALUES (?, ?, ?)',
+                         [(1, 'menu_faq', '2024-01-01 10:00:00'), (2, 'menu_faq', '2024-01-01 11:30:00')])
+
+    storage.run_sync(legacy_history)
+    storage.run_sync(init_db)
+    storage.run_sync(init_db)
+    rows = storage.run_sync(lambda conn: conn.execute('SELECT hour, command, n FROM stats_hourly ORDER BY hour').fetchall())
+    assert rows == [('2024-01-01 10', 'menu_faq', 1), ('2024-01-01 11', 'menu_faq', 1)]
+
+
+def test_events_near_midnight_land_on_one_utc_day(db, monkeypatch):
+    moment = datetime(2024, 6, 1, 23, 59, 30, tzinfo=timezone.utc)
+
+    class Clock(datetime):
+        # Локальное время сервера UTC+3: там уже 2 июня
+        @classmethod
+        def now(cls, tz=None):
+            return moment.astimezone(tz) if tz else (moment + timedelta(hours=3)).replace(tzinfo=None)
+
+    monkeypatch.setattr(telemetry, 'datetime', Clock)
+
+    async def scenario():
+        buffer = TelemetryBuffer(db, flush_interval=60)
+        buffer.record(1, 'menu_faq')
+        await buffer.flush()
+
+    asyncio.run(scenario())
+    days = db.run_sync(lambda conn: [
+        conn.execute(sql).fetchone() for sql in (
+            'SELECT substr(timestamp, 1, 10) FROM command_stats',
+            'SELECT date FROM user_activity',
+            'SELECT date FROM stats_daily',
+            'SELECT date FROM daily_active_users',
+        )])
+    assert days == [('2024-06-01',)] * 4
+    title, _, _, active, average_dau, taps, _ = db.run_sync(dashboard, date(2024, 6, 1))[0]
+    assert (active, average_dau, taps) == (1, 1, 1)
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter
+
+import benchmark
+import bot
+from fake_bot_api import FakeBotApi
+
+
+def test_fake_api_records_calls_and_injects_errors():
+    async def scenario():
+        api = FakeBotApi(blocked_chats={13}, seed=1)
+        await api.start()
+        client = Bot('1:TEST', base_url=api.base_url)
+        try:
+            await client.initialize()
+            first = await client.send_message(42, 'привет')
+            second = await client.send_message(42, 'ещё')
+            edited = await client.edit_message_text('новый текст', chat_id=42, message_id=first.message_id)
+            with pytest.raises(Forbidden):
+                await client.send_message(13, 'заблокирован')
+            api.push_update({'message': {'message_id': 1, 'date': 0, 'text': '/start',
+                                         'chat': {'id': 42, 'type': 'private'}}})
+            updates = await client.get_updates(timeout=1)
+            api.rate_limit_ratio = 1.0
+            with pytest.raises(RetryAfter):
+                await client.send_message(42, 'слишком часто')
+        finally:
+            await client.shutdown()
+            await api.stop()
+        return api, first, second, edited, updates
+
+    api, first, second, edited, updates = asyncio.run(scenario())
+    assert (first.message_id, second.message_id) == (1, 2)
+    assert edited.text == 'новый текст'
+    assert updates[0].message.text == '/start'
+    assert api.counts['sendMessage'] == 4
+    assert api.rate_limited['sendMessage'] == 1
+    assert [params.get('text') for _, method, params in api.calls if method == 'sendMessage'][:2] == ['привет', 'ещё']
+
+
+def test_benchmark_writes_comparable_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot.db, 'path', bot.db.path)
+    output = tmp_path / 'bench.json'
+    argv = ['--users', '5', '--clicks', '3', '--latency', '0', '--jitter', '0', '--db-events', '50',
+            '--broadcast', '5', '--broadcast-rate', '1000', '--workdir', str(tmp_path), '--output', str(output)]
+
+    assert benchmark.main(argv) == 0
+    results = json.loads(output.read_text(encoding='utf-8'))
+    assert results['handlers']['start']['count'] == 5
+    assert results['handlers']['menu']['count'] == 15
+    assert results['errors'] == 0
+    assert results['db']['rows'] == 50
+    assert results['broadcast']['sent'] == 5
+
+    # Сравнение с самим собой регрессий не находит, заметно худший прогон — находит
+    assert benchmark.compare(results, results, 0.2) == []
+    slower = json.loads(json.dumps(results))
+    slower['handlers']['menu']['p95_ms'] = results['handlers']['menu']['p95_ms'] * 2 + 1
+    assert benchmark.compare(slower, results, 0.2)
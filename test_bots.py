@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from telegram import Update
+from telegram.ext import Application
+
+import bot
+from analytics import dashboard, utc_today
+from benchmark import start_update
+from bots import DEFAULT_BOT, parse_bots
+from fake_bot_api import FakeBotApi
+from migrations import MIGRATIONS, migrate
+from persistence import load_records, write_records
+from segments import count_recipients
+from telemetry import TelemetryBuffer
+
+
+def test_parse_bots():
+    assert parse_bots('', '1:A') == [(DEFAULT_BOT, '1:A')]
+    assert parse_bots(' Main=1:A, partner=2:B ') == [('main', '1:A'), ('partner', '2:B')]
+    assert parse_bots('', None) == []
+    for bad in ('main', 'main=', 'бренд=1:A', 'a=1:A,a=2:B'):
+        with pytest.raises(ValueError):
+            parse_bots(bad)
+
+
+def test_existing_rows_belong_to_default_bot(storage):
+    def legacy(conn):
+        # База до появления нескольких ботов
+        migrate(conn, MIGRATIONS[:8])
+        conn.execute("INSERT INTO users (user_id, first_seen) VALUES (1, '2024-01-01 10:00:00')")
+        conn.execute("INSERT INTO groups (chat_id, title) VALUES (-1, 'Группа')")
+        conn.execute("INSERT INTO user_activity (user_id, date) VALUES (1, '2024-01-01')")
+        conn.execute("INSERT INTO persistence (kind, key, data) VALUES ('user', '1', '{\"a\":1}')")
+
+    storage.run_sync(legacy)
+    storage.run_sync(bot.init_db)
+    assert storage.run_sync(lambda conn: conn.execute('SELECT bot, user_id, first_seen FROM users').fetchall()) == [
+        (DEFAULT_BOT, 1, '2024-01-01 10:00:00')]
+    assert storage.run_sync(lambda conn: conn.execute('SELECT bot, chat_id FROM groups').fetchall()) == [(DEFAULT_BOT, -1)]
+    assert storage.run_sync(load_records, 'user') == [('1', '{"a":1}')]
+    # Тот же пользователь у другого бота — отдельная строка
+    storage.run_sync(bot._add_user, 1, 'partner')
+    storage.run_sync(write_records, {('user', '1'): '{"b":2}'}, 'partner')
+    assert storage.run_sync(lambda conn: conn.execute('SELECT COUNT(*) FROM users').fetchone()) == (2,)
+    assert storage.run_sync(load_records, 'user') == [('1', '{"a":1}')]
+
+
+def test_bots_share_storage_but_keep_their_rows(db, monkeypatch):
+    monkeypatch.setattr(bot, 'db', db)
+    monkeypatch.setattr(bot, 'telemetry', TelemetryBuffer(db))
+    monkeypatch.setattr(bot, 'BOT_NAMES', {'1:MAIN': 'main', '2:PARTNER': 'partner'})
+
+    async def scenario():
+        api = FakeBotApi()
+        await api.start()
+        applications = {}
+        try:
+            for token in ('1:MAIN', '2:PARTNER'):
+                application = Application.builder().token(token).base_url(api.base_url).build()
+                bot.register_handlers(application)
+                await application.initialize()
+                applications[token] = application
+            # Пользователь 5 пришёл в оба бота, пользователь 6 — только в партнёрский
+            for token, user_id in (('1:MAIN', 5), ('2:PARTNER', 5), ('2:PARTNER', 6)):
+                application = applications[token]
+                await application.process_update(Update.de_json(start_update(user_id), application.bot))
+            await bot.telemetry.flush()
+        finally:
+            for application in applications.values():
+                await application.shutdown()
+            await api.stop()
+
+    asyncio.run(scenario())
+    assert db.run_sync(lambda conn: conn.execute('SELECT bot, user_id FROM users ORDER BY bot, user_id').fetchall()) == [
+        ('main', 5), ('partner', 5), ('partner', 6)]
+    assert db.run_sync(lambda conn: conn.execute(
+        'SELECT bot, COUNT(*) FROM command_stats GROUP BY bot ORDER BY bot').fetchall()) == [('main', 1), ('partner', 2)]
+    assert db.run_sync(count_recipients, 'broadcast_users', {}, 'main') == 1
+    assert db.run_sync(count_recipients, 'broadcast_users', {}, 'partner') == 2
+    today = utc_today()
+    assert db.run_sync(dashboard, today, 'partner')[0][2:4] == (2, 2)
+    assert db.run_sync(dashboard, today, 'main')[0][2:4] == (1, 1)
+    assert {'main', 'partner'} <= set(bot.renders)
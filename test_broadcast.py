@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from broadcast import Broadcaster, BroadcastStats, TokenBucket
+
+
+class FakeBot:
+
+    def __init__(self):
+        self.delivered = []
+        self.flooded = False
+
+    async def send(self, bot, chat_id):
+        if chat_id == 13 and not self.flooded:
+            self.flooded = True
+            raise RetryAfter(0)
+        if chat_id == 66:
+            raise Forbidden("bot was blocked by the user")
+        if chat_id == 77:
+            raise BadRequest("Chat not found")
+        if chat_id == 99:
+            raise BadRequest("message text is empty")
+        self.delivered.append(chat_id)
+
+
+def test_broadcast_retries_flood_and_classifies_failures():
+    bot = FakeBot()
+    recipients = list(range(1, 40)) + [66, 77, 99]
+
+    async def scenario():
+        broadcaster = Broadcaster(bot, TokenBucket(rate=1000), concurrency=5)
+        return await broadcaster.run(recipients, bot.send, BroadcastStats(len(recipients)))
+
+    stats = asyncio.run(scenario())
+    assert sorted(bot.delivered) == list(range(1, 40))
+    assert (stats.sent, stats.blocked, stats.failed, stats.retries) == (39, 2, 1, 1)
+
+
+def test_token_bucket_limits_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.19
+
+
+def test_token_bucket_does_not_burst_after_pause():
+    async def scenario():
+        bucket = TokenBucket(rate=50)
+        bucket.pause(0.05)
+        resumed = time.monotonic() + 0.05
+        sent = 0
+        # За 0.2 с после конца паузы при 50/с — не больше ~10 сообщений
+        while time.monotonic() < resumed + 0.2:
+            await bucket.acquire()
+            sent += 1
+        return sent
+
+    assert asyncio.run(scenario()) <= 12
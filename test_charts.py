@@ -0,0 +1,63 @@
+import asyncio
+
+from charts import ChartService, upsert_conversions
+
+
+class FakePhoto:
+
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeMessage:
+
+    def __init__(self, file_id):
+        self.photo = [FakePhoto(file_id)]
+
+
+class FakeBot:
+
+    def __init__(self):
+        self.uploads = []
+
+    async def send_photo(self, chat_id, photo, disable_notification=False):
+        self.uploads.append((chat_id, photo))
+        return FakeMessage(f'file-{len(self.uploads)}')
+
+
+def test_charts_are_uploaded_once_per_data_version(db):
+    rendered = []
+
+    def render(title, rows):
+        rendered.append((title, len(rows)))
+        return b'png'
+
+    bot = FakeBot()
+    service = ChartService(db, upload_chat_id=42, render=render)
+
+    async def scenario():
+        await service.refresh(bot)
+        assert service.file_id('stats_7') is None
+
+        for day in range(1, 11):
+            await db.run(upsert_conversions, f'2026-10-{day:02d}', 1000, 250, 20)
+        await service.refresh(bot)
+        first = (service.file_id('stats_7'), service.file_id('stats_30'))
+        # Данные не менялись — повторный рендер и загрузка не нужны
+        await service.refresh(bot)
+        assert len(bot.uploads) == 2
+
+        # Новый процесс берёт file_id из кэша в базе без загрузки
+        restarted = ChartService(db, upload_chat_id=42, render=render)
+        await restarted.refresh(bot)
+        assert (restarted.file_id('stats_7'), restarted.file_id('stats_30')) == first
+        assert len(bot.uploads) == 2
+
+        await db.run(upsert_conversions, '2026-10-11', 900, 200, 30)
+        await service.refresh(bot)
+        return first
+
+    first = asyncio.run(scenario())
+    assert len(bot.uploads) == 4
+    assert service.file_id('stats_7') not in first
+    assert rendered[:2] == [("Click2Reg / Reg2Dep за 30 дней", 10), ("Click2Reg / Reg2Dep за 7 дней", 7)]
@@ -0,0 +1,82 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+import pytest
+from telegram import Bot
+
+import bot
+import jobstore
+from export import ExportStats, export_filename, export_table, parse_export_args
+from fake_bot_api import FakeBotApi
+from jobs import Job
+
+
+def fill(conn):
+    conn.executemany('INSERT INTO command_stats (user_id, command, timestamp) VALUES (?, ?, ?)', [
+        (user_id, f'menu_{user_id % 3}', f'2024-06-{day:02d} 12:00:00')
+        for day in (1, 2, 3) for user_id in range(1, 6)
+    ])
+    conn.executemany('INSERT INTO groups (chat_id, title) VALUES (?, ?)', [(-1, 'Чат, "с кавычками"'), (-2, 'Группа')])
+
+
+def test_parse_export_args():
+    assert parse_export_args(['activity']) == ('activity', 'csv', None, None)
+    assert parse_export_args(['users', '2024-05-01', 'jsonl']) == ('users', 'jsonl', '2024-05-01', None)
+    assert export_filename('activity', 'csv', '2024-06-01', '2024-06-02') == 'activity_2024-06-01_2024-06-02.csv.gz'
+    for bad in ([], ['payments'], ['users', 'xml'], ['users', '2024-06-02', '2024-06-01']):
+        with pytest.raises(ValueError):
+            parse_export_args(bad)
+
+
+def test_export_streams_chunks_with_filters(db):
+    db.run_sync(fill)
+    reads = []
+    db.timer = lambda operation, seconds: reads.append(operation)
+
+    async def export(*args, **kwargs):
+        with await export_table(db, *args, **kwargs) as document:
+            return gzip.decompress(document.read()).decode('utf-8')
+
+    stats = ExportStats()
+    text = asyncio.run(export('activity', 'csv', '2024-06-02', '2024-06-03', stats=stats, chunk=4))
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == ['id', 'user_id', 'command', 'timestamp']
+    assert len(rows) == 11 and stats.rows == 10
+    assert all(row[3].startswith(('2024-06-02', '2024-06-03')) for row in rows[1:])
+    # Строки читаются порциями по 4, а не одним запросом
+    assert reads.count('fetch_chunk') == 4
+
+    records = [json.loads(line) for line in asyncio.run(export('groups', 'jsonl')).splitlines()]
+    assert [(r['chat_id'], r['title']) for r in records] == [(-2, 'Группа'), (-1, 'Чат, "с кавычками"')]
+
+    assert asyncio.run(export('activity', 'csv', '2025-01-01')) == 'id,user_id,command,timestamp\n'
+
+
+def test_export_jobs_are_not_resumed(db):
+    db.run_sync(jobstore.create_job, 'export', 1, {'table': 'users'})
+    assert db.run_sync(jobstore.unfinished_jobs) == []
+
+
+def test_export_job_uploads_document(db, monkeypatch):
+    db.run_sync(fill)
+    monkeypatch.setattr(bot, 'db', db)
+
+    async def scenario():
+        api = FakeBotApi()
+        await api.start()
+        try:
+            async with Bot('1:TEST', base_url=api.base_url) as telegram_bot:
+                job_id = await db.run(jobstore.create_job, 'export', 7, {'table': 'activity'})
+                await bot.run_export_job(Job(job_id, 'export', 7), telegram_bot, 'activity', 'csv')
+                return job_id, [params for _, method, params in api.calls if method == 'sendDocument']
+        finally:
+            await api.stop()
+
+    job_id, uploads = asyncio.run(scenario())
+    assert len(uploads) == 1
+    assert str(uploads[0]['chat_id']) == '7'
+    assert 'строк: 15' in uploads[0]['caption']
+    assert db.run_sync(jobstore.job_status, job_id) == 'done'
@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ApplicationHandlerStop
+
+import bot
+from flood import FloodControl, parse_limits
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_limits_burst_and_refills():
+    clock = FakeClock()
+    flood = FloodControl({'callback': (2.0, 3)}, clock=clock)
+    assert [flood.allow(1, 'callback') for _ in range(4)] == [True, True, True, False]
+    # Другой пользователь и другой класс апдейтов считаются отдельно
+    assert flood.allow(2, 'callback')
+    assert flood.allow(1, 'unknown')
+    clock.now = 0.5
+    assert flood.allow(1, 'callback')
+    assert not flood.allow(1, 'callback')
+
+
+def test_idle_buckets_are_evicted():
+    clock = FakeClock()
+    flood = FloodControl({'callback': (1.0, 2)}, clock=clock, sweep_interval=10)
+    for user_id in range(100):
+        flood.allow(user_id, 'callback')
+    assert len(flood) == 100
+    clock.now = 1.0
+    flood.allow(500, 'callback')
+    flood.sweep()
+    # Все ведра, кроме только что тронутого, уже наполнились и не отличаются от новых
+    assert len(flood) == 1
+
+
+def test_parse_limits():
+    assert parse_limits("callback=2/6, command=0.5/3") == {'callback': (2.0, 6), 'command': (0.5, 3)}
+    assert parse_limits("") == {}
+
+
+def test_guard_answers_throttled_callback_and_stops_dispatch(monkeypatch):
+    monkeypatch.setattr(bot, 'flood', FloodControl({'callback': (0.001, 1)}))
+    answers = []
+
+    async def answer(text=None, **kwargs):
+        answers.append(text)
+
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=555),
+        callback_query=SimpleNamespace(data='menu_faq', answer=answer),
+        message=None,
+    )
+
+    async def scenario():
+        await bot.flood_guard(update, None)
+        with pytest.raises(ApplicationHandlerStop):
+            await bot.flood_guard(update, None)
+
+    asyncio.run(scenario())
+    assert len(answers) == 1
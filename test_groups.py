@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram import Bot, Update
+
+import bot
+
+BOT_ID = 100000
+ADMIN_RIGHTS = dict.fromkeys((
+    'can_be_edited', 'is_anonymous', 'can_manage_chat', 'can_delete_messages', 'can_manage_video_chats',
+    'can_restrict_members', 'can_promote_members', 'can_change_info', 'can_invite_users',
+    'can_post_stories', 'can_edit_stories', 'can_delete_stories'), False)
+MEMBER_FIELDS = {'administrator': ADMIN_RIGHTS, 'kicked': {'until_date': 0}}
+GROUP = {'id': -100, 'type': 'group', 'title': 'Партнёры'}
+
+
+def member_update(chat: dict, old_status: str, new_status: str) -> dict:
+    bot_user = {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bot'}
+
+    def member(status):
+        return dict({'status': status, 'user': bot_user}, **MEMBER_FIELDS.get(status, {}))
+
+    return {
+        'update_id': 1,
+        'my_chat_member': {
+            'chat': chat, 'date': 0,
+            'from': {'id': 7, 'is_bot': False, 'first_name': 'Admin'},
+            'old_chat_member': member(old_status),
+            'new_chat_member': member(new_status),
+        },
+    }
+
+
+def test_group_membership_follows_my_chat_member(db, monkeypatch):
+    monkeypatch.setattr(bot, 'db', db)
+    telegram_bot = Bot('1:TEST')
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append(chat_id)
+
+    context = SimpleNamespace(bot=SimpleNamespace(token='1:TEST', send_message=send_message))
+
+    def groups():
+        return db.run_sync(lambda conn: conn.execute(
+            'SELECT chat_id, title, active FROM groups ORDER BY chat_id').fetchall())
+
+    async def feed(data):
+        await bot.track_my_chat_member(Update.de_json(data, telegram_bot), context)
+
+    asyncio.run(feed(member_update(GROUP, 'left', 'member')))
+    assert groups() == [(-100, 'Партнёры', 1)]
+    # Повышение до админа — не новое добавление, приветствие не повторяется
+    asyncio.run(feed(member_update(dict(GROUP, title='Партнёры 2.0'), 'member', 'administrator')))
+    assert groups() == [(-100, 'Партнёры 2.0', 1)]
+    assert sent == [-100]
+
+    asyncio.run(feed(member_update(GROUP, 'administrator', 'kicked')))
+    assert groups() == [(-100, 'Партнёры 2.0', 0)]
+
+    # Группа стала супергруппой: новая запись активна, старая выключена
+    asyncio.run(feed(member_update(GROUP, 'kicked', 'member')))
+    db.run_sync(bot._migrate_group, -100, -1001)
+    assert groups() == [(-1001, 'Партнёры', 1), (-100, 'Партнёры', 0)]
+
+    # Пользователь заблокировал бота в личке
+    db.run_sync(bot._add_user, 42)
+    asyncio.run(feed(member_update({'id': 42, 'type': 'private'}, 'member', 'kicked')))
+    assert db.run_sync(lambda conn: conn.execute('SELECT active FROM users WHERE user_id = 42').fetchone()) == (0,)
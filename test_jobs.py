@@ -0,0 +1,49 @@
+import asyncio
+
+from jobs import JobManager
+
+
+def test_job_runs_in_background_and_can_be_cancelled():
+    async def scenario():
+        manager = JobManager()
+        started = asyncio.Event()
+
+        async def endless(job):
+            started.set()
+            await asyncio.sleep(3600)
+
+        async def quick(job):
+            job.error = None
+
+        long_job = manager.start(1, 'broadcast_users', 1, endless)
+        short_job = manager.start(2, 'export', 1, quick)
+        # start() возвращается сразу, работа идёт в фоне
+        assert long_job.status == 'running'
+        await started.wait()
+        await asyncio.sleep(0)
+        assert short_job.status == 'done'
+        assert [job.id for job in manager.running()] == [long_job.id]
+
+        assert manager.cancel(long_job.id)
+        await asyncio.gather(long_job.task, return_exceptions=True)
+        assert long_job.status == 'cancelled'
+        assert not manager.cancel(long_job.id)
+        assert 'отменена' in long_job.describe()
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_records_error():
+    async def scenario():
+        manager = JobManager()
+
+        async def broken(job):
+            raise RuntimeError('db is gone')
+
+        job = manager.start(1, 'broadcast_groups', 1, broken)
+        await job.task
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == 'failed'
+    assert job.error == 'db is gone'
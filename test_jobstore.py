@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+import jobstore
+from bots import DEFAULT_BOT
+from broadcast import Broadcaster, BroadcastStats, TokenBucket
+from jobs import JobManager
+
+PAYLOAD = {'type': 'text', 'text': 'hi'}
+
+
+def add_users(conn):
+    conn.executemany('INSERT INTO users (user_id) VALUES (?)', [(i,) for i in range(1, 51)])
+
+
+def test_resumed_broadcast_skips_already_delivered(db):
+    db.run_sync(add_users)
+    delivered = []
+
+    async def send(bot, chat_id):
+        delivered.append(chat_id)
+
+    async def scenario():
+        job_id = await db.run(jobstore.create_broadcast_job, 'broadcast_users', 1, PAYLOAD)
+        await jobstore.snapshot_recipients(db, job_id, jobstore.recipients_sql('broadcast_users'), (DEFAULT_BOT,), chunk=8)
+        # Первый процесс успел доставить 20 сообщений и записать чекпоинт
+        checkpoint = jobstore.DeliveryCheckpoint(db, job_id, batch_size=5)
+        for chat_id in range(1, 21):
+            await send(None, chat_id)
+            await checkpoint.record(chat_id, 'sent')
+        await checkpoint.flush()
+
+        # После рестарта задача продолжается только по необработанным получателям
+        assert await db.run(jobstore.unfinished_jobs) == [(job_id, 'broadcast_users', 1, PAYLOAD, {})]
+        checkpoint = jobstore.DeliveryCheckpoint(db, job_id)
+        await Broadcaster(None, TokenBucket(rate=1000), concurrency=4).run(
+            jobstore.iter_pending(db, job_id, chunk=7), send, BroadcastStats(), on_result=checkpoint.record
+        )
+        await checkpoint.flush()
+        return await db.run(jobstore.delivery_counts, job_id)
+
+    counts = asyncio.run(scenario())
+    assert sorted(delivered) == list(range(1, 51))
+    assert counts == {'sent': 50}
+
+
+def test_blocked_recipients_are_pruned_from_next_snapshot(db):
+    db.run_sync(add_users)
+
+    async def scenario():
+        sql = jobstore.recipients_sql('broadcast_users')
+        first = await db.run(jobstore.create_broadcast_job, 'broadcast_users', 1, PAYLOAD)
+        await jobstore.snapshot_recipients(db, first, sql, (DEFAULT_BOT,))
+        checkpoint = jobstore.DeliveryCheckpoint(db, first, prune_table=jobstore.RECIPIENT_TABLES['broadcast_users'])
+        await checkpoint.record(7, 'blocked')
+        await checkpoint.record(8, 'sent')
+        await checkpoint.flush()
+
+        second = await db.run(jobstore.create_broadcast_job, 'broadcast_users', 1, PAYLOAD)
+        await jobstore.snapshot_recipients(db, second, sql, (DEFAULT_BOT,))
+        return await db.run(jobstore.delivery_counts, second), await db.run(jobstore.job_status, second)
+
+    counts, status = asyncio.run(scenario())
+    assert counts == {'pending': 49}
+    assert status == 'running'
+    blocked = db.run_sync(lambda conn: conn.execute(
+        'SELECT user_id FROM users WHERE active = 0 AND blocked_at IS NOT NULL').fetchall())
+    assert blocked == [(7,)]
+
+
+def test_broadcast_cancelled_while_preparing_is_not_resumed(db, monkeypatch):
+    db.run_sync(add_users)
+    monkeypatch.setattr(bot, 'db', db)
+    monkeypatch.setattr(bot, 'jobs', JobManager())
+    snapshot_started = asyncio.Event()
+    sent = []
+
+    async def slow_snapshot(storage, job_id, sql, params=(), chunk=jobstore.PENDING_CHUNK):
+        snapshot_started.set()
+        await asyncio.sleep(3600)
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append(text)
+
+    monkeypatch.setattr(jobstore, 'snapshot_recipients', slow_snapshot)
+    telegram_bot = SimpleNamespace(token='1:TEST', send_message=send_message)
+
+    async def scenario():
+        job = await bot.start_broadcast(telegram_bot, 1, 'broadcast_users', PAYLOAD)
+        await snapshot_started.wait()
+        assert bot.jobs.cancel(job.id)
+        await asyncio.gather(job.task, return_exceptions=True)
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == 'cancelled'
+    assert db.run_sync(jobstore.job_status, job.id) == 'cancelled'
+    assert db.run_sync(jobstore.unfinished_jobs) == []
+    assert sent == [f"⛔ Задача #{job.id} отменена."]
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import TimedOut
+
+import bot
+from menu import MAIN_MENU, SCREENS, LruTtlCache, MenuRegistry, RenderTracker, compile_screens
+
+
+def test_builtin_screens_compile_with_back_buttons():
+    registry = MenuRegistry()
+    cpa = registry.get('conditions_cpa')
+    assert cpa.parse_mode == 'HTML'
+    back = cpa.markup.inline_keyboard[-1][0]
+    assert (back.text, back.callback_data) == ("◀️ Назад к условиям", 'menu_conditions')
+    # Один и тот же объект разметки на каждое нажатие
+    assert registry.get('menu_faq').markup is registry.get('menu_faq').markup
+    assert registry.get('menu_about').link_preview.is_disabled
+    assert 'unknown' not in registry
+
+
+def test_compile_rejects_dangling_callbacks():
+    broken = [dict(SCREENS[0], buttons=[[{'text': 'x', 'callback': 'nowhere'}]])]
+    with pytest.raises(ValueError):
+        compile_screens(broken)
+
+
+def test_registry_hot_reloads_file(tmp_path):
+    path = tmp_path / 'menu.json'
+    registry = MenuRegistry(path=str(path))
+    assert registry.get(MAIN_MENU).text == SCREENS[0]['text']
+
+    screens = [
+        {'id': MAIN_MENU, 'text': 'Новое меню', 'buttons': [[{'text': 'Акции', 'callback': 'promo'}]]},
+        {'id': 'promo', 'parent': MAIN_MENU, 'text': 'Акции недели'},
+    ]
+    path.write_text(json.dumps(screens, ensure_ascii=False), encoding='utf-8')
+    assert registry.reload()
+    assert registry.get(MAIN_MENU).text == 'Новое меню'
+    assert registry.get('promo').markup.inline_keyboard[-1][0].callback_data == MAIN_MENU
+
+    # Битый файл не ломает загруженное меню
+    path.write_text('{not json', encoding='utf-8')
+    os.utime(path, (1, 1))
+    assert not registry.reload()
+    assert registry.get('promo').text == 'Акции недели'
+
+
+def test_render_tracker_skips_repeated_taps():
+    registry = MenuRegistry()
+    tracker = RenderTracker(registry, debounce=60)
+    assert not tracker.is_redundant(1, 10, 1, 'menu_faq')
+    tracker.mark_rendered(1, 10, 'menu_faq')
+    tracker.mark_tapped(1, 10, 1, 'menu_faq')
+    # Двойное нажатие той же кнопки
+    assert tracker.is_redundant(1, 10, 1, 'menu_faq')
+    # Переход на другой экран и «Назад» на уже открытый экран
+    assert not tracker.is_redundant(1, 10, 1, 'main_menu')
+    tracker.mark_rendered(1, 10, 'main_menu')
+    tracker = RenderTracker(registry, debounce=0)
+    tracker.mark_rendered(1, 10, 'main_menu')
+    assert tracker.is_redundant(1, 10, 1, 'main_menu')
+    assert not tracker.is_redundant(1, 11, 1, 'main_menu')
+
+
+def test_menu_tap_is_retried_after_failed_edit(monkeypatch):
+    monkeypatch.setattr(bot, 'renders', {})
+    monkeypatch.setattr(bot, 'telemetry', SimpleNamespace(record=lambda *args: None))
+    edits = []
+
+    async def edit_message_text(**kwargs):
+        edits.append(kwargs['text'])
+        if len(edits) == 1:
+            raise TimedOut()
+
+    async def noop(*args, **kwargs):
+        pass
+
+    message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=10, photo=None, reply_text=noop)
+    query = SimpleNamespace(data='menu_faq', from_user=SimpleNamespace(id=1), message=message,
+                            answer=noop, edit_message_text=edit_message_text)
+    update = SimpleNamespace(callback_query=query)
+    context = SimpleNamespace(bot=SimpleNamespace(token='1:TEST'))
+
+    async def scenario():
+        for _ in range(3):
+            await bot.handle_menu(update, context)
+
+    asyncio.run(scenario())
+    # Первая попытка упала, повтор отрисовал экран, третье нажатие — уже показанный экран
+    assert len(edits) == 2
+
+
+def test_lru_ttl_cache_evicts_oldest():
+    cache = LruTtlCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    expired = LruTtlCache(max_size=2, ttl=-1)
+    expired.set('a', 1)
+    assert expired.get('a') is None
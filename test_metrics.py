@@ -0,0 +1,81 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from fake_bot_api import FakeBotApi
+from metrics import Histogram, InstrumentedRequest, Metrics, MetricsServer
+
+
+def test_histogram_quantile_interpolates_within_bucket():
+    histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+    for _ in range(90):
+        histogram.observe(0.005)
+    for _ in range(10):
+        histogram.observe(0.5)
+    assert histogram.quantile(0.5) == pytest.approx(0.01 * 50 / 90)
+    assert 0.1 < histogram.quantile(0.95) <= 1.0
+    assert histogram.count == 100
+
+
+def test_instrumented_handler_and_prometheus_text():
+    metrics = Metrics()
+    metrics.add_collector(lambda: [('bot_telemetry_pending_events', {}, 3)])
+
+    async def handler(update, context):
+        if update.callback_query.data == 'boom':
+            raise ValueError
+        await asyncio.sleep(0)
+
+    timed = metrics.instrument('menu', handler, known_callbacks={'menu_faq'})
+
+    def tap(data):
+        return SimpleNamespace(callback_query=SimpleNamespace(data=data))
+
+    async def scenario():
+        await timed(tap('menu_faq'), None)
+        await timed(tap('какой-то мусор'), None)
+        with pytest.raises(ValueError):
+            await timed(tap('boom'), None)
+
+    asyncio.run(scenario())
+    text = metrics.render()
+    assert 'bot_handler_seconds_count{handler="menu"} 3' in text
+    assert 'bot_callback_seconds_count{data="menu_faq"} 1' in text
+    assert 'bot_callback_seconds_count{data="other"} 2' in text
+    assert 'bot_handler_errors_total{handler="menu"} 1' in text
+    assert 'bot_telemetry_pending_events 3' in text
+    assert 'menu: ' in metrics.summary()
+
+
+def test_bot_api_calls_are_counted_and_served_over_http():
+    async def scenario():
+        metrics = Metrics()
+        api = FakeBotApi()
+        await api.start()
+        client = Bot('1:TEST', base_url=api.base_url, request=InstrumentedRequest(metrics))
+        server = MetricsServer(metrics, port=0)
+        await server.start()
+        try:
+            await client.initialize()
+            await client.send_message(1, 'ok')
+            api.rate_limit_ratio = 1.0
+            with pytest.raises(RetryAfter):
+                await client.send_message(1, 'limited')
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = (await reader.read()).decode()
+            writer.close()
+        finally:
+            await server.stop()
+            await client.shutdown()
+            await api.stop()
+        return metrics, response
+
+    metrics, response = asyncio.run(scenario())
+    assert response.startswith('HTTP/1.1 200 OK')
+    assert 'bot_api_requests_total{code="200",method="sendMessage"} 1' in response
+    assert 'bot_api_requests_total{code="429",method="sendMessage"} 1' in response
+    assert '429: 1' in metrics.summary()
@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from bot import INITIAL_ADMIN_ID, init_db
+from migrations import MIGRATIONS, migrate, schema_version
+from storage import Storage
+
+
+def test_fresh_database_reaches_latest_version_once(db):
+    assert db.run_sync(schema_version) == len(MIGRATIONS)
+    assert db.run_sync(lambda conn: conn.execute('SELECT user_id FROM admins').fetchall()) == [(INITIAL_ADMIN_ID,)]
+    # Повторный старт ничего не применяет
+    assert db.run_sync(migrate) == []
+
+
+def test_unversioned_database_is_upgraded_in_place(tmp_path):
+    path = str(tmp_path / 'stats.db')
+    # База в виде, в котором её создавала первая версия бота
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE users (user_id INTEGER PRIMARY KEY, first_seen DATETIME DEFAULT CURRENT_TIMESTAMP)')
+    conn.execute('CREATE TABLE admins (user_id INTEGER PRIMARY KEY)')
+    conn.execute('INSERT INTO users (user_id) VALUES (1), (2)')
+    conn.commit()
+    conn.close()
+
+    db = Storage(path)
+    db.open()
+    try:
+        db.run_sync(init_db)
+        users = db.run_sync(lambda conn: conn.execute('SELECT user_id, active FROM users ORDER BY user_id').fetchall())
+        assert users == [(1, 1), (2, 1)]
+        assert db.run_sync(schema_version) == len(MIGRATIONS)
+    finally:
+        db.close()
+
+
+def test_failed_step_is_rolled_back(storage):
+    def create(conn):
+        conn.execute('CREATE TABLE a (x INTEGER)')
+
+    def broken(conn):
+        conn.execute('CREATE TABLE b (x INTEGER)')
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        storage.run_sync(migrate, (create, broken))
+    tables = storage.run_sync(lambda conn: conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name").fetchall())
+    assert tables == [('a',)]
+    assert storage.run_sync(schema_version) == 1
+
+
+def schema_of(conn):
+    return conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+
+
+def test_upgrade_from_every_version_matches_fresh_schema(tmp_path):
+    # Шаги не зависят от текущего кода модулей: база любой прошлой версии приходит к той же схеме
+    fresh = sqlite3.connect(':memory:')
+    migrate(fresh)
+    expected = schema_of(fresh)
+    for version in range(1, len(MIGRATIONS)):
+        conn = sqlite3.connect(str(tmp_path / f'v{version}.db'))
+        migrate(conn, MIGRATIONS[:version])
+        migrate(conn)
+        assert schema_of(conn) == expected, version
+        conn.close()
@@ -0,0 +1,63 @@
+import asyncio
+
+from telegram.ext import Application
+
+from fake_bot_api import FakeBotApi
+from persistence import SqlitePersistence, load_records
+
+
+def test_user_data_survives_restart(db):
+    async def run_app(api, change):
+        application = (
+            Application.builder().token('1:TEST').base_url(api.base_url)
+            .persistence(SqlitePersistence(db, update_interval=3600)).build()
+        )
+        await application.initialize()
+        restored = {user_id: dict(data) for user_id, data in application.user_data.items()}
+        change(application)
+        # Без start() периодического сохранения нет: один проход вручную, shutdown вызовет flush
+        await application.update_persistence()
+        await application.shutdown()
+        return restored
+
+    def start_broadcast_flow(application):
+        application.user_data[7]['admin_action'] = 'broadcast_segment'
+        application.user_data[7]['pending_broadcast'] = {'kind': 'broadcast_users', 'segment': {'active': 7}}
+        # Пользователь, у которого ничего не хранится, не должен оставлять строк в базе
+        application.user_data[8].clear()
+        application.mark_data_for_update_persistence(user_ids=[7, 8])
+
+    async def scenario():
+        api = FakeBotApi()
+        await api.start()
+        try:
+            await run_app(api, start_broadcast_flow)
+            return await run_app(api, lambda application: None)
+        finally:
+            await api.stop()
+
+    restored = asyncio.run(scenario())
+    assert restored == {7: {'admin_action': 'broadcast_segment',
+                            'pending_broadcast': {'kind': 'broadcast_users', 'segment': {'active': 7}}}}
+    assert [key for key, _ in db.run_sync(load_records, 'user')] == ['7']
+
+
+def test_unchanged_records_are_not_rewritten(db):
+    writes = []
+    db.timer = lambda operation, seconds: writes.append(operation)
+
+    async def scenario():
+        persistence = SqlitePersistence(db)
+        await persistence.get_user_data()
+        await persistence.update_user_data(1, {'admin_action': 'add_admin'})
+        await persistence.update_user_data(2, {})
+        await persistence.flush()
+        await persistence.update_user_data(1, {'admin_action': 'add_admin'})
+        await persistence.update_user_data(2, {})
+        await persistence.flush()
+        await persistence.drop_user_data(1)
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    assert writes.count('write_records') == 2
+    assert db.run_sync(load_records, 'user') == []
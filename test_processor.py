@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+
+import bot
+from benchmark import start_update
+from fake_bot_api import FakeBotApi
+from metrics import Metrics
+from processor import ChatOrderedProcessor, update_key
+
+
+def chat_update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None)
+
+
+def test_update_key_falls_back_to_user():
+    assert update_key(chat_update(-100)) == -100
+    assert update_key(SimpleNamespace(effective_chat=None, effective_user=SimpleNamespace(id=7))) == 7
+    assert update_key(SimpleNamespace(effective_chat=None, effective_user=None)) is None
+
+
+def test_chat_order_is_kept_and_chats_run_in_parallel():
+    events = []
+    running = 0
+    peak = 0
+
+    async def handle(chat_id, n, delay):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        events.append(('start', chat_id, n))
+        await asyncio.sleep(delay)
+        events.append(('end', chat_id, n))
+        running -= 1
+
+    async def scenario():
+        processor = ChatOrderedProcessor(max_concurrent_updates=2)
+        await processor.initialize()
+        # Первый апдейт чата 1 медленный: второй должен дождаться его, а чат 2 — нет
+        updates = [(1, 0, 0.05), (1, 1, 0), (2, 0, 0), (2, 1, 0), (3, 0, 0)]
+        await asyncio.gather(*(
+            processor.process_update(chat_update(chat_id), handle(chat_id, n, delay))
+            for chat_id, n, delay in updates
+        ))
+        assert processor.active_chats > 0
+        await processor.shutdown()
+        return processor
+
+    processor = asyncio.run(scenario())
+    for chat_id in (1, 2):
+        assert [n for kind, c, n in events if kind == 'start' and c == chat_id] == [0, 1]
+    # Второй апдейт чата 1 стартует только после окончания первого
+    assert events.index(('end', 1, 0)) < events.index(('start', 1, 1))
+    # Чат 2 целиком обработан, пока чат 1 ждал медленный апдейт
+    assert events.index(('end', 2, 1)) < events.index(('end', 1, 0))
+    assert peak == 2
+    assert processor.active_chats == 0 and processor.pending == 0
+
+
+def test_overflowing_chat_drops_only_its_own_updates():
+    handled = []
+    metrics = Metrics()
+
+    async def handle(chat_id, n):
+        await asyncio.sleep(0)
+        handled.append((chat_id, n))
+
+    async def scenario():
+        processor = ChatOrderedProcessor(max_concurrent_updates=4, max_queued_per_chat=2,
+                                         on_drop=lambda: metrics.inc('bot_updates_dropped_total', bot='main'))
+        await processor.process_update(chat_update(1), handle(1, 0))
+        await asyncio.sleep(0)
+        for n in range(1, 5):
+            await processor.process_update(chat_update(1), handle(1, n))
+        await processor.process_update(chat_update(2), handle(2, 0))
+        await processor.shutdown()
+        return processor
+
+    processor = asyncio.run(scenario())
+    # Первый апдейт уже взят в работу, два ждут, два лишних отброшены
+    assert [n for chat_id, n in handled if chat_id == 1] == [0, 1, 2]
+    assert (2, 0) in handled
+    assert processor.dropped == 2
+    assert '# TYPE bot_updates_dropped_total counter' in metrics.render()
+    assert 'bot_updates_dropped_total{bot="main"} 2' in metrics.render()
+
+
+def test_queued_updates_finish_before_the_bot_closes():
+    results = []
+
+    async def reply(update, context):
+        await asyncio.sleep(0.01)
+        try:
+            await update.message.reply_text("ok")
+            results.append('sent')
+        except Exception as e:
+            results.append(type(e).__name__)
+
+    async def scenario():
+        api = FakeBotApi()
+        await api.start()
+        try:
+            application = (
+                Application.builder().token('1:TEST').base_url(api.base_url)
+                .concurrent_updates(ChatOrderedProcessor()).build()
+            )
+            application.add_handler(MessageHandler(filters.ALL, reply))
+            await application.initialize()
+            await application.start()
+            # Три апдейта одного чата ждут в очереди, когда приходит остановка
+            for _ in range(3):
+                await application.update_queue.put(Update.de_json(start_update(5), application.bot))
+            await bot.stop_application(application)
+            await application.shutdown()
+            return api.counts.get('sendMessage', 0)
+        finally:
+            await api.stop()
+
+    assert asyncio.run(scenario()) == 3
+    assert results == ['sent'] * 3
@@ -0,0 +1,35 @@
+import asyncio
+import gzip
+import json
+
+from bot import init_db
+from retention import RetentionWorker, enable_incremental_vacuum
+
+
+def test_old_events_are_archived_and_deleted_in_batches(storage, tmp_path):
+    storage.run_sync(enable_incremental_vacuum)
+    storage.run_sync(init_db)
+
+    def history(conn):
+        rows = [(1, 'menu_faq', f'2020-01-{day:02d} 10:00:00') for day in range(1, 29)]
+        rows += [(2, 'menu_about', '2020-02-01 09:00:00')]
+        rows += [(3, 'start', '2999-01-01 00:00:00')]
+        conn.executemany('INSERT INTO command_stats (user_id, command, timestamp) VALUES (?, ?, ?)', rows)
+        conn.execute("INSERT INTO stats_hourly (hour, command, n) VALUES ('2020-01-01 10', 'menu_faq', 1)")
+
+    storage.run_sync(history)
+    archive_dir = tmp_path / 'archive'
+    worker = RetentionWorker(storage, days=30, archive_dir=str(archive_dir), batch_size=10, pause=0)
+    assert asyncio.run(worker.run_once()) == 29
+
+    remaining = storage.run_sync(lambda conn: conn.execute('SELECT user_id FROM command_stats').fetchall())
+    assert remaining == [(3,)]
+    assert storage.run_sync(lambda conn: conn.execute('SELECT COUNT(*) FROM stats_hourly').fetchone()) == (0,)
+    assert storage.run_sync(lambda conn: conn.execute('PRAGMA auto_vacuum').fetchone()) == (2,)
+
+    with gzip.open(archive_dir / 'command_stats-2020-01.jsonl.gz', 'rt', encoding='utf-8') as f:
+        january = [json.loads(line) for line in f]
+    assert len(january) == 28
+    assert january[0]['command'] == 'menu_faq'
+    assert january[0]['bot'] == 'main'
+    assert (archive_dir / 'command_stats-2020-02.jsonl.gz').exists()
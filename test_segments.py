@@ -0,0 +1,61 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import jobstore
+from segments import count_recipients, describe_segment, parse_segment, segment_sql
+
+TODAY = date(2024, 6, 10)
+
+
+def fill(conn):
+    conn.executemany('INSERT INTO users (user_id, first_seen) VALUES (?, ?)', [
+        (1, '2024-01-01 10:00:00'), (2, '2024-06-01 10:00:00'), (3, '2024-06-09 10:00:00'), (4, '2024-06-09 11:00:00'),
+    ])
+    conn.execute('UPDATE users SET active = 0 WHERE user_id = 4')
+    conn.executemany('INSERT INTO user_activity (user_id, date) VALUES (?, ?)', [
+        (1, '2024-05-01'), (2, '2024-06-08'), (3, '2024-06-10'), (4, '2024-06-10'),
+    ])
+    conn.executemany('INSERT INTO command_stats (user_id, command) VALUES (?, ?)', [
+        (1, 'menu_faq'), (3, 'menu_faq'), (2, 'menu_about'),
+    ])
+    # Пользователь 3 только что получил рассылку
+    job_id = jobstore.create_broadcast_job(conn, 'broadcast_users', 1, {'type': 'text', 'text': 'x'})
+    conn.execute("INSERT INTO broadcast_deliveries (job_id, chat_id, status) VALUES (?, 3, 'sent')", (job_id,))
+
+
+def test_parse_and_describe_segment():
+    segment = parse_segment("active=7 since=2024-05-01 command=menu_faq exclude=3")
+    assert segment == {'active': 7, 'since': '2024-05-01', 'command': 'menu_faq', 'exclude': 3}
+    assert describe_segment({}) == "все активные"
+    assert "нажимали menu_faq" in describe_segment(segment)
+    for bad in ("active=0", "since=вчера", "color=red", "active"):
+        with pytest.raises(ValueError):
+            parse_segment(bad)
+
+
+def test_segments_select_expected_users(db):
+    db.run_sync(fill)
+
+    def chat_ids(conn, segment):
+        sql, params = segment_sql('broadcast_users', segment, today=TODAY)
+        return [row[0] for row in conn.execute(f'SELECT chat_id FROM ({sql}) ORDER BY chat_id', params)]
+
+    assert db.run_sync(chat_ids, {}) == [1, 2, 3]
+    assert db.run_sync(chat_ids, {'active': 7}) == [2, 3]
+    assert db.run_sync(chat_ids, {'since': '2024-06-01'}) == [2, 3]
+    assert db.run_sync(chat_ids, {'command': 'menu_faq'}) == [1, 3]
+    assert db.run_sync(chat_ids, {'command': 'menu_faq', 'exclude': 3}) == [1]
+    assert db.run_sync(count_recipients, 'broadcast_users', {'command': 'menu_faq'}) == 2
+
+    # Снимок задачи берёт тот же сегмент порциями
+    async def snapshot():
+        sql, params = segment_sql('broadcast_users', {'active': 7}, today=TODAY)
+        job_id = await db.run(jobstore.create_broadcast_job, 'broadcast_users', 1, {}, {'active': 7})
+        await jobstore.snapshot_recipients(db, job_id, sql, params, chunk=1)
+        return job_id
+
+    job_id = asyncio.run(snapshot())
+    assert db.run_sync(jobstore.delivery_counts, job_id) == {'pending': 2}
+    assert db.run_sync(jobstore.unfinished_jobs)[-1][-1] == {'active': 7}
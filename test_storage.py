@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+
+def test_storage_runs_sql_off_the_loop_thread(storage):
+    async def scenario():
+        loop_thread = threading.get_ident()
+        await storage.execute('CREATE TABLE t (x INTEGER)')
+        await storage.executemany('INSERT INTO t (x) VALUES (?)', [(1,), (2,), (3,)])
+        rows = await storage.fetchall('SELECT x FROM t ORDER BY x')
+        worker_thread = await storage.run(lambda conn: threading.get_ident())
+        mode = await storage.fetchone('PRAGMA journal_mode')
+        return loop_thread, worker_thread, rows, mode
+
+    loop_thread, worker_thread, rows, mode = asyncio.run(scenario())
+    assert rows == [(1,), (2,), (3,)]
+    assert worker_thread != loop_thread
+    assert mode == ('wal',)
+
+
+def test_storage_rolls_back_failed_transaction(storage):
+    storage.run_sync(lambda conn: conn.execute('CREATE TABLE t (x INTEGER)'))
+
+    def insert_then_fail(conn):
+        conn.execute('INSERT INTO t (x) VALUES (1)')
+        raise RuntimeError('boom')
+
+    try:
+        storage.run_sync(insert_then_fail)
+    except RuntimeError:
+        pass
+    assert storage.run_sync(lambda conn: conn.execute('SELECT COUNT(*) FROM t').fetchone()) == (0,)
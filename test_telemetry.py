@@ -0,0 +1,35 @@
+import asyncio
+
+from telemetry import TelemetryBuffer
+
+
+def test_buffer_aggregates_and_flushes_on_stop(db):
+    async def scenario():
+        telemetry = TelemetryBuffer(db, flush_interval=60)
+        await telemetry.start()
+        for command in ('start', 'menu_about', 'main_menu'):
+            telemetry.record(1, command)
+        telemetry.record(2, 'menu_faq')
+        await telemetry.flush()
+        telemetry.record(1, 'stats_7')
+        # Событие, не попавшее в таймерный сброс, должно записаться при остановке
+        await telemetry.stop()
+
+    asyncio.run(scenario())
+    events = db.run_sync(lambda conn: conn.execute('SELECT COUNT(*) FROM command_stats').fetchone())
+    activity = db.run_sync(lambda conn: conn.execute(
+        'SELECT user_id, actions_count FROM user_activity ORDER BY user_id').fetchall())
+    assert events == (5,)
+    assert activity == [(1, 4), (2, 1)]
+
+
+def test_buffer_flushes_when_threshold_reached(db):
+    async def scenario():
+        telemetry = TelemetryBuffer(db, flush_interval=60, max_events=3)
+        for _ in range(3):
+            telemetry.record(1, 'menu_about')
+        await asyncio.sleep(0.1)
+        return telemetry.pending
+
+    assert asyncio.run(scenario()) == 0
+    assert db.run_sync(lambda conn: conn.execute('SELECT COUNT(*) FROM command_stats').fetchone()) == (3,)
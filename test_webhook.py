@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+from telegram import Bot, Update
+
+from webhook import WebhookServer
+
+RECORDED_UPDATE = {
+    'update_id': 100500,
+    'callback_query': {
+        'id': '1',
+        'chat_instance': '42',
+        'data': 'menu_faq',
+        'from': {'id': 7, 'is_bot': False, 'first_name': 'Partner'},
+    },
+}
+
+
+async def _post(port, body: bytes, headers: dict, path='/telegram'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n{head}\r\n".encode() + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+def test_webhook_accepts_recorded_update_with_secret():
+    bot = Bot('123:TEST')
+    received = []
+
+    async def handle_update(data):
+        received.append(Update.de_json(data, bot))
+
+    async def scenario():
+        server = WebhookServer(handle_update, host='127.0.0.1', port=0, secret_token='s3cret')
+        await server.start()
+        try:
+            body = json.dumps(RECORDED_UPDATE).encode()
+            ok = await _post(server.port, body, {'X-Telegram-Bot-Api-Secret-Token': 's3cret'})
+            forbidden = await _post(server.port, body, {'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+            not_found = await _post(server.port, body, {'X-Telegram-Bot-Api-Secret-Token': 's3cret'}, path='/other')
+            bad = await _post(server.port, b'{oops', {'X-Telegram-Bot-Api-Secret-Token': 's3cret'})
+        finally:
+            await server.stop()
+        return ok, forbidden, not_found, bad
+
+    assert asyncio.run(scenario()) == (200, 403, 404, 400)
+    assert len(received) == 1
+    assert received[0].callback_query.data == 'menu_faq'
+
+
+def test_webhook_drains_in_flight_request_on_stop():
+    state = {}
+
+    async def slow_handler(data):
+        state['started'].set()
+        await asyncio.sleep(0.2)
+        state['handled'] = True
+
+    async def scenario():
+        state['started'] = asyncio.Event()
+        server = WebhookServer(slow_handler, host='127.0.0.1', port=0, secret_token='s3cret')
+        await server.start()
+        request = asyncio.create_task(_post(server.port, b'{}', {'X-Telegram-Bot-Api-Secret-Token': 's3cret'}))
+        await state['started'].wait()
+        await server.stop()
+        return await request
+
+    assert asyncio.run(scenario()) == 200
+    assert state['handled']
+
+
+def test_webhook_routes_updates_by_path():
+    received = []
+
+    async def scenario():
+        server = WebhookServer(host='127.0.0.1', port=0)
+        for name in ('main', 'partner'):
+            async def handle_update(data, name=name):
+                received.append((name, data['update_id']))
+            server.add_route(f'/telegram/{name}', handle_update)
+        await server.start()
+        try:
+            secret = {'X-Telegram-Bot-Api-Secret-Token': server.secret_token}
+            statuses = [await _post(server.port, json.dumps({'update_id': n}).encode(), secret, path=path)
+                        for n, path in enumerate(('/telegram/partner', '/telegram/main', '/telegram'))]
+        finally:
+            await server.stop()
+        return statuses
+
+    assert asyncio.run(scenario()) == [200, 200, 404]
+    assert received == [('partner', 0), ('main', 1)]
+
+
+def test_webhook_without_configured_secret_rejects_unsigned_requests():
+    received = []
+
+    async def handle_update(data):
+        received.append(data)
+
+    async def scenario():
+        server = WebhookServer(handle_update, host='127.0.0.1', port=0)
+        await server.start()
+        try:
+            body = json.dumps(RECORDED_UPDATE).encode()
+            unsigned = await _post(server.port, body, {})
+            forged = await _post(server.port, body, {'X-Telegram-Bot-Api-Secret-Token': ''})
+            signed = await _post(server.port, body, {'X-Telegram-Bot-Api-Secret-Token': server.secret_token})
+        finally:
+            await server.stop()
+        return unsigned, forged, signed
+
+    assert asyncio.run(scenario()) == (403, 403, 200)
+    assert received == [RECORDED_UPDATE]
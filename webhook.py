@@ -0,0 +1,151 @@
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = '/telegram'
+DEFAULT_MAX_CONNECTIONS = 40
+MAX_BODY_SIZE = 1024 * 1024
+IDLE_TIMEOUT = 60.0
+DRAIN_TIMEOUT = 10.0
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+class WebhookServer:
+    # Минимальный HTTP/1.1-сервер на asyncio для приёма апдейтов от Telegram.
+    # handle_update(data) получает разобранный JSON апдейта; ответ 200 уходит сразу после него.
+    # Несколько ботов на одном порту — по обработчику на путь (add_route).
+    # Без секрета сервер принимал бы поддельные апдейты от любого, кто достучится до порта,
+    # поэтому если secret_token не задан, он генерируется; его нужно передать в set_webhook.
+
+    def __init__(self, handle_update=None, host: str = '0.0.0.0', port: int = 8443, path: str = DEFAULT_PATH,
+                 secret_token: str = None, max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        self.routes = {path: handle_update} if handle_update is not None else {}
+        self.host = host
+        self.port = port
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.max_connections = max_connections
+        self._server = None
+        self._connections = set()
+        self._idle = set()
+        self._closing = False
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        # При port=0 система выбирает свободный порт — удобно для тестов
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает {self.host}:{self.port} ({', '.join(self.routes)})")
+
+    def add_route(self, path: str, handle_update):
+        self.routes[path] = handle_update
+
+    async def stop(self, timeout: float = DRAIN_TIMEOUT):
+        # Новые соединения не принимаем, текущие запросы дорабатываем
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        # Соединения, ждущие следующего запроса keep-alive, закрываем сразу
+        for task in list(self._idle):
+            task.cancel()
+        if self._connections:
+            done, pending = await asyncio.wait(self._connections, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        if len(self._connections) >= self.max_connections or self._closing:
+            await self._respond(writer, 503, keep_alive=False)
+            writer.close()
+            return
+        self._connections.add(task)
+        try:
+            while not self._closing:
+                self._idle.add(task)
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, ConnectionError):
+                    break
+                finally:
+                    self._idle.discard(task)
+                if not request_line:
+                    break
+                try:
+                    keep_alive = await self._handle_request(request_line, reader, writer)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if not keep_alive:
+                    break
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _handle_request(self, request_line: bytes, reader, writer) -> bool:
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close' and not self._closing
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            await self._respond(writer, 400, keep_alive=False)
+            return False
+        if length > MAX_BODY_SIZE:
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b''
+
+        handle_update = self.routes.get(target.split('?', 1)[0])
+        if handle_update is None:
+            status = 404
+        elif method != 'POST':
+            status = 405
+        elif not hmac.compare_digest(
+                headers.get(SECRET_HEADER, '').encode(), self.secret_token.encode()):
+            status = 403
+        else:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                status = 400
+            else:
+                try:
+                    await handle_update(data)
+                    status = 200
+                except Exception as e:
+                    logger.error(f"Ошибка приёма апдейта: {e}")
+                    status = 500
+        await self._respond(writer, status, keep_alive=keep_alive)
+        return keep_alive
+
+    async def _respond(self, writer, status: int, keep_alive: bool):
+        connection = 'keep-alive' if keep_alive else 'close'
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Length: 0\r\nConnection: {connection}\r\n\r\n".encode('latin-1')
+        )
+        await writer.drain()